@@ -0,0 +1,128 @@
+"""
+Dependency graph of the runs in a FragPipe batch. A run depends on another if it links results from that run's
+output folder (skip_msfragger_path, set in the template or by automatic search reuse), or if it writes to the same
+output folder as an earlier run. Used by Fragpipe_Batch_Runner to order scripts and keep dependent runs on one
+node, and by Fragpipe_Local_Executor to run independent branches in parallel and start each run as soon as the
+runs it depends on have finished.
+"""
+import os
+
+
+class BatchGraph(object):
+    """
+    Directed acyclic graph of runs, by index in the batch (edges go from upstream to downstream run)
+    """
+    n_runs: int
+    upstream: list
+    downstream: list
+
+    def __init__(self, n_runs):
+        """
+        :param n_runs: number of runs in the batch
+        :type n_runs: int
+        """
+        self.n_runs = n_runs
+        self.upstream = [[] for _ in range(n_runs)]
+        self.downstream = [[] for _ in range(n_runs)]
+
+    def add_edge(self, upstream_index, downstream_index):
+        """
+        Record that a run must wait for another
+        :param upstream_index: run that must finish first
+        :type upstream_index: int
+        :param downstream_index: run that waits
+        :type downstream_index: int
+        :return: void
+        """
+        if upstream_index not in self.upstream[downstream_index]:
+            self.upstream[downstream_index].append(upstream_index)
+            self.downstream[upstream_index].append(downstream_index)
+
+    def topological_order(self):
+        """
+        Order runs so each comes after everything it depends on, otherwise keeping batch order (the lowest index
+        ready run is always taken next)
+        :return: ordered run indices, and indices that cannot be ordered (in or downstream of a cycle)
+        :rtype: tuple
+        """
+        waiting_on = [len(x) for x in self.upstream]
+        ready = [index for index in range(self.n_runs) if waiting_on[index] == 0]
+        order = []
+        while len(ready) > 0:
+            index = min(ready)
+            ready.remove(index)
+            order.append(index)
+            for downstream_index in self.downstream[index]:
+                waiting_on[downstream_index] -= 1
+                if waiting_on[downstream_index] == 0:
+                    ready.append(downstream_index)
+        ordered = set(order)
+        return order, [index for index in range(self.n_runs) if index not in ordered]
+
+    def all_downstream(self, index):
+        """
+        Get every run that depends on this run, directly or through other runs
+        :param index: run index
+        :type index: int
+        :return: set of run indices
+        :rtype: set
+        """
+        found = set()
+        to_check = list(self.downstream[index])
+        while len(to_check) > 0:
+            current = to_check.pop()
+            if current not in found:
+                found.add(current)
+                to_check.extend(self.downstream[current])
+        return found
+
+    def components(self):
+        """
+        Split into groups of runs connected by dependencies (in either direction), which must run on the same node
+        :return: list of groups (lists of run indices in topological order), in order of their first run
+        :rtype: list
+        """
+        order, unordered = self.topological_order()
+        position = {index: rank for rank, index in enumerate(order + unordered)}
+        group_of = [None] * self.n_runs
+        groups = []
+        for start in range(self.n_runs):
+            if group_of[start] is not None:
+                continue
+            group = []
+            to_visit = [start]
+            while len(to_visit) > 0:
+                current = to_visit.pop()
+                if group_of[current] is not None:
+                    continue
+                group_of[current] = len(groups)
+                group.append(current)
+                to_visit.extend(self.upstream[current] + self.downstream[current])
+            groups.append(sorted(group, key=lambda x: position[x]))
+        return groups
+
+
+def build_graph(output_paths, skip_paths):
+    """
+    Make the dependency graph from each run's output folder and the folder it links results from
+    :param output_paths: output folder of each run, in batch order
+    :type output_paths: list
+    :param skip_paths: folder each run links results from (None if it does its own search), same order
+    :type skip_paths: list
+    :return: graph
+    :rtype: BatchGraph
+    """
+    graph = BatchGraph(len(output_paths))
+    runs_by_output = {}
+    for index, output_path in enumerate(output_paths):
+        runs_by_output.setdefault(os.path.normpath(output_path), []).append(index)
+    for indices in runs_by_output.values():
+        # runs writing to the same folder run one after another, in batch order
+        for previous, current in zip(indices[:-1], indices[1:]):
+            graph.add_edge(previous, current)
+    for index, skip_path in enumerate(skip_paths):
+        if skip_path is not None:
+            for upstream_index in runs_by_output.get(os.path.normpath(skip_path), []):
+                if upstream_index != index:
+                    graph.add_edge(upstream_index, index)
+    return graph
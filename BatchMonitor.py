@@ -0,0 +1,318 @@
+"""
+Live progress of a FragPipe batch. Finds the runs of a batch from its script or job file (the FragPipe call of each
+run names its log file), follows each run's log_fragpipe_*.txt by reading only the bytes added since the last poll,
+and shows the stage each run is in with an ETA per run and for the batch from the historical stage timings
+(FragpipeTimings). Each poll only stats the logs and reads new lines, so it adds no noticeable load to the nodes
+or the file share. (Runs in a scratch workdir, see ScratchStaging, show as queued until synced back.)
+
+To Use:
+python BatchMonitor.py /path/to/fragpipe_batch.sh [more scripts or .json job files] [--interval 60] [--once]
+"""
+import argparse
+import datetime
+import os
+import re
+import time
+
+import FragpipeTimings
+import RunCost
+
+POLL_SECONDS = 60
+STALLED_MINUTES = 120           # a running log not written for this long is shown as stalled
+FRAGPIPE_CALL_PATTERN = re.compile(r'--workflow (\S+) --manifest (\S+) --workdir (\S+) .*\|& tee (\S+)')
+FINGERPRINT_CHECK_PATTERN = re.compile(r'if ! grep -qsx (\w+) (\S+); then')
+RUNNING = 'running'
+QUEUED = 'queued'
+DONE = 'done'
+FAILED = 'failed'
+STALLED = 'stalled'
+
+
+class LogTail(object):
+    """
+    Incremental reader of a growing log file: each read returns only the complete lines added since the last read
+    """
+    path: str
+    offset: int
+    partial: str
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.partial = ''
+
+    def read_new_lines(self):
+        """
+        Read the lines added since the last call (nothing is read if the file has not grown)
+        :return: list of lines (without line endings)
+        :rtype: list
+        """
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return []
+        if size < self.offset:
+            # log was replaced (run restarted): start over
+            self.offset = 0
+            self.partial = ''
+        if size == self.offset:
+            return []
+        with open(self.path, 'rb') as readfile:
+            readfile.seek(self.offset)
+            data = readfile.read(size - self.offset)
+        self.offset += len(data)
+        lines = (self.partial + data.decode(errors='replace')).split('\n')
+        self.partial = lines.pop()
+        return [x.rstrip('\r') for x in lines]
+
+
+class RunProgress(object):
+    """
+    Progress of one FragPipe run in the batch, updated from its log
+    """
+    name: str
+    workflow: str
+    manifest_path: str
+    log_path: str
+    fingerprint: str
+    fingerprint_path: str
+    raw_gb: float
+    tail: LogTail
+    stage_seconds: dict
+    done_seconds: float
+    current_stage: str
+    current_stage_start: float
+    failed: bool
+    finished: bool
+
+    def __init__(self, name, workflow_path, manifest_path, log_path, fingerprint=None, fingerprint_path=None):
+        self.name = name
+        self.workflow = os.path.basename(workflow_path)
+        self.manifest_path = manifest_path
+        self.log_path = log_path
+        self.fingerprint = fingerprint
+        self.fingerprint_path = fingerprint_path
+        self.raw_gb = None
+        self.tail = LogTail(log_path)
+        self.stage_seconds = {}
+        self.done_seconds = 0
+        self.current_stage = None
+        self.current_stage_start = None
+        self.failed = False
+        self.finished = False
+
+    def update(self):
+        """
+        Parse the lines added to the log since the last update (stage headers, stage times, exit codes). A stage
+        started when its header was read, or for a log already running when the monitor started, when the log
+        was last written (so time in the current stage is underestimated until the next stage)
+        :return: void
+        """
+        first_read = self.tail.offset == 0
+        read_time = os.path.getmtime(self.log_path) if first_read and os.path.exists(self.log_path) else time.time()
+        for line in self.tail.read_new_lines():
+            stage_match = FragpipeTimings.STAGE_PATTERN.match(line)
+            if stage_match:
+                self.current_stage = stage_match.group(1).strip()
+                self.stage_seconds.setdefault(self.current_stage, 0)
+                self.current_stage_start = read_time
+                continue
+            done_match = FragpipeTimings.DONE_IN_PATTERN.match(line)
+            if done_match and self.current_stage is not None:
+                self.stage_seconds[self.current_stage] += float(done_match.group(1))
+                self.done_seconds += float(done_match.group(1))
+                continue
+            process_match = FragpipeTimings.PROCESS_DONE_PATTERN.match(line)
+            if process_match and int(process_match.group(2)) != 0:
+                self.failed = True
+                continue
+            if FragpipeTimings.ALL_DONE_PATTERN.search(line):
+                self.finished = True
+
+    def status(self, now):
+        """
+        :param now: current time (epoch seconds)
+        :type now: float
+        :return: run status (RUNNING, QUEUED, DONE, FAILED or STALLED)
+        :rtype: str
+        """
+        if not os.path.exists(self.log_path):
+            if self.fingerprint is not None and self.fingerprint_path is not None and os.path.exists(self.fingerprint_path):
+                with open(self.fingerprint_path, 'r') as readfile:
+                    if readfile.read().strip() == self.fingerprint:
+                        return DONE         # skipped: already completed with the same inputs
+            return QUEUED
+        if self.finished:
+            return DONE
+        if self.failed:
+            return FAILED
+        if now - os.path.getmtime(self.log_path) > STALLED_MINUTES * 60:
+            return STALLED
+        return RUNNING
+
+    def get_raw_gb(self):
+        """
+        Raw data size of the run (read from the manifest once)
+        :return: GB (None if the raw files cannot be found from here)
+        :rtype: float
+        """
+        if self.raw_gb is None and self.manifest_path is not None and os.path.exists(self.manifest_path):
+            raw_bytes = FragpipeTimings.manifest_raw_bytes(self.manifest_path)
+            self.raw_gb = raw_bytes / 1024 ** 3 if raw_bytes is not None else None
+        return self.raw_gb
+
+    def remaining_seconds(self, stage_medians, now):
+        """
+        Predict the time left: the median time of each stage not yet run, and of the current stage less its
+        time so far. Without history for the workflow, the default whole-run rate less the elapsed time is used
+        :param stage_medians: dict of stage name: median seconds per GB raw for this run's workflow
+        :type stage_medians: dict
+        :param now: current time (epoch seconds)
+        :type now: float
+        :return: seconds (None if the raw data size is unknown)
+        :rtype: float
+        """
+        raw_gb = self.get_raw_gb()
+        if raw_gb is None:
+            return None
+        elapsed = self.done_seconds + (now - self.current_stage_start if self.current_stage_start is not None else 0)
+        if len(stage_medians) == 0:
+            return max(0, RunCost.RUN_OVERHEAD_S + raw_gb * RunCost.DEFAULT_SECONDS_PER_GB - elapsed)
+        remaining = 0
+        for stage_name, per_gb in stage_medians.items():
+            if stage_name == self.current_stage:
+                remaining += max(0, per_gb * raw_gb - (now - self.current_stage_start))
+            elif stage_name not in self.stage_seconds:
+                remaining += per_gb * raw_gb
+        return remaining
+
+
+def find_runs(batch_paths):
+    """
+    Find the FragPipe runs in batch scripts (.sh) or job files (.json) from their FragPipe calls
+    :param batch_paths: list of batch scripts and/or job files
+    :type batch_paths: list
+    :return: list of runs
+    :rtype: list[RunProgress]
+    """
+    runs = []
+    for batch_path in batch_paths:
+        if batch_path.endswith('.json'):
+            import Fragpipe_Local_Executor
+            lines = [line for job in Fragpipe_Local_Executor.read_batch_jobs(batch_path) for line in job.commands]
+        else:
+            with open(batch_path, 'r') as readfile:
+                lines = readfile.readlines()
+        fingerprint_check = None
+        for line in lines:
+            check_match = FINGERPRINT_CHECK_PATTERN.search(line)
+            if check_match:
+                fingerprint_check = check_match.groups()
+                continue
+            call_match = FRAGPIPE_CALL_PATTERN.search(line)
+            if call_match:
+                workflow_path, manifest_path, workdir, log_path = call_match.groups()
+                fingerprint, fingerprint_path = fingerprint_check if fingerprint_check is not None else (None, None)
+                runs.append(RunProgress(os.path.basename(workdir), workflow_path, manifest_path, log_path, fingerprint, fingerprint_path))
+                fingerprint_check = None
+    return runs
+
+
+def format_duration(seconds):
+    """
+    :param seconds: duration
+    :type seconds: float
+    :return: 'h:mm' ('?' if unknown)
+    :rtype: str
+    """
+    if seconds is None:
+        return '?'
+    minutes = int(seconds // 60)
+    return '{}:{:02d}'.format(minutes // 60, minutes % 60)
+
+
+def print_status(runs, medians_by_workflow, now):
+    """
+    Print one line per run (status, current stage, time in stage, time left) and the batch ETA. Queued runs share
+    the nodes with the running ones, so the batch time left is their total time over the number of runs going now
+    :param runs: list of runs
+    :type runs: list[RunProgress]
+    :param medians_by_workflow: dict of workflow name: stage medians
+    :type medians_by_workflow: dict
+    :param now: current time (epoch seconds)
+    :type now: float
+    :return: void
+    """
+    print('{}  {}'.format(datetime.datetime.fromtimestamp(now).strftime('%Y-%m-%d %H:%M'), 'FragPipe batch progress'))
+    print('{:<40}{:>9}  {:<24}{:>10}{:>10}'.format('run', 'status', 'stage', 'in stage', 'left'))
+    counts = {}
+    running_left = []
+    queued_left = []
+    unknown = 0
+    for run in runs:
+        status = run.status(now)
+        counts[status] = counts.get(status, 0) + 1
+        stage = run.current_stage if status in [RUNNING, STALLED, FAILED] and run.current_stage is not None else ''
+        in_stage = now - run.current_stage_start if stage != '' else None
+        left = run.remaining_seconds(medians_by_workflow[run.workflow], now) if status in [RUNNING, STALLED, QUEUED] else 0
+        if status in [RUNNING, STALLED, QUEUED]:
+            if left is None:
+                unknown += 1
+            elif status == QUEUED:
+                queued_left.append(left)
+            else:
+                running_left.append(left)
+        print('{:<40}{:>9}  {:<24}{:>10}{:>10}'.format(run.name[:39], status, stage[:23], format_duration(in_stage) if stage != '' else '',
+                                                      format_duration(left) if status != DONE and status != FAILED else ''))
+    n_running = max(1, counts.get(RUNNING, 0) + counts.get(STALLED, 0))
+    batch_left = max(max(running_left, default=0), (sum(running_left) + sum(queued_left)) / n_running)
+    print('{} runs: {}. Batch ETA {} (in {}){}'.format(
+        len(runs), ', '.join(['{} {}'.format(count, status) for status, count in sorted(counts.items())]),
+        datetime.datetime.fromtimestamp(now + batch_left).strftime('%Y-%m-%d %H:%M'), format_duration(batch_left),
+        ', not counting {} runs of unknown size'.format(unknown) if unknown > 0 else ''))
+
+
+def monitor(batch_paths, interval=POLL_SECONDS, once=False, timings_db=FragpipeTimings.DEFAULT_DB):
+    """
+    Show the progress of a batch, updating every interval until all runs are done or failed (or once)
+    :param batch_paths: list of batch scripts and/or job files
+    :type batch_paths: list
+    :param interval: seconds between updates
+    :type interval: float
+    :param once: print the status once and return
+    :type once: bool
+    :param timings_db: historical timings database (not used if it does not exist)
+    :type timings_db: str
+    :return: list of runs
+    :rtype: list[RunProgress]
+    """
+    runs = find_runs(batch_paths)
+    if len(runs) == 0:
+        print('ERROR: no FragPipe runs found in {}'.format(', '.join(batch_paths)))
+        return runs
+    # stage history is read once: it does not change while the batch runs
+    use_history = timings_db is not None and os.path.exists(timings_db)
+    medians_by_workflow = {}
+    for run in runs:
+        if run.workflow not in medians_by_workflow:
+            medians_by_workflow[run.workflow] = FragpipeTimings.workflow_stage_medians(run.workflow, RunCost.HISTORY_RUNS, timings_db) if use_history else {}
+    while True:
+        now = time.time()
+        for run in runs:
+            run.update()
+        if not once:
+            print('\033[2J\033[H', end='')      # clear the terminal
+        print_status(runs, medians_by_workflow, now)
+        if once or all([run.status(now) in [DONE, FAILED] for run in runs]):
+            return runs
+        time.sleep(interval)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Live progress and ETA of a FragPipe batch')
+    parser.add_argument('batch_paths', nargs='+', help='fragpipe_batch.sh script(s) and/or .json job file(s)')
+    parser.add_argument('--interval', type=float, default=POLL_SECONDS, help='seconds between updates')
+    parser.add_argument('--once', action='store_true', help='print the status once and exit')
+    parser.add_argument('--db', default=FragpipeTimings.DEFAULT_DB, help='timings database (FragpipeTimings)')
+    args = parser.parse_args()
+    monitor(args.batch_paths, args.interval, args.once, args.db)
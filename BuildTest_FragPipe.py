@@ -29,7 +29,7 @@ ADDITIONAL_WORKFLOWS_TEMPLATE = None
 # DISABLE_TOOLS = True
 DISABLE_TOOLS = False
 CLEAR_PREV_TEMP_FILES = False
-# CLEAR_PREV_TEMP_FILES = True    # clear .pepindex files between runs (using folders below)
+# CLEAR_PREV_TEMP_FILES = True    # clear .pepindex files between runs (using folders below). To share indexes between runs instead, see Fragpipe_Batch_Runner.USE_PEPINDEX_CACHE
 RAW_FOLDER = r"Z:\dpolasky\projects\_BuildTests\raw"
 DB_FOLDER = r"Z:\dpolasky\projects\_BuildTests\databases"
 
@@ -4,8 +4,6 @@ analysis by Philosopher. Creates a new folder for the Philosopher analysis, soft
 and generates a shell script to run philosopher
 """
 
-import tkinter
-from tkinter import filedialog
 import os
 import CombinePSMs
 
@@ -29,8 +27,10 @@ def link_file(input_file, current_activation, analysis_combined_dir):
     os.link(input_file, new_filepath)
 
 
-def main():
-    maindir = filedialog.askdirectory()
+def main(maindir=None):
+    if maindir is None:
+        from tkinter import filedialog
+        maindir = filedialog.askdirectory()
     results_folders = [os.path.join(maindir, x) for x in os.listdir(maindir)]
 
     # combine_dict = CombinePSMs.sort_by_combinetype(analysis_folders, ACTIVATION_TYPES, ignore_date=False)
@@ -85,6 +85,7 @@ def main():
 
 
 if __name__ == '__main__':
+    import tkinter
     root = tkinter.Tk()
     root.withdraw()
 
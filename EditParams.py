@@ -3,8 +3,6 @@ Module for editing parameter files by activation type - e.g. creating multiple p
 for various activation types
 """
 
-import tkinter
-from tkinter import filedialog
 import os
 
 
@@ -124,115 +122,146 @@ def edit_param_value(line, new_value):
     return '{}= {}\n'.format(splits[0], new_value)
 
 
-def create_param_file(base_param_file, output_dir, activation_type=None, enzyme=None, remove_localize_delta_mass=False):
+def edit_param_lines(base_lines, activation_type=None, enzyme=None, remove_localize_delta_mass=False):
     """
-    Create a new param file based on the base param file, edited for the provided activation type
-    :param base_param_file:
+    Edit the lines of a base param file for the provided activation type and enzyme (no file access, so many
+    variants can be made from one read of the base file)
+    :param base_lines: lines of the base param file
+    :type base_lines: list
     :param activation_type: optional
-    :param output_dir
     :param enzyme: optional
-    :return: void
+    :param remove_localize_delta_mass: disable localize_delta_mass for CID/HCD
+    :return: edited lines (None if the activation type or enzyme is not defined)
+    :rtype: list
     """
     # check activation types
     if activation_type is not None:
         if activation_type not in ['HCD', 'CID', 'AIETD', 'ETD', 'EThcD', 'AI-ETD']:
             print('ERROR: ACTIVATION TYPE {} NOT DEFINED'.format(activation_type))
-            return
+            return None
 
     if enzyme is not None:
         if enzyme not in ENZYME_DATA.keys():
             print('ERROR: ENZYME {} NOT DEFINED, must be in the enzyme data dict'.format(enzyme))
-            return
+            return None
 
     output_lines = []
-    with open(base_param_file, 'r') as infile:
-        for unchecked_line in list(infile):
-            # check/replace deprecated params
-            checked_lines = deprecated_param_check(unchecked_line, DEPRECATED_PARAMS, DEPRECATED_VALUES)
-            for line in checked_lines:
-                newline = None
-                if line.startswith('remove_precursor_peak'):
-                    if activation_type is not None:
-                        if activation_type in ['HCD', 'CID']:
-                            newline = edit_param_value(line, 1)
-                        else:
-                            newline = edit_param_value(line, 2)
-                elif line.startswith('fragment_ion_series'):
-                    if activation_type is not None:
-                        check_line = line.split('#')[0]     # ignore comments
-                        current_series = check_line.split('=')[1].strip().split(',')
+    for unchecked_line in base_lines:
+        # check/replace deprecated params
+        checked_lines = deprecated_param_check(unchecked_line, DEPRECATED_PARAMS, DEPRECATED_VALUES)
+        for line in checked_lines:
+            newline = None
+            if line.startswith('remove_precursor_peak'):
+                if activation_type is not None:
+                    if activation_type in ['HCD', 'CID']:
+                        newline = edit_param_value(line, 1)
+                    else:
+                        newline = edit_param_value(line, 2)
+            elif line.startswith('fragment_ion_series'):
+                if activation_type is not None:
+                    check_line = line.split('#')[0]     # ignore comments
+                    current_series = check_line.split('=')[1].strip().split(',')
+                    if activation_type in ['HCD', 'CID']:
+                        remove_ions = ['c', 'z']
+                    elif activation_type in ['ETD']:
+                        remove_ions = ['b', 'y', 'b~', 'y~', 'Y', 'b-18', 'y-18', 'a']
+                    elif activation_type in ['AIETD', 'EThcD', 'AI-ETD']:
+                        remove_ions = ['b~', 'y~']
+                    # removed improper ions then edit the line
+                    for remove_type in remove_ions:
+                        if remove_type in current_series:
+                            current_series.remove(remove_type)
+
+                    newline = edit_param_value(line, ','.join(current_series))
+
+            # elif line.startswith('diagnostic_fragments_filter'):
+            elif line.startswith('oxonium_intensity_filter'):
+                if activation_type is not None:
+                    # don't add filtering if it has been turned off
+                    check_line = line.split('#')[0]
+                    if float(check_line.strip().split('=')[1]) == 0:
+                        newline = line
+                    else:
                         if activation_type in ['HCD', 'CID']:
-                            remove_ions = ['c', 'z']
+                            newline = edit_param_value(line, 0.1)
+                        elif activation_type in ['EThcD', 'AIETD']:
+                            newline = line      # leave hybrid modes at value set in param file
                         elif activation_type in ['ETD']:
-                            remove_ions = ['b', 'y', 'b~', 'y~', 'Y', 'b-18', 'y-18', 'a']
-                        elif activation_type in ['AIETD', 'EThcD', 'AI-ETD']:
-                            remove_ions = ['b~', 'y~']
-                        # removed improper ions then edit the line
-                        for remove_type in remove_ions:
-                            if remove_type in current_series:
-                                current_series.remove(remove_type)
-
-                        newline = edit_param_value(line, ','.join(current_series))
-
-                # elif line.startswith('diagnostic_fragments_filter'):
-                elif line.startswith('oxonium_intensity_filter'):
-                    if activation_type is not None:
-                        # don't add filtering if it has been turned off
-                        check_line = line.split('#')[0]
-                        if float(check_line.strip().split('=')[1]) == 0:
-                            newline = line
+                            newline = edit_param_value(line, 0)
                         else:
-                            if activation_type in ['HCD', 'CID']:
-                                newline = edit_param_value(line, 0.1)
-                            elif activation_type in ['EThcD', 'AIETD']:
-                                newline = line      # leave hybrid modes at value set in param file
-                            elif activation_type in ['ETD']:
-                                newline = edit_param_value(line, 0)
-                            else:
-                                newline = edit_param_value(line, 0)
-                elif line.startswith('labile_mod_no_shifted_by_ions'):
+                            newline = edit_param_value(line, 0)
+            elif line.startswith('labile_mod_no_shifted_by_ions'):
+                if activation_type is not None:
+                    # disable labile mod removing b/y ions if in ETD mode, since b/y ions will not be included in the ion series
+                    if activation_type in ['ETD']:
+                        newline = edit_param_value(line, 0)
+                    else:
+                        # don't enable by default, as we don't always want to use this for HCD/etc searches. (Need to remember to set/unset as needed in base param file)
+                        newline = line
+            elif line.startswith('localize_delta_mass'):
+                if remove_localize_delta_mass:
+                    # disable shifted ions for CID/HCD glyco searches
                     if activation_type is not None:
-                        # disable labile mod removing b/y ions if in ETD mode, since b/y ions will not be included in the ion series
-                        if activation_type in ['ETD']:
+                        if activation_type in ['CID', 'HCD']:
                             newline = edit_param_value(line, 0)
-                        else:
-                            # don't enable by default, as we don't always want to use this for HCD/etc searches. (Need to remember to set/unset as needed in base param file)
-                            newline = line
-                elif line.startswith('localize_delta_mass'):
-                    if remove_localize_delta_mass:
-                        # disable shifted ions for CID/HCD glyco searches
-                        if activation_type is not None:
-                            if activation_type in ['CID', 'HCD']:
-                                newline = edit_param_value(line, 0)
-
-                # enzyme params
-                elif line.startswith('search_enzyme_name'):
-                    if enzyme is not None:
-                        newline = edit_param_value(line, ENZYME_DATA[enzyme][0])
-                elif line.startswith('search_enzyme_cutafter'):
-                    if enzyme is not None:
-                        newline = edit_param_value(line, ENZYME_DATA[enzyme][1])
-                elif line.startswith('search_enzyme_butnotafter'):
-                    if enzyme is not None:
-                        newline = edit_param_value(line, ENZYME_DATA[enzyme][2])
-                elif line.startswith('database_name'):
-                    if enzyme is not None:
-                        newline = 'database_name = ../{}\n'.format(line.split('=')[1].strip())
-                else:
-                    newline = line
-
-                if newline is None:
-                    newline = line
-                output_lines.append(newline)
 
-    # save updated params to new file with activation appended
+            # enzyme params
+            elif line.startswith('search_enzyme_name'):
+                if enzyme is not None:
+                    newline = edit_param_value(line, ENZYME_DATA[enzyme][0])
+            elif line.startswith('search_enzyme_cutafter'):
+                if enzyme is not None:
+                    newline = edit_param_value(line, ENZYME_DATA[enzyme][1])
+            elif line.startswith('search_enzyme_butnotafter'):
+                if enzyme is not None:
+                    newline = edit_param_value(line, ENZYME_DATA[enzyme][2])
+            elif line.startswith('database_name'):
+                if enzyme is not None:
+                    newline = 'database_name = ../{}\n'.format(line.split('=')[1].strip())
+            else:
+                newline = line
+
+            if newline is None:
+                newline = line
+            output_lines.append(newline)
+
+    return output_lines
+
+
+def get_param_file_path(base_param_file, output_dir, activation_type=None):
+    """
+    Path of the param file made from a base param file: base name with activation appended (if any) in output_dir
+    :param base_param_file: base param file path
+    :param output_dir: folder to save in
+    :param activation_type: optional
+    :return: path
+    :rtype: str
+    """
     if activation_type is not None:
         old_filename = os.path.splitext(os.path.basename(base_param_file))[0]
         new_filename = '{}_{}{}'.format(old_filename, activation_type, os.path.splitext(base_param_file)[1])
-        new_path = os.path.join(output_dir, new_filename)
-    else:
-        # save in folder
-        new_path = os.path.join(output_dir, os.path.basename(base_param_file))
+        return os.path.join(output_dir, new_filename)
+    # save in folder
+    return os.path.join(output_dir, os.path.basename(base_param_file))
+
+
+def create_param_file(base_param_file, output_dir, activation_type=None, enzyme=None, remove_localize_delta_mass=False):
+    """
+    Create a new param file based on the base param file, edited for the provided activation type
+    :param base_param_file:
+    :param activation_type: optional
+    :param output_dir
+    :param enzyme: optional
+    :return: void
+    """
+    with open(base_param_file, 'r') as infile:
+        base_lines = list(infile)
+    output_lines = edit_param_lines(base_lines, activation_type, enzyme, remove_localize_delta_mass)
+    if output_lines is None:
+        return
+
+    # save updated params to new file with activation appended
+    new_path = get_param_file_path(base_param_file, output_dir, activation_type)
     with open(new_path, 'w') as newfile:
         for line in output_lines:
             newfile.write(line)
@@ -271,6 +300,8 @@ def rename_enzyme_mzmls(enzyme_name, file_list):
 
 
 if __name__ == '__main__':
+    import tkinter
+    from tkinter import filedialog
     root = tkinter.Tk()
     root.withdraw()
 
@@ -5,8 +5,6 @@ Convenience script for combinging multiple nodes of a search into a single folde
 - edits and copies the final shell script into the results folder so it can be started immediately
 """
 
-import tkinter
-from tkinter import filedialog
 import os
 import shutil
 import PrepFraggerRuns
@@ -99,6 +97,8 @@ def create_multinode_folder(param_files):
 
 
 if __name__ == '__main__':
+    import tkinter
+    from tkinter import filedialog
     root = tkinter.Tk()
     root.withdraw()
 
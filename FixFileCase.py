@@ -4,8 +4,6 @@ in the IDE.
 """
 
 import os
-import tkinter
-from tkinter import messagebox
 
 EDIT_DIR = r"C:\Users\dpolasky\Repositories\msfragger\src\edu\umich\andykong\msfragger"
 # EDIT_DIR = r"C:\Users\dpolasky\IdeaProjects\msfragger\src\edu\umich\andykong\msfragger"
@@ -28,6 +26,7 @@ def single_folder(edit_dir):
         os.rename(file, new_filepath)
 
     # prompt user to click stuff in the IDE
+    from tkinter import messagebox
     messagebox.showinfo('Click the IDE!', 'Click on the files in the IDE, then close this prompt (files will be renamed back to originals')
 
     # fix the filenames (remove 'a' form the start)
@@ -59,6 +58,7 @@ def include_subdirs(edit_dir):
                     print('renaming: {}'.format(filename))
 
     # prompt user to click stuff in the IDE
+    from tkinter import messagebox
     messagebox.showinfo('Click the IDE!',
                         'Click on the files in the IDE, then close this prompt (files will be renamed back to originals')
 
@@ -85,6 +85,7 @@ def include_subdirs(edit_dir):
 
 
 if __name__ == '__main__':
+    import tkinter
     root = tkinter.Tk()
     root.withdraw()
 
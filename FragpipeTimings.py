@@ -0,0 +1,364 @@
+"""
+Per-stage timings from FragPipe logs. Parses the log_fragpipe_*.txt files left in each run output folder into
+stages (MSFragger, PeptideProphet, IonQuant, PTMShepherd, ...) with their run time and exit code, and stores them
+in a local SQLite database for historical queries. Ingesting a results tree again only re-reads logs that are new
+or have changed since the last ingest.
+
+To Use:
+python FragpipeTimings.py ingest /path/to/results [more folders] [--db timings.sqlite]
+python FragpipeTimings.py query --workflow my.workflow --stage MSFragger [--last 50]
+python FragpipeTimings.py report
+"""
+import argparse
+import datetime
+import os
+import re
+import sqlite3
+import statistics
+
+import PathTranslation
+
+DEFAULT_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fragpipe_timings.sqlite')
+LOG_PATTERN = re.compile(r'log_fragpipe_(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})\.txt$')
+STAGE_PATTERN = re.compile(r'^(.+?) \[Work dir: (.+)\]\s*$')
+PROCESS_DONE_PATTERN = re.compile(r"^Process '(.+)' finished, exit code: (-?\d+)")
+DONE_IN_PATTERN = re.compile(r'^Done in ([\d.]+) s\.')
+ALL_DONE_PATTERN = re.compile(r'ALL JOBS DONE IN ([\d.]+) MINUTES')
+FRAGPIPE_MANIFEST_NAME = 'fragpipe-files.fp-manifest'     # manifest FragPipe saves in the output folder
+FRAGPIPE_WORKFLOW_NAME = 'fragpipe.workflow'              # workflow FragPipe saves in the output folder
+RAW_BYTES_NAME = '.raw_bytes'       # raw input size saved in the output folder for runs with inputs staged to scratch
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS logs (
+    path TEXT PRIMARY KEY,
+    mtime REAL,
+    size INTEGER,
+    run_folder TEXT,
+    workflow TEXT,
+    started TEXT,
+    total_s REAL,
+    raw_bytes INTEGER
+);
+CREATE TABLE IF NOT EXISTS stages (
+    log_path TEXT,
+    stage_index INTEGER,
+    stage TEXT,
+    work_dir TEXT,
+    seconds REAL,
+    exit_code INTEGER
+);
+CREATE INDEX IF NOT EXISTS stages_by_log ON stages (log_path);
+CREATE INDEX IF NOT EXISTS logs_by_workflow ON logs (workflow, started);
+'''
+
+
+class Stage(object):
+    """
+    container for one stage (tool invocation header) in a FragPipe log
+    """
+    name: str
+    work_dir: str
+    seconds: float
+    exit_code: int
+
+    def __init__(self, name, work_dir):
+        self.name = name
+        self.work_dir = work_dir
+        self.seconds = None
+        self.exit_code = None
+
+
+def parse_log(log_path):
+    """
+    Read the stages of a FragPipe log. A stage starts at each 'Name [Work dir: ...]' header; its time is the sum of
+    the 'Done in N s.' lines and its exit code the worst 'Process ... finished' code before the next header
+    :param log_path: full path to log file
+    :type log_path: str
+    :return: list of stages, total run time in seconds (None if the run did not finish)
+    :rtype: tuple
+    """
+    stages = []
+    total_seconds = None
+    current = None
+    with open(log_path, 'r', errors='replace') as readfile:
+        for line in readfile:
+            line = line.rstrip('\r\n')
+            stage_match = STAGE_PATTERN.match(line)
+            if stage_match:
+                current = Stage(stage_match.group(1).strip(), stage_match.group(2))
+                stages.append(current)
+                continue
+            if current is not None:
+                done_match = DONE_IN_PATTERN.match(line)
+                if done_match:
+                    current.seconds = (current.seconds or 0) + float(done_match.group(1))
+                    continue
+                process_match = PROCESS_DONE_PATTERN.match(line)
+                if process_match:
+                    exit_code = int(process_match.group(2))
+                    if current.exit_code is None or current.exit_code == 0:
+                        current.exit_code = exit_code
+                    continue
+            all_done_match = ALL_DONE_PATTERN.search(line)
+            if all_done_match:
+                total_seconds = float(all_done_match.group(1)) * 60
+    return stages, total_seconds
+
+
+def get_workflow_name(run_folder):
+    """
+    Name of the workflow used for a run: the workflow copied in by the batch runner, if present, otherwise
+    the one saved by FragPipe
+    :param run_folder: run output folder
+    :type run_folder: str
+    :return: workflow file name (None if no workflow found)
+    :rtype: str
+    """
+    workflows = sorted([x for x in os.listdir(run_folder) if x.endswith('.workflow')])
+    named = [x for x in workflows if x != FRAGPIPE_WORKFLOW_NAME]
+    if len(named) > 0:
+        return named[0]
+    return workflows[0] if len(workflows) > 0 else None
+
+
+def get_raw_bytes(run_folder):
+    """
+    Total size of the raw files in the manifest FragPipe saved in the run output folder. If they cannot be found
+    (runs with inputs staged to scratch list the deleted scratch copies), the size saved by save_raw_bytes is used
+    :param run_folder: run output folder
+    :type run_folder: str
+    :return: bytes (None if no manifest or no raw files could be found)
+    :rtype: int
+    """
+    raw_bytes = None
+    manifest_path = os.path.join(run_folder, FRAGPIPE_MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        raw_bytes = manifest_raw_bytes(manifest_path)
+    saved_path = os.path.join(run_folder, RAW_BYTES_NAME)
+    if raw_bytes is None and os.path.exists(saved_path):
+        try:
+            with open(saved_path, 'r') as readfile:
+                raw_bytes = int(readfile.read().strip())
+        except ValueError:
+            pass
+    return raw_bytes
+
+
+def save_raw_bytes(run_folder, manifest_path):
+    """
+    Save the total size of the raw files in a manifest to the run output folder (see get_raw_bytes), for runs
+    whose inputs are read from copies that are deleted afterwards
+    :param run_folder: run output folder
+    :type run_folder: str
+    :param manifest_path: the run's original manifest
+    :type manifest_path: str
+    :return: void
+    """
+    raw_bytes = manifest_raw_bytes(manifest_path)
+    if raw_bytes is None:
+        return
+    os.makedirs(run_folder, exist_ok=True)
+    with open(os.path.join(run_folder, RAW_BYTES_NAME), 'w') as outfile:
+        outfile.write('{}\n'.format(raw_bytes))
+
+
+def manifest_raw_bytes(manifest_path):
+    """
+    Total size of the raw files in a manifest (only files that can be read from here, on either mount)
+    :param manifest_path: full path to manifest
+    :type manifest_path: str
+    :return: bytes (None if no raw files could be found)
+    :rtype: int
+    """
+    total = 0
+    found = False
+    with open(manifest_path, 'r') as readfile:
+        for line in readfile:
+            raw_path = line.split('\t')[0].strip()
+            if raw_path == '':
+                continue
+            for candidate in [raw_path, PathTranslation.to_linux(raw_path), PathTranslation.to_windows(raw_path)]:
+                if os.path.exists(candidate):
+                    total += os.path.getsize(candidate) if os.path.isfile(candidate) else sum(
+                        [os.path.getsize(os.path.join(dirpath, x)) for dirpath, _, files in os.walk(candidate) for x in files])
+                    found = True
+                    break
+    return total if found else None
+
+
+def connect(db_path=DEFAULT_DB):
+    """
+    Open (and create if needed) the timings database
+    :param db_path: full path to SQLite file
+    :type db_path: str
+    :return: connection
+    :rtype: sqlite3.Connection
+    """
+    connection = sqlite3.connect(db_path)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def find_logs(root_folder):
+    """
+    Find all FragPipe logs under a folder
+    :param root_folder: results folder to search
+    :type root_folder: str
+    :return: list of log paths
+    :rtype: list
+    """
+    log_paths = []
+    for dirpath, dirnames, filenames in os.walk(root_folder):
+        for filename in filenames:
+            if LOG_PATTERN.match(filename):
+                log_paths.append(os.path.join(dirpath, filename))
+    return log_paths
+
+
+def ingest(root_folders, db_path=DEFAULT_DB):
+    """
+    Add new or changed logs under the provided folders to the database. Unchanged logs (same size and
+    modified time as last ingest) are skipped without being read
+    :param root_folders: list of results folders
+    :type root_folders: list
+    :param db_path: full path to SQLite file
+    :type db_path: str
+    :return: number of logs (re)parsed
+    :rtype: int
+    """
+    connection = connect(db_path)
+    known = {row[0]: (row[1], row[2]) for row in connection.execute('SELECT path, mtime, size FROM logs')}
+    parsed = 0
+    for root_folder in root_folders:
+        for log_path in find_logs(root_folder):
+            stat = os.stat(log_path)
+            log_path = os.path.abspath(log_path)
+            if known.get(log_path) == (stat.st_mtime, stat.st_size):
+                continue
+            stages, total_seconds = parse_log(log_path)
+            run_folder = os.path.dirname(log_path)
+            started = datetime.datetime.strptime(LOG_PATTERN.search(log_path).group(1), '%Y-%m-%d_%H-%M-%S').isoformat()
+            connection.execute('DELETE FROM stages WHERE log_path = ?', (log_path,))
+            connection.execute('INSERT OR REPLACE INTO logs VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                               (log_path, stat.st_mtime, stat.st_size, run_folder, get_workflow_name(run_folder),
+                                started, total_seconds, get_raw_bytes(run_folder)))
+            connection.executemany('INSERT INTO stages VALUES (?, ?, ?, ?, ?, ?)',
+                                   [(log_path, index, stage.name, stage.work_dir, stage.seconds, stage.exit_code) for index, stage in enumerate(stages)])
+            parsed += 1
+    connection.commit()
+    connection.close()
+    print('parsed {} new or updated logs'.format(parsed))
+    return parsed
+
+
+def stage_seconds_per_gb(workflow, stage, last_n=50, db_path=DEFAULT_DB):
+    """
+    Time of a stage per GB of raw data for the most recent runs of a workflow (stage time summed over all its
+    invocations in a run, e.g. PeptideProphet per experiment). Only successful runs with known raw size count
+    :param workflow: workflow file name (as copied to the output folder)
+    :type workflow: str
+    :param stage: stage name as in the log header (e.g. 'MSFragger')
+    :type stage: str
+    :param last_n: number of most recent runs to use
+    :type last_n: int
+    :param db_path: full path to SQLite file
+    :type db_path: str
+    :return: list of seconds per GB, most recent first
+    :rtype: list
+    """
+    connection = connect(db_path)
+    rows = connection.execute('''
+        SELECT SUM(stages.seconds), logs.raw_bytes FROM logs JOIN stages ON stages.log_path = logs.path
+        WHERE logs.workflow = ? AND stages.stage = ? AND logs.raw_bytes > 0
+        GROUP BY logs.path
+        HAVING COUNT(stages.seconds) > 0 AND MAX(COALESCE(stages.exit_code, 0)) = 0
+        ORDER BY logs.started DESC LIMIT ?''', (workflow, stage, last_n)).fetchall()
+    connection.close()
+    return [seconds / (raw_bytes / 1024 ** 3) for seconds, raw_bytes in rows]
+
+
+def median_stage_seconds_per_gb(workflow, stage, last_n=50, db_path=DEFAULT_DB):
+    """
+    Median time of a stage per GB of raw data over the most recent runs of a workflow
+    :param workflow: workflow file name
+    :type workflow: str
+    :param stage: stage name as in the log header (e.g. 'MSFragger')
+    :type stage: str
+    :param last_n: number of most recent runs to use
+    :type last_n: int
+    :param db_path: full path to SQLite file
+    :type db_path: str
+    :return: median seconds per GB (None if no data)
+    :rtype: float
+    """
+    values = stage_seconds_per_gb(workflow, stage, last_n, db_path)
+    if len(values) == 0:
+        return None
+    return statistics.median(values)
+
+
+def workflow_stage_medians(workflow, last_n=50, db_path=DEFAULT_DB):
+    """
+    Median time per GB raw of every stage seen in the most recent runs of a workflow
+    :param workflow: workflow file name
+    :type workflow: str
+    :param last_n: number of most recent runs to use per stage
+    :type last_n: int
+    :param db_path: full path to SQLite file
+    :type db_path: str
+    :return: dict of stage name: median seconds per GB
+    :rtype: dict
+    """
+    connection = connect(db_path)
+    stage_names = [row[0] for row in connection.execute('''
+        SELECT DISTINCT stages.stage FROM logs JOIN stages ON stages.log_path = logs.path
+        WHERE logs.workflow = ?''', (workflow,))]
+    connection.close()
+    medians = {}
+    for stage_name in stage_names:
+        median = median_stage_seconds_per_gb(workflow, stage_name, last_n, db_path)
+        if median is not None:
+            medians[stage_name] = median
+    return medians
+
+
+def stage_totals(db_path=DEFAULT_DB):
+    """
+    Total hours spent in each stage over all ingested logs, largest first
+    :param db_path: full path to SQLite file
+    :type db_path: str
+    :return: list of (stage, hours, number of invocations)
+    :rtype: list
+    """
+    connection = connect(db_path)
+    rows = connection.execute('''
+        SELECT stage, SUM(seconds) / 3600.0, COUNT(*) FROM stages WHERE seconds IS NOT NULL
+        GROUP BY stage ORDER BY SUM(seconds) DESC''').fetchall()
+    connection.close()
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='FragPipe stage timings database')
+    parser.add_argument('--db', default=DEFAULT_DB, help='SQLite database file')
+    subparsers = parser.add_subparsers(dest='mode', required=True)
+    ingest_parser = subparsers.add_parser('ingest', help='add new/changed logs under results folders')
+    ingest_parser.add_argument('folders', nargs='+')
+    query_parser = subparsers.add_parser('query', help='median stage time per GB raw for a workflow')
+    query_parser.add_argument('--workflow', required=True, help='workflow file name')
+    query_parser.add_argument('--stage', default='MSFragger')
+    query_parser.add_argument('--last', type=int, default=50, help='number of most recent runs')
+    subparsers.add_parser('report', help='total hours per stage')
+    args = parser.parse_args()
+
+    if args.mode == 'ingest':
+        ingest(args.folders, args.db)
+    elif args.mode == 'query':
+        per_gb = stage_seconds_per_gb(args.workflow, args.stage, args.last, args.db)
+        if len(per_gb) == 0:
+            print('no timings for {} in {}'.format(args.stage, args.workflow))
+        else:
+            print('{} in {}: median {:.1f} s per GB raw over {} runs'.format(args.stage, args.workflow, statistics.median(per_gb), len(per_gb)))
+    else:
+        for stage_name, hours, count in stage_totals(args.db):
+            print('{:<40}{:>10.1f} h{:>8} invocations'.format(stage_name[:39], hours, count))
@@ -4,12 +4,25 @@ Uses windows filechooser to select template file, but could generalize instead
 """
 import pathlib
 import re
-import tkinter
-from tkinter import filedialog
 import os
 import shutil
 from enum import Enum
 import datetime
+import glob
+import hashlib
+import Fragpipe_Local_Executor
+import IncrementalRerun
+import WorkflowRewriter
+import PathTranslation
+import BatchGraph
+import PepindexCache
+import PrepPlan
+import RunCost
+import RunMarkers
+import RunTelemetry
+import ScratchStaging
+import SearchReuse
+import ToolsCache
 
 
 FRAGPIPE_PATH = r"\\corexfs.med.umich.edu\proteomics\dpolasky\tools\_FragPipes\a_current"
@@ -28,11 +41,32 @@ USE_LINUX = True
 DISABLE_TOOLS = False
 BATCH_INCREMENT = ''    # set to '2' (or higher) for multiple batches in same folder
 OUTPUT_FOLDER_APPEND = '__FraggerResults'
+RESUME_COMPLETED_RUNS = True     # skip runs whose output folder records a successful run with identical inputs (see FragpipeRun.make_fingerprint)
+COLLAPSE_DUPLICATE_RUNS = True  # run template rows with identical workflow, manifest, database and tools once, and link the results into the other rows' output folders
+INCREMENTAL_RERUN = False       # rerunning into an existing output folder: keep the results of stages whose parameters did not change (see IncrementalRerun)
+AUTO_REUSE_SEARCH = True        # link results from a previous run with the same MSFragger search instead of searching again (see SearchReuse)
+# outputs that must also exist for a completed run to be skipped, by workflow key that enables them
+EXPECTED_OUTPUTS = {
+    'phi-report.run-report': ['psm.tsv', '*/psm.tsv'],
+}
+USE_TELEMETRY = False           # wrap each FragPipe call with RunTelemetry to record wall time, peak RSS, CPU and I/O per run
+TELEMETRY_PYTHON = 'python3'
+TELEMETRY_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'RunTelemetry.py')
+ORDER_LONGEST_FIRST = True      # reorder runs by predicted run time, longest first (runs linked by skip_msfragger_path stay in order)
+PREP_THREADS = 16               # parallel filesystem operations when preparing run folders (network share latency)
+PREP_DRY_RUN = False            # only print the folders/files that would be prepared, do not write anything
+SHARD_NODES = 1                 # if > 1, split the batch into this many per-node scripts balanced by predicted run time (see RunCost)
+# RUN_LOCAL_EXECUTOR = True     # run the batch directly with Fragpipe_Local_Executor (packs runs by ram/threads) instead of only writing fragpipe_batch.sh
+RUN_LOCAL_EXECUTOR = False
+SCRATCH_PATH = None             # with the local executor: node-local folder to stage raw inputs to before each run (see ScratchStaging)
+SCRATCH_WORKDIR = False         # with SCRATCH_PATH: also run FragPipe in a scratch workdir, synced back to the output folder after each run
 
 DEFAULT_TOOLS_PATH = r"Z:\dpolasky\tools"
 # DEFAULT_TOOLS_PATH = r"Z:\dpolasky\tools\23.0_tools"
-TEMP_TOOLS_NAME = "temp_tools"
-TEMP_TOOLS_FOLDERS = []
+TEMP_TOOLS_NAME = "temp_tools"     # old per-run tools copies (replaced by tools cache), still cleaned up if found
+TOOLS_CACHE_NAME = "tools_cache"   # content-addressed tool sets for runs requesting specific versions (see ToolsCache)
+USE_PEPINDEX_CACHE = False          # point MSFragger runs at a shared FASTA copy per database + digest params, so the .pepindex is built once and reused (see PepindexCache)
+PEPINDEX_CACHE_NAME = "pepindex_cache"
 DIA_TRACER_PATH = r"Z:\dpolasky\tools\diaTracer-2.2.1.jar"      # not implemented to change versions of this, just needed for temp tools copying
 EXT_FOLDER = r"Z:\dpolasky\tools\ext"
 
@@ -41,6 +75,9 @@ EXT_FOLDER = r"Z:\dpolasky\tools\ext"
 # FILETYPES_FOR_COPY = ['pepXML', 'pin']
 # FILETYPES_FOR_COPY = ['.pep.xml', '.prot.xml', '_opair.txt']
 FILETYPES_FOR_COPY = ['.pep.xml', '.prot.xml']
+SPLIT_SEARCH_WAYS = 1           # if > 1, split the MSFragger search of each run over this many MSFragger-only runs of parts of its manifest (see FragpipeRun.split_search)
+SPLIT_FOLDER_APPEND = '__split'
+SPLIT_FILETYPES = ['.pepXML', '.pin']     # MSFragger outputs linked from the split searches (.pin only if the workflow writes it)
 
 
 class DisableTools(Enum):
@@ -119,25 +156,28 @@ class FragpipeRun(object):
     python_path: str
     skip_msfragger_path: str
     database_path: str
+    workflow_is_linux: bool
+    fingerprint: str
+    search_key: str
+    runs_msfragger: bool
+    pepindex_entry: str
+    run_key: str
+    duplicate_of: 'FragpipeRun'
+    incremental_tools: list
+    unchanged: bool
+    pending_workflow_path: str
+    split_runs: list
+    split_paths: list
+    split_filetypes: list
+    split_of: 'FragpipeRun'
+    plan: PrepPlan.PrepPlan
 
-    def __init__(self, fragpipe, workflow, manifest, output, ram, threads, msfragger, philosopher, ionquant, python=None, skip_MSFragger=None, database_path=None, disable_list=None):
-        if output == '':
-            # use base workflow name automatically if no specific output name specified
-            output_name = os.path.join(OUTPUT_FOLDER_APPEND, os.path.basename(os.path.splitext(workflow)[0]))
-        else:
-            output_name = output
-            # append specified output name to base workflow name
-            # output_name = os.path.join(OUTPUT_FOLDER_APPEND, os.path.basename(os.path.splitext(workflow)[0])) + "_" + output
-
+    def __init__(self, fragpipe, workflow, manifest, output, ram, threads, msfragger, philosopher, ionquant, python=None, skip_MSFragger=None, database_path=None, disable_list=None, search_index=None, plan=None, duplicate_index=None, split_ways=1):
         # update output_dir to full path (template has only the unique name, not the full path), and make dir if it doesn't exist
-        self.output_path = os.path.join(os.path.dirname(workflow), output_name)
-        if not os.path.exists(self.output_path):
-            os.makedirs(self.output_path)
+        self.output_path = get_output_path(workflow, output)
         self.original_output_path = self.output_path
-
-        # copy workflow file to output dir (for later reference)
-        self.workflow_path = os.path.join(self.output_path, os.path.basename(workflow))
-        shutil.copy(workflow, self.workflow_path)
+        self.plan = plan
+        self.prep('make output folder', os.makedirs, self.output_path, exist_ok=True)
 
         self.fragpipe_path = fragpipe
         self.manifest_path = manifest
@@ -151,9 +191,17 @@ class FragpipeRun(object):
         else:
             self.python_path = None
 
+        self.database_path = None
+        if database_path is not None:
+            if database_path != '':
+                self.database_path = database_path
+                if USE_LINUX:
+                    self.database_path = update_folder_linux(self.database_path)
+
+        disable_tools = []
         if skip_MSFragger is not None and skip_MSFragger != '':
             # disable the MSFragger run in this workflow and note the path to copy from for adding to the shell script
-            edit_workflow_disable_tools(self.workflow_path, DISABLE_IF_COPY)
+            disable_tools.extend(DISABLE_IF_COPY)
             if output == '':
                 # add fragger results folder append
                 if skip_MSFragger.endswith('.workflow') or skip_MSFragger.endswith('.workflow\n'):
@@ -169,13 +217,201 @@ class FragpipeRun(object):
             self.skip_msfragger_path = None
 
         if disable_list is not None:
-            edit_workflow_disable_tools(self.workflow_path, disable_list)
-        if database_path is not None:
-            if database_path != '':
-                self.database_path = database_path
-                if USE_LINUX:
-                    self.database_path = update_folder_linux(self.database_path)
-                self.edit_database()
+            disable_tools.extend(disable_list)
+        self.incremental_tools = []
+        self.unchanged = False
+        self.pending_workflow_path = None
+        if INCREMENTAL_RERUN and self.skip_msfragger_path is None:
+            self.find_incremental_rerun(workflow, disable_tools)
+        self.run_key = None
+        self.duplicate_of = None
+        self.fingerprint = None
+        if duplicate_index is not None:
+            self.run_key = duplicate_index.make_run_key(self, workflow, disable_tools)
+            self.duplicate_of = duplicate_index.find_or_add(self)
+        self.search_key = None
+        self.runs_msfragger = False
+        self.pepindex_entry = None
+        self.split_runs = []
+        self.split_paths = []
+        self.split_filetypes = []
+        self.split_of = None
+        if self.duplicate_of is None:
+            # (a duplicate only links the results of the identical run)
+            if search_index is not None:
+                self.find_search_reuse(workflow, search_index, disable_tools)
+            if split_ways > 1 and self.skip_msfragger_path is None:
+                self.split_search(workflow, split_ways, disable_tools, database_path)
+            if USE_PEPINDEX_CACHE:
+                self.use_pepindex_cache(workflow, search_index, disable_tools)
+        # copy workflow file to output dir (for later reference), applying all edits in a single pass
+        self.workflow_path = os.path.join(self.output_path, os.path.basename(workflow))
+        rewriter = WorkflowRewriter.WorkflowRewriter(disable_tools=[x.value for x in disable_tools],
+                                                     database_path=self.database_path,
+                                                     translate=update_folder_linux if USE_LINUX else None)
+        self.prep('write edited workflow {}'.format(self.workflow_path), rewriter.rewrite, workflow, self.workflow_path)
+        self.workflow_is_linux = USE_LINUX
+
+    def prep(self, description, function, *args, **kwargs):
+        """
+        Do a filesystem action needed to prepare this run: add it to the batch prep plan if there is one (run later
+        in parallel with other runs), otherwise do it now
+        :param description: readable description of the action
+        :type description: str
+        :param function: function to call
+        :type function: function
+        :return: void
+        :rtype:
+        """
+        if self.plan is not None:
+            self.plan.add(self.original_output_path, description, function, *args, **kwargs)
+        else:
+            function(*args, **kwargs)
+
+    def find_search_reuse(self, workflow, search_index, disable_tools):
+        """
+        Check for an existing (or planned) MSFragger search with the same search key. If found, link its results
+        instead of searching (sets skip_msfragger_path and disables the DISABLE_IF_COPY tools). If not, register
+        this run as doing the search. A search key left over from a different search in this output folder is removed.
+        :param workflow: full path to the original workflow
+        :type workflow: str
+        :param search_index: index of searches in this batch and on disk
+        :type search_index: SearchReuse.SearchIndex
+        :param disable_tools: list of tools to disable for this run (updated in place)
+        :type disable_tools: list
+        :return: void
+        :rtype:
+        """
+        workflow_params = search_index.get_workflow_params(workflow)
+        # tools kept from the previous run in the folder by an incremental rerun still have their outputs there
+        disabled = [x.value for x in disable_tools if x.value not in self.incremental_tools]
+        self.search_key = SearchReuse.make_search_key(workflow_params, self.manifest_path, self.database_path, disabled)
+        if self.skip_msfragger_path is None and workflow_params.get(SearchReuse.RUN_MSFRAGGER_KEY) == 'true' and DisableTools.MSFRAGGER not in disable_tools:
+            results_folders = [os.path.join(os.path.dirname(workflow), OUTPUT_FOLDER_APPEND), os.path.dirname(self.output_path)]
+            match = search_index.find(self.search_key, results_folders, exclude_folder=self.output_path)
+            if match is not None:
+                print('reusing MSFragger search from {} for {}'.format(match, self.output_path))
+                self.skip_msfragger_path = match
+                disable_tools.extend(DISABLE_IF_COPY)
+            else:
+                self.runs_msfragger = True
+                search_index.add(self.search_key, self.output_path)
+
+        previous_key = SearchReuse.read_search_key(self.output_path)
+        keeps_search = self.runs_msfragger or DisableTools.MSFRAGGER.value in self.incremental_tools
+        if not self.runs_msfragger and keeps_search and previous_key == self.search_key:
+            # incremental rerun keeping this folder's search
+            search_index.add(self.search_key, self.output_path)
+        if previous_key is not None and (not keeps_search or previous_key != self.search_key):
+            self.prep('remove old search key', os.remove, os.path.join(self.output_path, RunMarkers.SEARCH_KEY_NAME))
+
+    def find_incremental_rerun(self, workflow, disable_tools):
+        """
+        Compare the workflow requested for this run (with template edits, before automatic ones) to the one requested
+        for the last successful run in the output folder, and disable the stages whose results there can be kept (see
+        IncrementalRerun). The manifest and FragPipe/tool paths are compared too, and a run with nothing changed is
+        marked unchanged (not run again). The requested workflow is saved in the output folder as pending, and
+        replaces the previous one for the next comparison once the run succeeds (see make_run_commands).
+        :param workflow: full path to the original workflow
+        :type workflow: str
+        :param disable_tools: list of tools to disable for this run (updated in place)
+        :type disable_tools: list
+        :return: void
+        :rtype:
+        """
+        rewriter = WorkflowRewriter.WorkflowRewriter(disable_tools=[x.value for x in disable_tools],
+                                                     database_path=self.database_path,
+                                                     translate=update_folder_linux if USE_LINUX else None)
+        with open(workflow, 'r') as readfile:
+            requested_lines = rewriter.rewrite_lines(readfile)
+        new_params = WorkflowRewriter.parse_workflow_lines(requested_lines)
+        tool_paths = [self.fragpipe_path, self.msfragger_path, self.philosopher_path, self.ionquant_path, self.python_path]
+        if self.has_no_tool_paths():
+            tool_paths.append(DEFAULT_TOOLS_PATH)
+        input_params = IncrementalRerun.get_input_params(self.manifest_path, tool_paths)
+        new_params.update(input_params)
+        previous_path = os.path.join(self.output_path, RunMarkers.REQUESTED_WORKFLOW_NAME)
+        if not os.path.exists(previous_path):
+            # folder from a run before incremental reruns: its workflow copy (may include automatic edits), if the run
+            # completed and the copy has not been rewritten since (by preparing a batch that did not run)
+            previous_path = os.path.join(self.output_path, os.path.basename(workflow))
+            fingerprint_path = os.path.join(self.output_path, RunMarkers.FINGERPRINT_NAME)
+            if not os.path.exists(fingerprint_path) or (os.path.exists(previous_path) and os.path.getmtime(previous_path) > os.path.getmtime(fingerprint_path)):
+                previous_path = None
+        if previous_path is not None and os.path.exists(previous_path):
+            old_params = WorkflowRewriter.parse_workflow(previous_path)
+            reuse_tools, changes, rerun_needed = IncrementalRerun.find_reusable_stages(new_params, old_params, self.output_path)
+            reuse_tools = [x for x in reuse_tools if DisableTools(x) not in disable_tools]
+            self.unchanged = not rerun_needed
+            if self.unchanged:
+                print('incremental rerun of {}: nothing changed, keeping all results'.format(self.output_path))
+            elif len(reuse_tools) > 0:
+                print('incremental rerun of {}: keeping results of {} ({} changed parameters)'.format(self.output_path, ', '.join(reuse_tools), len(changes)))
+            if len(reuse_tools) > 0:
+                self.incremental_tools = reuse_tools
+                disable_tools.extend([DisableTools(x) for x in reuse_tools])
+        self.pending_workflow_path = os.path.join(self.output_path, IncrementalRerun.PENDING_WORKFLOW_NAME)
+        self.prep('save requested workflow {}'.format(self.pending_workflow_path), IncrementalRerun.save_requested_workflow, self.pending_workflow_path, requested_lines, input_params)
+
+    def split_search(self, workflow, split_ways, disable_tools, database_path):
+        """
+        Split the MSFragger search of this run over MSFragger-only runs of parts of its manifest (in
+        SPLIT_FOLDER_APPEND folders next to the output folder), balanced by raw file size. This run then links their
+        results and runs the rest of the workflow (validation, FDR, quant) on all files together
+        :param workflow: full path to the original workflow
+        :type workflow: str
+        :param split_ways: number of split searches
+        :type split_ways: int
+        :param disable_tools: list of tools to disable for this run (updated in place)
+        :type disable_tools: list
+        :param database_path: database override from the template
+        :type database_path: str
+        :return: void
+        :rtype:
+        """
+        workflow_params = WorkflowRewriter.parse_workflow(workflow)
+        if workflow_params.get(SearchReuse.RUN_MSFRAGGER_KEY) != 'true' or DisableTools.MSFRAGGER in disable_tools:
+            return
+        manifest_parts = split_manifest(self.manifest_path, split_ways)
+        if len(manifest_parts) < 2:
+            return
+        search_only = [x for x in DisableTools if x != DisableTools.MSFRAGGER]
+        for index, manifest_lines in enumerate(manifest_parts):
+            split_output = '{}{}{}'.format(self.original_output_path, SPLIT_FOLDER_APPEND, index + 1)
+            split_run = FragpipeRun(self.fragpipe_path, workflow, os.path.join(split_output, 'split.fp-manifest'), split_output, self.ram, self.threads,
+                                    self.msfragger_path, self.philosopher_path, self.ionquant_path, self.python_path,
+                                    database_path=database_path, disable_list=search_only, plan=self.plan)
+            split_run.split_of = self
+            split_run.prep('write manifest {}'.format(split_run.manifest_path), write_manifest, split_run.manifest_path, manifest_lines)
+            self.split_runs.append(split_run)
+            self.split_paths.append(split_output)
+        self.split_filetypes = [x for x in SPLIT_FILETYPES if x != '.pin' or 'pin' in workflow_params.get('msfragger.output_format', '').lower()]
+        disable_tools.append(DisableTools.MSFRAGGER)
+        print('splitting the MSFragger search of {} over {} runs'.format(self.output_path, len(self.split_runs)))
+
+    def use_pepindex_cache(self, workflow, search_index, disable_tools):
+        """
+        If this run searches with MSFragger, point it at the database copy in the pepindex cache entry for its
+        database and digest parameters (the entry is made with the other prep actions)
+        :param workflow: full path to the original workflow
+        :type workflow: str
+        :param search_index: index of searches (used for its parsed workflow cache), or None
+        :type search_index: SearchReuse.SearchIndex
+        :param disable_tools: list of tools disabled for this run
+        :type disable_tools: list
+        :return: void
+        :rtype:
+        """
+        workflow_params = search_index.get_workflow_params(workflow) if search_index is not None else WorkflowRewriter.parse_workflow(workflow)
+        if workflow_params.get(SearchReuse.RUN_MSFRAGGER_KEY) != 'true' or DisableTools.MSFRAGGER in disable_tools:
+            return
+        database_path = self.database_path if self.database_path is not None else workflow_params.get(WorkflowRewriter.DATABASE_KEY)
+        entry = PepindexCache.get_cache_entry(os.path.join(DEFAULT_TOOLS_PATH, PEPINDEX_CACHE_NAME), database_path, workflow_params)
+        if entry is None:
+            return
+        self.pepindex_entry, fasta_path, source = entry
+        self.prep('link database into pepindex cache {}'.format(self.pepindex_entry), PepindexCache.make_entry, self.pepindex_entry, fasta_path, source, workflow_params)
+        self.database_path = update_folder_linux(fasta_path) if USE_LINUX else fasta_path
 
     def update_linux(self):
         """
@@ -185,7 +421,9 @@ class FragpipeRun(object):
         """
         # update paths in specific files
         self.manifest_path = update_manifest_linux(self.manifest_path)
-        update_workflow_linux(self.workflow_path)
+        if not self.workflow_is_linux:
+            update_workflow_linux(self.workflow_path)
+            self.workflow_is_linux = True
 
         # update the paths themselves
         self.fragpipe_path = update_folder_linux(self.fragpipe_path)
@@ -204,25 +442,45 @@ class FragpipeRun(object):
         :return: void
         :rtype:
         """
-        output = []
-        found_db = False
-        index = 0
-        with open(self.workflow_path, 'r') as readfile:
-            for line in list(readfile):
-                if line.startswith('database.db-path'):
-                    newline = 'database.db-path={}\n'.format(self.database_path)
-                    found_db = True
-                elif line.startswith('crystalc') and not found_db:     # db-path is not in the file, would have been found already
-                    output.append('database.db-path={}\n'.format(self.database_path))
-                    newline = line
-                    found_db = True
-                else:
-                    newline = line
-                output.append(newline)
-                index += 1
-        with open(self.workflow_path, 'w') as outfile:
-            for line in output:
-                outfile.write(line)
+        WorkflowRewriter.WorkflowRewriter(database_path=self.database_path).rewrite(self.workflow_path)
+
+    def make_fingerprint(self, tools_path=None):
+        """
+        Hash everything that determines the results of this run: workflow (as edited for this run) and manifest
+        contents, database override, and FragPipe/tool versions. Must be called before update_linux.
+        :param tools_path: tools folder passed to FragPipe, if any (tools cache folders are named by content)
+        :type tools_path: str
+        :return: fingerprint (hex digest)
+        :rtype: str
+        """
+        hasher = hashlib.sha256()
+        for file_path in [self.workflow_path, self.manifest_path]:
+            with open(file_path, 'rb') as readfile:
+                hasher.update(readfile.read())
+        for value in [self.database_path, self.fragpipe_path, tools_path, self.msfragger_path, self.philosopher_path, self.ionquant_path, self.python_path]:
+            hasher.update('{}\n'.format(value).encode())
+        self.fingerprint = hasher.hexdigest()
+        return self.fingerprint
+
+    def is_complete(self):
+        """
+        Check if the output folder has a completion record matching this run's fingerprint and the expected
+        outputs of the enabled tools
+        :return: bool
+        :rtype: bool
+        """
+        marker_path = os.path.join(self.original_output_path, RunMarkers.FINGERPRINT_NAME)
+        if not os.path.exists(marker_path):
+            return False
+        with open(marker_path, 'r') as readfile:
+            if readfile.read().strip() != self.fingerprint:
+                return False
+        params = WorkflowRewriter.parse_workflow(os.path.join(self.original_output_path, os.path.basename(self.workflow_path)))
+        for key, patterns in EXPECTED_OUTPUTS.items():
+            if params.get(key) == 'true':
+                if not any(len(glob.glob(os.path.join(self.original_output_path, pattern))) > 0 for pattern in patterns):
+                    return False
+        return True
 
     def has_no_tool_paths(self):
         """
@@ -232,6 +490,113 @@ class FragpipeRun(object):
         return self.msfragger_path == '' and self.ionquant_path == '' and self.philosopher_path == ''
 
 
+class DuplicateIndex(object):
+    """
+    Index of the runs in a batch by run key (hash of everything that determines a run's results), to find rows
+    that would repeat an identical run under a different output name
+    """
+    runs: dict
+    digests: dict
+
+    def __init__(self):
+        self.runs = {}
+        self.digests = {}
+
+    def file_digest(self, file_path):
+        """
+        Hash a file's contents, once per batch
+        :param file_path: full path to file
+        :type file_path: str
+        :return: hex digest
+        :rtype: str
+        """
+        file_path = str(file_path)
+        if file_path not in self.digests:
+            with open(file_path, 'rb') as readfile:
+                self.digests[file_path] = hashlib.sha256(readfile.read()).hexdigest()
+        return self.digests[file_path]
+
+    def make_run_key(self, fragpipe_run, workflow, disable_tools):
+        """
+        Hash the effective inputs of a run: workflow and manifest contents, tools disabled, database, the folder it
+        links results from, and FragPipe/tool versions
+        :param fragpipe_run: run (with paths from the template)
+        :type fragpipe_run: FragpipeRun
+        :param workflow: full path to the original workflow
+        :type workflow: str
+        :param disable_tools: tools disabled for this run
+        :type disable_tools: list
+        :return: run key
+        :rtype: str
+        """
+        hasher = hashlib.sha256()
+        hasher.update(self.file_digest(workflow).encode())
+        hasher.update(self.file_digest(fragpipe_run.manifest_path).encode())
+        values = [sorted(set([x.value for x in disable_tools])), fragpipe_run.database_path, fragpipe_run.skip_msfragger_path, fragpipe_run.fragpipe_path,
+                  fragpipe_run.msfragger_path, fragpipe_run.philosopher_path, fragpipe_run.ionquant_path, fragpipe_run.python_path]
+        for value in values:
+            hasher.update('{}\n'.format(value).encode())
+        return hasher.hexdigest()
+
+    def find_or_add(self, fragpipe_run):
+        """
+        Get the earlier identical run, or register this run as the first with its key
+        :param fragpipe_run: run with run_key set
+        :type fragpipe_run: FragpipeRun
+        :return: earlier run with the same key, or None
+        :rtype: FragpipeRun
+        """
+        if fragpipe_run.run_key in self.runs:
+            return self.runs[fragpipe_run.run_key]
+        self.runs[fragpipe_run.run_key] = fragpipe_run
+        return None
+
+
+def split_manifest(manifest_path, n_parts):
+    """
+    Split the rows of a manifest into parts of about equal raw data size (largest files first, each to the part
+    with the least data so far)
+    :param manifest_path: full path to manifest
+    :type manifest_path: str
+    :param n_parts: number of parts
+    :type n_parts: int
+    :return: list of parts (lists of manifest lines), no more parts than files
+    :rtype: list
+    """
+    with open(manifest_path, 'r') as readfile:
+        lines = [line if line.endswith('\n') else line + '\n' for line in readfile if line.strip() != '']
+    sized_lines = []
+    for line in lines:
+        raw_path = line.split('\t')[0].strip()
+        size = 0
+        for candidate in [raw_path, PathTranslation.to_linux(raw_path), PathTranslation.to_windows(raw_path)]:
+            if os.path.exists(candidate):
+                size = ScratchStaging.input_size(candidate)
+                break
+        sized_lines.append((size, line))
+    sized_lines.sort(key=lambda x: x[0], reverse=True)
+
+    parts = [[] for _ in range(min(n_parts, len(lines)))]
+    part_sizes = [0] * len(parts)
+    for size, line in sized_lines:
+        index = min(range(len(parts)), key=lambda x: (part_sizes[x], len(parts[x])))
+        parts[index].append(line)
+        part_sizes[index] += size
+    return parts
+
+
+def write_manifest(manifest_path, lines):
+    """
+    :param manifest_path: full path to manifest to write
+    :type manifest_path: str
+    :param lines: manifest lines
+    :type lines: list
+    :return: void
+    """
+    with open(manifest_path, 'w', newline='') as outfile:
+        outfile.writelines(lines)
+
+
 def update_manifest_linux(manifest_path):
     """
     update the manifest file to linux paths and save a copy, return the updated path to use as new manifest path
@@ -240,17 +605,9 @@ def update_manifest_linux(manifest_path):
     :return: updated path
     :rtype: str
     """
-    output = []
-    with open(manifest_path, 'r') as readfile:
-        for line in list(readfile):
-            newline = update_folder_linux(line)
-            output.append(newline)
     pathsplits = os.path.splitext(manifest_path)
     newpath = pathsplits[0] + '_linux' + pathsplits[1]
-    with open(newpath, 'w', newline='') as outfile:
-        for line in output:
-            outfile.write(line)
-    return newpath
+    return PathTranslation.translate_file(manifest_path, newpath, linux=True)
 
 
 def update_manifest_windows(manifest_path):
@@ -260,14 +617,7 @@ def update_manifest_windows(manifest_path):
     :type manifest_path: str
     :return:
     """
-    output = []
-    with open(manifest_path, 'r') as readfile:
-        for line in list(readfile):
-            newline = update_folder_windows(line)
-            output.append(newline)
-    with open(manifest_path, 'w') as outfile:
-        for line in output:
-            outfile.write(line)
+    PathTranslation.translate_file(manifest_path, linux=False)
 
 
 def edit_workflow_disable_tools(workflow_path, disable_list):
@@ -280,19 +630,7 @@ def edit_workflow_disable_tools(workflow_path, disable_list):
     :return: void
     :rtype:
     """
-    output = []
-    with open(workflow_path, 'r') as readfile:
-        for line in list(readfile):
-            newline = line
-            for tool_name in disable_list:
-                if 'run-{}'.format(tool_name.value) in line:
-                    # change to false
-                    splits = line.split('=')
-                    newline = splits[0] + '=false\n'
-            output.append(newline)
-    with open(workflow_path, 'w') as outfile:
-        for line in output:
-            outfile.write(line)
+    WorkflowRewriter.WorkflowRewriter(disable_tools=[x.value for x in disable_list]).rewrite(workflow_path)
 
 
 def update_workflow_linux(workflow_path):
@@ -303,147 +641,457 @@ def update_workflow_linux(workflow_path):
     :return: void
     :rtype:
     """
-    output = []
-    # read to edit database path
-    with open(workflow_path, 'r') as readfile:
-        for line in list(readfile):
-            if line.startswith('database.db-path'):
-                newline = update_folder_linux(line)
-            elif line.startswith('ptmshepherd.glycodatabase'):
-                newline = update_folder_linux(line)
-            elif line.startswith('ptmshepherd.opair.glyco_db') or line.startswith('opair.glyco_db'):
-                newline = update_folder_linux(line)
-            elif line.startswith('opair.oxonium_filtering_file'):
-                newline = update_folder_linux(line)
-            elif line.startswith('msfragger.mass_offset_file'):
-                newline = update_folder_linux(line)
-            elif line.startswith('mbg.glycan_db'):
-                newline = update_folder_linux(line)
-            else:
-                newline = line
-            output.append(newline)
+    WorkflowRewriter.WorkflowRewriter(translate=update_folder_linux).rewrite(workflow_path)
 
-    # save output back to same path
-    with open(workflow_path, 'w') as outfile:
-        for line in output:
-            outfile.write(line)
+
+def get_output_path(workflow, output):
+    """
+    Get the full output folder path of a template row
+    :param workflow: full path to the workflow
+    :type workflow: str
+    :param output: output name from the template (empty to use the workflow name)
+    :type output: str
+    :return: full path
+    :rtype: str
+    """
+    if output == '':
+        # use base workflow name automatically if no specific output name specified
+        output_name = os.path.join(OUTPUT_FOLDER_APPEND, os.path.basename(os.path.splitext(workflow)[0]))
+    else:
+        output_name = output
+        # append specified output name to base workflow name
+        # output_name = os.path.join(OUTPUT_FOLDER_APPEND, os.path.basename(os.path.splitext(workflow)[0])) + "_" + output
+    return os.path.join(os.path.dirname(workflow), output_name)
 
 
-def parse_template(template_file, disable_list, fragpipe_path):
+def parse_template(template_file, disable_list, fragpipe_path, dry_run=False):
     """
-    read the template into a list of FragpipeRun containers
+    read the template into a list of FragpipeRun containers. Output folders and workflow copies for all runs are
+    then made together on a thread pool (see PrepPlan); runs that fail to prepare (and runs linking results from
+    them) are dropped from the batch with an error message
     :param template_file: full path to template file to read
     :type template_file: str
     :param disable_list: list of tool names to disable (specified in Enum)
     :type disable_list: list
+    :param dry_run: if True, only print the filesystem actions that would be done (nothing is written)
+    :type dry_run: bool
     :return: list of FragpipeRun containers
     :rtype: list[FragpipeRun]
     """
     runs = []
+    plan = PrepPlan.PrepPlan()
+    if USE_PEPINDEX_CACHE and not dry_run:
+        # before this batch's entries are marked as used, so they are not evicted
+        PepindexCache.evict_pepindex_cache(os.path.join(DEFAULT_TOOLS_PATH, PEPINDEX_CACHE_NAME))
+    search_index = SearchReuse.SearchIndex(FILETYPES_FOR_COPY) if AUTO_REUSE_SEARCH else None
+    duplicate_index = DuplicateIndex() if COLLAPSE_DUPLICATE_RUNS else None
     with open(template_file, 'r') as readfile:
+        rows = []
         for line in list(readfile):
             if line.startswith('#'):
                 continue
             splits = [x for x in line.split(',') if x != '\n']
             splits[-1] = splits[-1].rstrip('\n')
             splits.insert(0, fragpipe_path)
-            this_run = FragpipeRun(*splits, disable_list=disable_list)
+            rows.append(splits)
+        if search_index is not None:
+            # searches in folders this batch writes to are only reused once their run is planned
+            search_index.add_batch_folders([get_output_path(x[1], x[3]) for x in rows])
+        for splits in rows:
+            this_run = FragpipeRun(*splits, disable_list=disable_list, search_index=search_index, plan=plan, duplicate_index=duplicate_index, split_ways=SPLIT_SEARCH_WAYS)
+            if this_run.duplicate_of is not None:
+                if os.path.normpath(this_run.duplicate_of.original_output_path) == os.path.normpath(this_run.original_output_path):
+                    print('Warning: {} is listed more than once with identical settings, running it once'.format(this_run.original_output_path))
+                    continue
+                print('{} is identical to {}: running once and linking the results'.format(this_run.original_output_path, this_run.duplicate_of.original_output_path))
+            runs.extend(this_run.split_runs)
             runs.append(this_run)
-    return runs
+
+    if dry_run:
+        plan.describe()
+        return runs
+    failed = plan.execute(PREP_THREADS)
+    failed_outputs = set([os.path.normpath(x) for x in failed.keys()])
+    prepared_runs = []
+    for fragpipe_run in runs:
+        fragpipe_run.plan = None
+        if os.path.normpath(fragpipe_run.original_output_path) in failed_outputs:
+            continue
+        upstream_paths = [fragpipe_run.duplicate_of.original_output_path if fragpipe_run.duplicate_of is not None else fragpipe_run.skip_msfragger_path] + fragpipe_run.split_paths
+        if any([x is not None and os.path.normpath(x) in failed_outputs for x in upstream_paths]):
+            print('ERROR: not running {}: the run it links results from failed to prepare'.format(fragpipe_run.original_output_path))
+            failed_outputs.add(os.path.normpath(fragpipe_run.original_output_path))
+            continue
+        prepared_runs.append(fragpipe_run)
+    return prepared_runs
+
+
+def make_run_graph(run_list):
+    """
+    Get the dependency graph of a list of runs: runs linking results from another run's output folder
+    (skip_msfragger_path, duplicate_of or split searches) and runs sharing an output folder wait for the other run
+    (see BatchGraph)
+    :param run_list: list of runs
+    :type run_list: list[FragpipeRun]
+    :return: graph (nodes are indices in run_list)
+    :rtype: BatchGraph.BatchGraph
+    """
+    # a duplicate run links the results of the run it duplicates
+    upstream_paths = [x.duplicate_of.original_output_path if x.duplicate_of is not None else x.skip_msfragger_path for x in run_list]
+    graph = BatchGraph.build_graph([x.original_output_path for x in run_list], upstream_paths)
+    indices_by_output = {}
+    for index, fragpipe_run in enumerate(run_list):
+        indices_by_output.setdefault(os.path.normpath(fragpipe_run.original_output_path), []).append(index)
+    for index, fragpipe_run in enumerate(run_list):
+        for split_path in fragpipe_run.split_paths:
+            for upstream_index in indices_by_output.get(os.path.normpath(split_path), []):
+                graph.add_edge(upstream_index, index)
+    return graph
+
+
+def order_dependencies(run_list):
+    """
+    Put each run after the runs it depends on (otherwise keeping template order), so the serial script does not rely
+    on template line order. Runs in a dependency cycle (and runs depending on them) are dropped with an error
+    :param run_list: list of runs
+    :type run_list: list[FragpipeRun]
+    :return: ordered runs
+    :rtype: list[FragpipeRun]
+    """
+    order, unordered = make_run_graph(run_list).topological_order()
+    for index in unordered:
+        print('ERROR: not running {}: it is part of (or depends on) a circular chain of linked runs'.format(run_list[index].original_output_path))
+    return [run_list[x] for x in order]
+
+
+def group_dependent_runs(run_list):
+    """
+    Group runs that must run on the same node: runs connected by dependencies (see make_run_graph), including
+    chains of links
+    :param run_list: list of runs
+    :type run_list: list[FragpipeRun]
+    :return: list of groups (lists of run indices, in dependency order)
+    :rtype: list
+    """
+    return make_run_graph(run_list).components()
 
 
-def make_commands_linux(run_list, output_path, fragpipe_uses_tools_folder, write_output=True, is_first_run=True):
+def shard_runs(run_list, n_shards, costs):
     """
-    Format commands and write to linux shell script from the provided run list
+    Split runs into n_shards lists with balanced total predicted cost, keeping dependent runs together. Groups
+    are assigned largest first to the least loaded shard; runs keep their input order within each shard
+    :param run_list: list of runs
+    :type run_list: list[FragpipeRun]
+    :param n_shards: number of shards (nodes)
+    :type n_shards: int
+    :param costs: predicted cost of each run (same order as run_list)
+    :type costs: list
+    :return: list of shards (lists of runs), list of predicted total cost per shard
+    :rtype: tuple
+    """
+    groups = group_dependent_runs(run_list)
+    groups.sort(key=lambda group: sum([costs[x] for x in group]), reverse=True)
+    shard_indices = [[] for _ in range(n_shards)]
+    shard_costs = [0] * n_shards
+    for group in groups:
+        shard = shard_costs.index(min(shard_costs))
+        shard_indices[shard].extend(group)
+        shard_costs[shard] += sum([costs[x] for x in group])
+    shards = [[run_list[x] for x in sorted(indices)] for indices in shard_indices]
+    return shards, shard_costs
+
+
+def order_longest_first(run_list, costs):
+    """
+    Reorder runs so the longest predicted work starts first. Dependent runs (see group_dependent_runs) move as a
+    group, ranked by the group's total cost, and keep their template order within the group
+    :param run_list: list of runs
+    :type run_list: list[FragpipeRun]
+    :param costs: predicted cost of each run (same order as run_list)
+    :type costs: list
+    :return: reordered runs, reordered costs
+    :rtype: tuple
+    """
+    groups = group_dependent_runs(run_list)
+    groups.sort(key=lambda group: sum([costs[x] for x in group]), reverse=True)
+    order = [index for group in groups for index in group]
+    return [run_list[x] for x in order], [costs[x] for x in order]
+
+
+def make_sharded_commands_linux(run_list, output_path, fragpipe_uses_tools_folder, n_shards, costs):
+    """
+    Write one linux shell script (and job file) per node, with runs balanced by predicted run time
+    :param run_list: list of runs
+    :type run_list: list[FragpipeRun]
+    :param output_path: full path to save output files
+    :type output_path: str
+    :param fragpipe_uses_tools_folder: if True, pass tools folder instead of individual tool paths
+    :type fragpipe_uses_tools_folder: bool
+    :param n_shards: number of nodes to split the batch over
+    :type n_shards: int
+    :param costs: predicted cost of each run (same order as run_list)
+    :type costs: list
+    :return: list of job file paths written (one per non-empty shard)
+    :rtype: list
+    """
+    shards, shard_costs = shard_runs(run_list, n_shards, costs)
+    jobs_paths = []
+    for index, shard in enumerate(shards):
+        if len(shard) == 0:
+            continue
+        batch_name = 'fragpipe_batch{}_node{}'.format(BATCH_INCREMENT, index + 1)
+        print('{}: {} runs, predicted {:.1f} h'.format(batch_name, len(shard), shard_costs[index] / 3600))
+        make_commands_linux(shard, output_path, fragpipe_uses_tools_folder, batch_name=batch_name)
+        jobs_paths.append(os.path.join(output_path, '{}.json'.format(batch_name)))
+    return jobs_paths
+
+
+def make_commands_linux(run_list, output_path, fragpipe_uses_tools_folder, write_output=True, is_first_run=True, batch_name=None):
+    """
+    Format commands and write to linux shell script from the provided run list. Also writes the same commands
+    grouped per run (with declared ram/threads and the runs each one waits for) to a .json job file for the local
+    executor
     :param run_list: list of runs
     :type run_list: list[FragpipeRun]
     :param output_path: full path to save output file
     :type output_path: str
+    :param batch_name: name of the output script/job file (without extension). Default fragpipe_batch[BATCH_INCREMENT]
+    :type batch_name: str
     :return: void
     :rtype:
     """
-    batch_path = os.path.join(output_path, 'fragpipe_batch{}.sh'.format(BATCH_INCREMENT))
+    if batch_name is None:
+        batch_name = 'fragpipe_batch{}'.format(BATCH_INCREMENT)
+    batch_path = os.path.join(output_path, '{}.sh'.format(batch_name))
+    jobs_path = os.path.join(output_path, '{}.json'.format(batch_name))
     output = []
+    jobs = []
     if is_first_run:
         output.append('#!/bin/bash\nset -xe\n\n')   # bash header
         if fragpipe_uses_tools_folder:
             delete_old_temp_tools()
+            ToolsCache.evict_tools_cache(os.path.join(DEFAULT_TOOLS_PATH, TOOLS_CACHE_NAME))
 
-    for fragpipe_run in run_list:
-        # copy original format manifest file to output dir before updating paths [disabled after 18.1 update fixes manifest copying]
-        # shutil.copy(fragpipe_run.manifest_path, os.path.join(fragpipe_run.output_path, os.path.basename(fragpipe_run.manifest_path)))
+    graph = make_run_graph(run_list)
+    job_names = {}
+    for index, fragpipe_run in enumerate(run_list):
+        run_lines = make_run_commands(fragpipe_run, fragpipe_uses_tools_folder)
+        if len(run_lines) == 0:
+            continue
+        output.extend(run_lines)
+        job_name = os.path.basename(fragpipe_run.output_path)
+        if job_name in job_names.values():
+            job_name = '{}_{}'.format(job_name, index + 1)
+        job_names[index] = job_name
+        jobs.append(Fragpipe_Local_Executor.BatchJob(name=job_name,
+                                                     output_path=fragpipe_run.output_path,
+                                                     ram=fragpipe_run.ram,
+                                                     threads=fragpipe_run.threads,
+                                                     commands=run_lines,
+                                                     manifest_path=fragpipe_run.manifest_path,
+                                                     fingerprint=fragpipe_run.fingerprint,
+                                                     skip_msfragger_path=update_folder_linux(fragpipe_run.skip_msfragger_path) if fragpipe_run.skip_msfragger_path is not None else None))
+    for index, job in zip(job_names.keys(), jobs):
+        # upstream runs already complete (no job) are not waited for
+        job.depends_on = [job_names[x] for x in graph.upstream[index] if x in job_names]
 
-        current_time = datetime.datetime.now()
-        log_path = '{}/log_fragpipe_{}.txt'.format(update_folder_linux(fragpipe_run.output_path), current_time.strftime("%Y-%m-%d_%H-%M-%S"))
-        if fragpipe_run.skip_msfragger_path is not None:
-            for filetype_str in FILETYPES_FOR_COPY:
-                # link necessary file types from the copied analysis. Check if the needed files exist (from a previous attempt at the run) and write commands to link if not
-                if not any(file.endswith(filetype_str) for file in os.listdir(fragpipe_run.original_output_path)):
-                    output.append('ln -s {}/*{} {}\n'.format(update_folder_linux(fragpipe_run.skip_msfragger_path), filetype_str, update_folder_linux(fragpipe_run.output_path)))
+    if write_output:
+        if USE_TELEMETRY:
+            output.append('{} {} summary {}\n'.format(TELEMETRY_PYTHON, update_folder_linux(TELEMETRY_SCRIPT), update_folder_linux(jobs_path)))
+        with open(batch_path, 'w', newline='') as outfile:
+            for line in output:
+                outfile.write(line)
+        Fragpipe_Local_Executor.write_batch_jobs(jobs, jobs_path)
 
-        python_arg = ''
-        if len(fragpipe_run.python_path) > 0:
-            python_arg = ' --config-python {}'.format(update_folder_linux(fragpipe_run.python_path))
-        if fragpipe_uses_tools_folder:
-            arg_list = []
-            if fragpipe_run.has_no_tool_paths():
-                # no special versions desired - use the default tools folder for pathing
-                tools_path = DEFAULT_TOOLS_PATH
-            else:
-                # special versions requested. Copy them to a new subfolder and pass that
-                temp_tools_name = "{}_{}".format(TEMP_TOOLS_NAME, len(TEMP_TOOLS_FOLDERS) + 1)
-                temp_tools_path = pathlib.Path(DEFAULT_TOOLS_PATH) / temp_tools_name
-                os.makedirs(temp_tools_path)
-                TEMP_TOOLS_FOLDERS.append(temp_tools_path)
-                tools_path = str(temp_tools_path)
-                shutil.copy(fragpipe_run.msfragger_path, temp_tools_path / os.path.basename(fragpipe_run.msfragger_path))
-                shutil.copy(fragpipe_run.ionquant_path, temp_tools_path / os.path.basename(fragpipe_run.ionquant_path))
-                shutil.copy(DIA_TRACER_PATH, temp_tools_path / os.path.basename(DIA_TRACER_PATH))
+    return output
+
+
+def make_run_commands(fragpipe_run, fragpipe_uses_tools_folder):
+    """
+    Format the shell commands for a single run (linking copied results, then the FragPipe call). Updates the run
+    to linux paths. The commands only run if the run's completion fingerprint is not already recorded in its
+    output folder, and record it when FragPipe succeeds, so a crashed batch can simply be rerun. If FragPipe fails,
+    the commands exit with its exit code.
+    :param fragpipe_run: run to format
+    :type fragpipe_run: FragpipeRun
+    :param fragpipe_uses_tools_folder: if True, pass tools folder instead of individual tool paths
+    :type fragpipe_uses_tools_folder: bool
+    :return: list of command lines (empty if the run is already complete)
+    :rtype: list
+    """
+    if fragpipe_run.duplicate_of is not None and fragpipe_run.duplicate_of.fingerprint is not None:
+        return make_duplicate_commands(fragpipe_run)
+    output = []
+    # copy original format manifest file to output dir before updating paths [disabled after 18.1 update fixes manifest copying]
+    # shutil.copy(fragpipe_run.manifest_path, os.path.join(fragpipe_run.output_path, os.path.basename(fragpipe_run.manifest_path)))
+
+    tools_path = None
+    if fragpipe_uses_tools_folder:
+        if fragpipe_run.has_no_tool_paths():
+            # no special versions desired - use the default tools folder for pathing
+            tools_path = DEFAULT_TOOLS_PATH
+        else:
+            # special versions requested. Use the (shared) tool set with these versions from the tools cache
+            ext_folder = None
+            if '-raw' in fragpipe_run.workflow_path or '_raw' in fragpipe_run.workflow_path:
                 # add ext folder for raw file runs
-                if '-raw' in fragpipe_run.workflow_path or '_raw' in fragpipe_run.workflow_path:
-                    shutil.copytree(EXT_FOLDER, temp_tools_path / 'ext')
+                ext_folder = EXT_FOLDER
+            tools_path = ToolsCache.get_tools_folder(os.path.join(DEFAULT_TOOLS_PATH, TOOLS_CACHE_NAME),
+                                                     [fragpipe_run.msfragger_path, fragpipe_run.ionquant_path, DIA_TRACER_PATH],
+                                                     ext_folder)
 
-            fragpipe_run.update_linux()
-            arg_list = [fragpipe_run.fragpipe_path,
-                        fragpipe_run.workflow_path,
-                        fragpipe_run.manifest_path,
-                        fragpipe_run.output_path,
-                        fragpipe_run.ram,
-                        fragpipe_run.threads,
-                        update_folder_linux(tools_path),
-                        python_arg,
-                        log_path
-                        ]
-            output.append('{} --headless --workflow {} --manifest {} --workdir {} --ram {} --threads {} --config-tools-folder {}{} |& tee {}\n'.format(*arg_list))
+    fingerprint = fragpipe_run.make_fingerprint(tools_path)
+    if RESUME_COMPLETED_RUNS and fragpipe_run.is_complete():
+        print('skipping {}: already completed with the same inputs'.format(fragpipe_run.original_output_path))
+        return output
+    fingerprint_path = '{}/{}'.format(update_folder_linux(fragpipe_run.output_path), RunMarkers.FINGERPRINT_NAME)
+    output.append('if ! grep -qsx {} {}; then\n'.format(fingerprint, fingerprint_path))
+    if fragpipe_run.unchanged:
+        # results in the folder are from the last successful run with the same request: when the batch runs, record
+        # them as complete instead of running FragPipe with every stage disabled
+        print('not running {}: nothing changed since the last successful run in this folder'.format(fragpipe_run.original_output_path))
+        fragpipe_run.ram = '1'
+        fragpipe_run.threads = '1'
+        fragpipe_run.manifest_path = None
+        fragpipe_run.output_path = update_folder_linux(fragpipe_run.output_path)
+        output.append('echo {} > {}\n'.format(fingerprint, fingerprint_path))
+        output.append('fi\n')
+        return output
+
+    current_time = datetime.datetime.now()
+    log_path = '{}/log_fragpipe_{}.txt'.format(update_folder_linux(fragpipe_run.output_path), current_time.strftime("%Y-%m-%d_%H-%M-%S"))
+    if fragpipe_run.skip_msfragger_path is not None:
+        for filetype_str in FILETYPES_FOR_COPY:
+            # link necessary file types from the copied analysis. Check if the needed files exist (from a previous attempt at the run) and write commands to link if not
+            if not any(file.endswith(filetype_str) for file in os.listdir(fragpipe_run.original_output_path)):
+                output.append('ln -s {}/*{} {}\n'.format(update_folder_linux(fragpipe_run.skip_msfragger_path), filetype_str, update_folder_linux(fragpipe_run.output_path)))
+    if len(fragpipe_run.split_runs) > 0:
+        # link the MSFragger results of all split searches, once they have all completed
+        split_checks = ['grep -qsx {} {}/{}'.format(x.fingerprint, update_folder_linux(x.output_path), RunMarkers.FINGERPRINT_NAME) for x in fragpipe_run.split_runs]
+        output.append('if ! ({}); then echo "ERROR: split searches of {} did not complete"; exit 1; fi\n'.format(' && '.join(split_checks), update_folder_linux(fragpipe_run.output_path)))
+        for split_path in fragpipe_run.split_paths:
+            for filetype_str in fragpipe_run.split_filetypes:
+                output.append('ln -sf {}/*{} {}\n'.format(update_folder_linux(split_path), filetype_str, update_folder_linux(fragpipe_run.output_path)))
+
+    if fragpipe_run.pepindex_entry is not None:
+        # mark the shared peptide index as in use, and wait for (or take the lock to build) it
+        pepindex_before, pepindex_success, pepindex_after = PepindexCache.lock_commands(update_folder_linux(fragpipe_run.pepindex_entry))
+        output.append(pepindex_before)
+
+    python_arg = ''
+    if len(fragpipe_run.python_path) > 0:
+        python_arg = ' --config-python {}'.format(update_folder_linux(fragpipe_run.python_path))
+    if fragpipe_uses_tools_folder:
+        fragpipe_run.update_linux()
+        arg_list = [telemetry_prefix(fragpipe_run) + fragpipe_run.fragpipe_path,
+                    fragpipe_run.workflow_path,
+                    fragpipe_run.manifest_path,
+                    fragpipe_run.output_path,
+                    fragpipe_run.ram,
+                    fragpipe_run.threads,
+                    update_folder_linux(tools_path),
+                    python_arg,
+                    log_path
+                    ]
+        output.append('{} --headless --workflow {} --manifest {} --workdir {} --ram {} --threads {} --config-tools-folder {}{} |& tee {}\n'.format(*arg_list))
+    else:
+        fragpipe_run.update_linux()
+        # old style FragPipe (before 21.2-build41)
+        arg_list = [telemetry_prefix(fragpipe_run) + fragpipe_run.fragpipe_path,
+                    fragpipe_run.workflow_path,
+                    fragpipe_run.manifest_path,
+                    fragpipe_run.output_path,
+                    fragpipe_run.ram,
+                    fragpipe_run.threads,
+                    fragpipe_run.msfragger_path,
+                    fragpipe_run.philosopher_path,
+                    fragpipe_run.ionquant_path,
+                    ]
+        if len(fragpipe_run.python_path) > 0:
+            arg_list.append(fragpipe_run.python_path)
+            arg_list.append(log_path)
+            output.append('{} --headless --workflow {} --manifest {} --workdir {} --ram {} --threads {} --config-msfragger {} --config-philosopher {} --config-ionquant {} --config-python {} |& tee {}\n'.format(*arg_list))
         else:
-            fragpipe_run.update_linux()
-            # old style FragPipe (before 21.2-build41)
-            arg_list = [fragpipe_run.fragpipe_path,
-                        fragpipe_run.workflow_path,
-                        fragpipe_run.manifest_path,
-                        fragpipe_run.output_path,
-                        fragpipe_run.ram,
-                        fragpipe_run.threads,
-                        fragpipe_run.msfragger_path,
-                        fragpipe_run.philosopher_path,
-                        fragpipe_run.ionquant_path,
-                        ]
-            if len(fragpipe_run.python_path) > 0:
-                arg_list.append(fragpipe_run.python_path)
-                arg_list.append(log_path)
-                output.append('{} --headless --workflow {} --manifest {} --workdir {} --ram {} --threads {} --config-msfragger {} --config-philosopher {} --config-ionquant {} --config-python {} |& tee {}\n'.format(*arg_list))
-            else:
-                arg_list.append(log_path)
-                output.append('{} --headless --workflow {} --manifest {} --workdir {} --ram {} --threads {} --config-msfragger {} --config-philosopher {} --config-ionquant {} |& tee {}\n'.format(*arg_list))
+            arg_list.append(log_path)
+            output.append('{} --headless --workflow {} --manifest {} --workdir {} --ram {} --threads {} --config-msfragger {} --config-philosopher {} --config-ionquant {} |& tee {}\n'.format(*arg_list))
+    # record completion (FragPipe exit code, not tee's) so reruns of this batch skip this run
+    success_lines = ['echo {} > {}'.format(fingerprint, fingerprint_path)]
+    if fragpipe_run.pending_workflow_path is not None:
+        # save the requested workflow for the next incremental rerun, now that its results are in the folder
+        success_lines.insert(0, 'mv -f {}/{} {}/{}'.format(update_folder_linux(fragpipe_run.output_path), IncrementalRerun.PENDING_WORKFLOW_NAME,
+                                                          update_folder_linux(fragpipe_run.output_path), RunMarkers.REQUESTED_WORKFLOW_NAME))
+    if fragpipe_run.runs_msfragger:
+        # mark this folder as a completed search for automatic reuse by later runs
+        success_lines.append('echo {} > {}/{}'.format(fragpipe_run.search_key, update_folder_linux(fragpipe_run.output_path), RunMarkers.SEARCH_KEY_NAME))
+    if fragpipe_run.pepindex_entry is not None:
+        success_lines.append(pepindex_success)
+    output.append('fragpipeStatus=${PIPESTATUS[0]}\n')
+    output.append('if [ $fragpipeStatus -eq 0 ]; then {}; fi\n'.format('; '.join(success_lines)))
+    if fragpipe_run.pepindex_entry is not None:
+        output.append(pepindex_after)
+    # fail the job (and the batch script, which runs with set -e) so runs linking these results do not start
+    output.append('if [ $fragpipeStatus -ne 0 ]; then echo "ERROR: FragPipe failed (exit code $fragpipeStatus) for {}"; exit $fragpipeStatus; fi\n'.format(fragpipe_run.output_path))
+    output.append('fi\n')
+    return output
 
-    if write_output:
-        with open(batch_path, 'w', newline='') as outfile:
-            for line in output:
-                outfile.write(line)
 
+def make_duplicate_commands(fragpipe_run):
+    """
+    Format the shell commands for a run identical to an earlier run in the batch (see DuplicateIndex): once the
+    earlier run has completed, link its results into this run's output folder (symlinks, existing files are kept).
+    If the earlier run has not completed, the commands exit with an error. The earlier run's commands must be made
+    first (sets its fingerprint)
+    :param fragpipe_run: duplicate run
+    :type fragpipe_run: FragpipeRun
+    :return: list of command lines (empty if the results are already linked)
+    :rtype: list
+    """
+    fragpipe_run.fingerprint = fragpipe_run.duplicate_of.fingerprint
+    if RESUME_COMPLETED_RUNS and fragpipe_run.is_complete():
+        print('skipping {}: already completed with the same inputs'.format(fragpipe_run.original_output_path))
+        return []
+    # only linking files: the job needs almost no resources, and does not read the raw inputs (not staged to scratch)
+    fragpipe_run.ram = '1'
+    fragpipe_run.threads = '1'
+    fragpipe_run.manifest_path = None
+    fragpipe_run.output_path = update_folder_linux(fragpipe_run.output_path)
+    source_path = update_folder_linux(fragpipe_run.duplicate_of.original_output_path)
+    output = ['if ! grep -qsx {} {}/{}; then\n'.format(fragpipe_run.fingerprint, fragpipe_run.output_path, RunMarkers.FINGERPRINT_NAME),
+              'if grep -qsx {} {}/{}; then cp -rsn {}/. {}/; else echo "ERROR: {} has not completed, not linking its results to {}"; exit 1; fi\n'.format(
+                  fragpipe_run.fingerprint, source_path, RunMarkers.FINGERPRINT_NAME, source_path, fragpipe_run.output_path, source_path, fragpipe_run.output_path),
+              'fi\n']
     return output
 
 
+def print_duplicate_savings(run_list, costs):
+    """
+    Print the predicted compute saved by running duplicate runs once
+    :param run_list: list of runs
+    :type run_list: list[FragpipeRun]
+    :param costs: predicted seconds of each run (same order)
+    :type costs: list
+    :return: void
+    """
+    cost_by_run = {id(fragpipe_run): cost for fragpipe_run, cost in zip(run_list, costs)}
+    duplicates = [x for x in run_list if x.duplicate_of is not None]
+    if len(duplicates) > 0:
+        saved = sum([cost_by_run.get(id(x.duplicate_of), 0) for x in duplicates])
+        print('{} duplicate runs linked to identical runs instead of running: saves a predicted {:.1f} h'.format(len(duplicates), saved / 3600))
+
+
+def telemetry_prefix(fragpipe_run):
+    """
+    Get the RunTelemetry wrapper to put in front of the FragPipe command, if telemetry is on
+    :param fragpipe_run: run (already updated to linux paths)
+    :type fragpipe_run: FragpipeRun
+    :return: wrapper command start (empty string if telemetry is off)
+    :rtype: str
+    """
+    if not USE_TELEMETRY:
+        return ''
+    return '{} {} run --output {} -- '.format(TELEMETRY_PYTHON, update_folder_linux(TELEMETRY_SCRIPT), fragpipe_run.output_path)
+
+
 def make_commands_windows(run_list, fragpipe_path, output_path):
     """
     NOT USED - test first
@@ -487,10 +1135,29 @@ def main(template_file, fragpipe_path, write_to_linux, disable_list):
     :return: void
     :rtype:
     """
-    run_list = parse_template(template_file, disable_list, fragpipe_path)
+    run_list = parse_template(template_file, disable_list, fragpipe_path, dry_run=PREP_DRY_RUN)
+    if PREP_DRY_RUN:
+        return
+    run_list = order_dependencies(run_list)
     output_dir = os.path.dirname(template_file)
     if write_to_linux:
-        make_commands_linux(run_list, output_dir, NEW_FRAGPIPE)
+        # predict run times before paths are updated to linux (raw files and databases are read from here)
+        costs = RunCost.estimate_costs(run_list)
+        if ORDER_LONGEST_FIRST:
+            run_list, costs = order_longest_first(run_list, costs)
+        RunCost.print_costs(run_list, costs)
+        print_duplicate_savings(run_list, costs)
+        if SHARD_NODES > 1:
+            jobs_paths = make_sharded_commands_linux(run_list, output_dir, NEW_FRAGPIPE, SHARD_NODES, costs)
+            if RUN_LOCAL_EXECUTOR:
+                Fragpipe_Local_Executor.run_shards(jobs_paths, scratch_path=SCRATCH_PATH, scratch_workdir=SCRATCH_WORKDIR)
+        else:
+            make_commands_linux(run_list, output_dir, NEW_FRAGPIPE)
+            jobs_paths = [os.path.join(output_dir, 'fragpipe_batch{}.json'.format(BATCH_INCREMENT))]
+            if RUN_LOCAL_EXECUTOR:
+                Fragpipe_Local_Executor.main(jobs_paths[0], scratch_path=SCRATCH_PATH, scratch_workdir=SCRATCH_WORKDIR)
+        if RUN_LOCAL_EXECUTOR and USE_TELEMETRY:
+            RunTelemetry.summarize(jobs_paths)
     else:
         make_commands_windows(run_list, fragpipe_path, output_dir)
 
@@ -501,32 +1168,7 @@ def update_folder_linux(folder_name):
     :param folder_name: path to update
     :return: updated path
     """
-    # folder_name = folder_name.replace('\\\\', '\\')
-    if '//corexfs' in folder_name:
-        linux_name = folder_name.replace('//corexfs.med.umich.edu/proteomics', '/storage')
-        linux_name = linux_name.replace('\\', '/')
-    elif '\\corexfs' in folder_name:
-        folder_name = folder_name.replace('\\', '/')
-        while '//' in folder_name:
-            folder_name = folder_name.replace('//', '/')
-        linux_name = folder_name.replace('/corexfs.med.umich.edu/proteomics', '/storage')
-    elif '=Z:' in folder_name:
-        linux_name = folder_name.replace('Z:', '/storage')
-        linux_name = linux_name.replace('\\', '/')
-    elif 'Z:\\' in folder_name:
-        linux_name = folder_name.replace('Z:', '/storage')
-        linux_name = linux_name.replace('\\', '/')
-    elif 'Z\\:' in folder_name:
-        linux_name = folder_name.replace('Z\\:', '/storage')
-        linux_name = linux_name.replace('\\', '/')
-        linux_name = linux_name.replace('//', '/')
-    elif 'C\\:' in folder_name:
-        linux_name = folder_name.replace('C\\:', '')
-        linux_name = linux_name.replace('\\', '/')
-        linux_name = linux_name.replace('//', '/')
-    else:
-        linux_name = folder_name
-    return linux_name
+    return PathTranslation.to_linux(folder_name)
 
 
 def update_folder_windows(folder_name):
@@ -535,12 +1177,25 @@ def update_folder_windows(folder_name):
     :param folder_name:
     :return:
     """
-    output = folder_name
-    if "/storage" in folder_name:
-        output = folder_name.replace('/storage', 'Z:')
-    if "/nfs/corexfs/proteomic" in folder_name:
-        output = folder_name.replace("/nfs/corexfs/proteomic", 'Z:')
-    return output.replace('/', '\\')
+    return PathTranslation.to_windows(folder_name)
+
+
+def find_fragpipe(fragpipe_folder):
+    """
+    Find the fragpipe executable in a folder of FragPipe versions (uses the last by name if there are several)
+    :param fragpipe_folder: folder containing FragPipe install(s)
+    :type fragpipe_folder: str
+    :return: full path to fragpipe executable, or None if none found
+    :rtype: str
+    """
+    fragpipes = [os.path.join(fragpipe_folder, x) for x in os.listdir(fragpipe_folder)]
+    if len(fragpipes) == 0:
+        print('Error: could not find any fragpipe in {}'.format(fragpipe_folder))
+        return None
+    if len(fragpipes) > 1:
+        fragpipes = sorted(fragpipes)
+        print('Warning: found multiple fragpipes in {} - using {}'.format(fragpipe_folder, fragpipes[-1]))
+    return str(pathlib.Path(fragpipes[-1]) / 'bin' / 'fragpipe')
 
 
 def delete_old_temp_tools():
@@ -556,17 +1211,14 @@ def delete_old_temp_tools():
 
 
 if __name__ == '__main__':
+    import tkinter
+    from tkinter import filedialog
     root = tkinter.Tk()
     root.withdraw()
 
     template = filedialog.askopenfilename(filetypes=[('FP Template', '.csv')])
-    fragpipes = [os.path.join(FRAGPIPE_PATH, x) for x in os.listdir(FRAGPIPE_PATH)]
-    if len(fragpipes) == 0:
-        print('Error: could not find any fragpipe in {}'.format(FRAGPIPE_PATH))
+    fp_path = find_fragpipe(FRAGPIPE_PATH)
+    if fp_path is None:
         exit(1)
-    if len(fragpipes) > 1:
-        fragpipes = sorted(fragpipes)
-        print('Warning: found multiple fragpipes in {} - using {}'.format(FRAGPIPE_PATH, fragpipes[-1]))
-    fp_path = pathlib.Path(fragpipes[-1]) / 'bin' / 'fragpipe'
-    main(template, str(fp_path), USE_LINUX, TOOLS_TO_DISABLE)
+    main(template, fp_path, USE_LINUX, TOOLS_TO_DISABLE)
     print('Done!')
@@ -0,0 +1,392 @@
+"""
+Resource-packing local executor for FragPipe batches. Reads the fragpipe_batch.json job file written alongside
+fragpipe_batch.sh by Fragpipe_Batch_Runner and runs as many runs at once as the declared ram/threads of each run
+allow within the node capacity, rather than running every run back to back.
+
+To Use (on the node):
+python3 Fragpipe_Local_Executor.py /path/to/fragpipe_batch.json [--ram 512] [--threads 64]
+Several job files (shards of one batch) are each run in their own process, as if on separate nodes
+Add --scratch /local/scratch to stage each run's raw inputs to node-local disk first (see ScratchStaging), and
+--scratch-workdir to also run FragPipe in a workdir on scratch that is synced back to the output folder afterwards
+"""
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import re
+import subprocess
+import time
+from dataclasses import dataclass, field, asdict, replace
+
+import BatchGraph
+import FragpipeTimings
+import RunMarkers
+import ScratchStaging
+
+NODE_RAM = 512          # GB available to FragPipe runs on this node
+NODE_THREADS = 64
+POLL_INTERVAL = 10      # seconds between checks for finished runs
+EXECUTOR_LOG_NAME = 'fragpipe_executor.log'
+SCRATCH_PATH = None     # node-local folder to stage raw inputs to before each run (None: read inputs from storage)
+PREFETCH_JOBS = 2       # upcoming jobs to stage inputs for while others run
+SCRATCH_WORKDIR = False     # with a scratch path: run FragPipe in a scratch workdir, synced back to the output folder after
+SYNC_THREADS = 2
+
+
+@dataclass
+class BatchJob(object):
+    """
+    container for a single FragPipe run as written to the batch job file
+    """
+    name: str
+    output_path: str
+    ram: str
+    threads: str
+    commands: list
+    skip_msfragger_path: str = None
+    depends_on: list = field(default_factory=list)
+    manifest_path: str = None
+    fingerprint: str = None
+
+
+def write_batch_jobs(jobs, jobs_path):
+    """
+    Save the list of jobs to a .json job file for running with the executor
+    :param jobs: list of jobs
+    :type jobs: list[BatchJob]
+    :param jobs_path: full path to output file
+    :type jobs_path: str
+    :return: void
+    :rtype:
+    """
+    with open(jobs_path, 'w', newline='') as outfile:
+        json.dump([asdict(job) for job in jobs], outfile, indent=1)
+
+
+def read_batch_jobs(jobs_path):
+    """
+    Read a .json job file and fill in dependencies between jobs (runs that link results from another run's
+    output folder, or share its output folder, must wait for that run to finish; see BatchGraph). Jobs in a
+    dependency cycle are dropped with an error
+    :param jobs_path: full path to job file
+    :type jobs_path: str
+    :return: list of jobs
+    :rtype: list[BatchJob]
+    """
+    with open(jobs_path, 'r') as readfile:
+        jobs = [BatchJob(**job_dict) for job_dict in json.load(readfile)]
+
+    implied = BatchGraph.build_graph([job.output_path for job in jobs], [job.skip_msfragger_path for job in jobs])
+    for index, job in enumerate(jobs):
+        for upstream_index in implied.upstream[index]:
+            if jobs[upstream_index].name not in job.depends_on:
+                job.depends_on.append(jobs[upstream_index].name)
+
+    names = [job.name for job in jobs]
+    graph = BatchGraph.BatchGraph(len(jobs))
+    for index, job in enumerate(jobs):
+        for dependency in job.depends_on:
+            if dependency in names:
+                graph.add_edge(names.index(dependency), index)
+    order, unordered = graph.topological_order()
+    for index in unordered:
+        print('ERROR: not running {}: it is part of (or depends on) a circular chain of dependencies'.format(jobs[index].name))
+    return [jobs[x] for x in sorted(order)]
+
+
+def parse_resource(value, node_capacity):
+    """
+    Get the integer resource request from the template value. Blank or 0 means FragPipe picks (uses most of the
+    node), so reserve the full node for it
+    :param value: ram or threads string from the template
+    :type value: str
+    :param node_capacity: total capacity of the node for this resource
+    :type node_capacity: int
+    :return: amount to reserve
+    :rtype: int
+    """
+    try:
+        request = int(float(value))
+    except (TypeError, ValueError):
+        request = 0
+    if request <= 0 or request > node_capacity:
+        return node_capacity
+    return request
+
+
+def start_job(job):
+    """
+    Launch a single job as a bash process, logging output to the run's output folder
+    :param job: job to start
+    :type job: BatchJob
+    :return: running process
+    :rtype: subprocess.Popen
+    """
+    os.makedirs(job.output_path, exist_ok=True)
+    logfile = open(os.path.join(job.output_path, EXECUTOR_LOG_NAME), 'a')
+    script = 'set -xe\n' + ''.join(job.commands)
+    process = subprocess.Popen(['bash', '-c', script], stdout=logfile, stderr=subprocess.STDOUT)
+    logfile.close()     # child has its own handle
+    return process
+
+
+def is_recorded(job):
+    """
+    Check that a finished job recorded its completion: its fingerprint is in the output folder (jobs without a
+    fingerprint are not checked)
+    :param job: finished job
+    :type job: BatchJob
+    :return: bool
+    :rtype: bool
+    """
+    if job.fingerprint is None:
+        return True
+    try:
+        with open(os.path.join(job.output_path, RunMarkers.FINGERPRINT_NAME), 'r') as readfile:
+            return readfile.read().strip() == job.fingerprint
+    except OSError:
+        return False
+
+
+def get_result(job, return_code):
+    """
+    Get the result of a finished job: its exit code, or 1 if it exited 0 without recording its completion
+    :param job: finished job
+    :type job: BatchJob
+    :param return_code: exit code of the job
+    :type return_code: int
+    :return: result code
+    :rtype: int
+    """
+    if return_code == 0 and not is_recorded(job):
+        print('ERROR: {} exited without recording its completion in {}, counting it as failed'.format(job.name, job.output_path))
+        return 1
+    return return_code
+
+
+def use_staged_manifest(job, stager):
+    """
+    Get the job with its commands pointing to its inputs staged on scratch (waits for staging to finish)
+    :param job: job to start
+    :type job: BatchJob
+    :param stager: scratch stager
+    :type stager: ScratchStaging.ScratchStager
+    :return: job to run (the original job if its inputs could not be staged)
+    :rtype: BatchJob
+    """
+    scratch_manifest = stager.get_manifest(job.name, job.manifest_path)
+    if scratch_manifest == job.manifest_path:
+        return job
+    # FragPipe's copy of the manifest will list the scratch inputs, which are deleted after the run
+    try:
+        FragpipeTimings.save_raw_bytes(job.output_path, job.manifest_path)
+    except OSError as error:
+        print('Warning: could not save the raw input size of {}: {}'.format(job.name, error))
+    manifest_arg = '--manifest {} '.format(job.manifest_path)
+    commands = [x.replace(manifest_arg, '--manifest {} '.format(scratch_manifest)) for x in job.commands]
+    return replace(job, commands=commands)
+
+
+def use_scratch_workdir(job, workdir):
+    """
+    Get the job with its commands using a scratch workdir in place of its output folder (for FragPipe's workdir,
+    log, telemetry and completion markers; the executor log stays in the output folder)
+    :param job: job to start
+    :type job: BatchJob
+    :param workdir: scratch workdir (already seeded from the output folder)
+    :type workdir: str
+    :return: job to run
+    :rtype: BatchJob
+    """
+    output_pattern = re.escape(job.output_path.rstrip('/')) + r'(?![\w.-])'
+    commands = [re.sub(output_pattern, lambda match: workdir, x) for x in job.commands]
+    return replace(job, commands=commands)
+
+
+def run_jobs(jobs, node_ram=NODE_RAM, node_threads=NODE_THREADS, poll_interval=POLL_INTERVAL, stager=None, workdir_path=None):
+    """
+    Run all jobs, starting each as soon as its dependencies are done and its declared ram/threads fit in the
+    remaining node capacity. Jobs are considered in batch order, but later (smaller) jobs are allowed to fill
+    gaps left by earlier ones that do not fit yet. With a stager, the inputs of the next jobs are copied to scratch
+    while others run, and a job only starts once its inputs are staged (unless nothing else is running). With a
+    scratch workdir path, each job runs in a workdir there, seeded from its output folder in the background once its
+    dependencies are done (the job starts when seeding finishes) and synced back in the background once it
+    finishes; the job counts as done (for its dependents and the results) when the sync is verified. A job that
+    exits 0 without its fingerprint in the output folder (see is_recorded) counts as failed.
+    :param jobs: list of jobs to run
+    :type jobs: list[BatchJob]
+    :param node_ram: total ram (GB) to allocate
+    :type node_ram: int
+    :param node_threads: total threads to allocate
+    :type node_threads: int
+    :param poll_interval: seconds between checks for finished jobs
+    :type poll_interval: float
+    :param stager: stages job inputs to node-local scratch (None to read inputs from storage)
+    :type stager: ScratchStaging.ScratchStager
+    :param workdir_path: folder for scratch workdirs (None to run in the output folders)
+    :type workdir_path: str
+    :return: dict of job name: return code (None if skipped because a dependency failed)
+    :rtype: dict
+    """
+    pending = list(jobs)
+    running = {}
+    syncing = {}
+    in_workdir = set()
+    results = {}
+    sync_pool = concurrent.futures.ThreadPoolExecutor(max_workers=SYNC_THREADS)
+    free_ram = node_ram
+    free_threads = node_threads
+    start_time = time.time()
+
+    while len(pending) > 0 or len(running) > 0 or len(syncing) > 0:
+        # collect finished jobs
+        for name, (job, process, ram, threads) in list(running.items()):
+            return_code = process.poll()
+            if return_code is not None:
+                free_ram += ram
+                free_threads += threads
+                del running[name]
+                if stager is not None:
+                    stager.release(name)
+                print('finished {} (exit code {}) after {:.1f} min'.format(name, return_code, (time.time() - start_time) / 60))
+                if name in in_workdir:
+                    in_workdir.discard(name)
+                    syncing[name] = (sync_pool.submit(ScratchStaging.sync_back, os.path.join(workdir_path, name), job.output_path), job, return_code)
+                else:
+                    results[name] = get_result(job, return_code)
+        for name, (future, job, return_code) in list(syncing.items()):
+            if future.done():
+                del syncing[name]
+                results[name] = get_result(job, return_code) if future.result() else 1
+
+        # start anything that is ready and fits
+        for job in list(pending):
+            if any(dep in results and results[dep] != 0 for dep in job.depends_on):
+                # dependency failed, or was skipped itself (passes down chains of dependent runs)
+                print('Warning: skipping {} because a run it depends on failed'.format(job.name))
+                results[job.name] = None
+                pending.remove(job)
+                if stager is not None:
+                    stager.release(job.name)
+                continue
+            if not all(results.get(dep) == 0 for dep in job.depends_on):
+                continue
+            if workdir_path is not None:
+                stager.prefetch_workdir(job.name, job.output_path, os.path.join(workdir_path, job.name))
+            ram = parse_resource(job.ram, node_ram)
+            threads = parse_resource(job.threads, node_threads)
+            if ram <= free_ram and threads <= free_threads:
+                if stager is not None and job.manifest_path is not None:
+                    stager.prefetch(job.name, job.manifest_path)
+                    if len(running) > 0 and not stager.is_ready(job.name):
+                        continue
+                    job = use_staged_manifest(job, stager)
+                if workdir_path is not None:
+                    if len(running) + len(syncing) > 0 and not stager.is_seeded(job.name):
+                        continue
+                    workdir = stager.get_workdir(job.name, job.output_path, os.path.join(workdir_path, job.name))
+                    if workdir is not None:
+                        job = use_scratch_workdir(job, workdir)
+                        in_workdir.add(job.name)
+                running[job.name] = (job, start_job(job), ram, threads)
+                free_ram -= ram
+                free_threads -= threads
+                pending = [x for x in pending if x.name != job.name]
+                print('started {} ({} GB, {} threads); {} running, {} waiting'.format(job.name, ram, threads, len(running), len(pending)))
+
+        if len(running) == 0 and len(syncing) == 0 and len(pending) > 0 and all(not all(results.get(dep) == 0 for dep in job.depends_on) for job in pending):
+            # nothing can ever start (dependency not in this batch or circular)
+            for job in pending:
+                print('Error: dependencies {} of {} are not in this batch, not running'.format(job.depends_on, job.name))
+                results[job.name] = None
+            pending = []
+        if stager is not None:
+            # stage the next jobs that could run while the current ones compute
+            upcoming = [x for x in pending if x.manifest_path is not None and all(results.get(dep) in [0, None] for dep in x.depends_on)]
+            for job in upcoming[:PREFETCH_JOBS]:
+                stager.prefetch(job.name, job.manifest_path)
+        if len(running) > 0 or len(syncing) > 0:
+            time.sleep(poll_interval)
+    sync_pool.shutdown()
+    return results
+
+
+def main(jobs_path, node_ram=NODE_RAM, node_threads=NODE_THREADS, scratch_path=SCRATCH_PATH, scratch_workdir=SCRATCH_WORKDIR):
+    """
+    Run the batch from the provided job file and print a summary
+    :param jobs_path: full path to fragpipe_batch.json
+    :type jobs_path: str
+    :param node_ram: total ram (GB) to allocate
+    :type node_ram: int
+    :param node_threads: total threads to allocate
+    :type node_threads: int
+    :param scratch_path: node-local folder to stage raw inputs to (None: read from storage)
+    :type scratch_path: str
+    :param scratch_workdir: also run FragPipe in workdirs under the scratch path
+    :type scratch_workdir: bool
+    :return: True if all runs succeeded
+    :rtype: bool
+    """
+    jobs = read_batch_jobs(jobs_path)
+    print('running {} jobs with {} GB and {} threads'.format(len(jobs), node_ram, node_threads))
+    stager = None
+    workdir_path = None
+    if scratch_path is not None:
+        # separate folder per job file, so shards run on the same machine do not share (and delete) each other's files
+        scratch_path = os.path.join(scratch_path, os.path.splitext(os.path.basename(jobs_path))[0])
+        stager = ScratchStaging.ScratchStager(scratch_path)
+        if scratch_workdir:
+            workdir_path = os.path.join(scratch_path, ScratchStaging.WORKDIR_FOLDER)
+    try:
+        results = run_jobs(jobs, node_ram, node_threads, stager=stager, workdir_path=workdir_path)
+    finally:
+        if stager is not None:
+            stager.close()
+    failed = [name for name, return_code in results.items() if return_code != 0]
+    for name in failed:
+        print('Failed: {} (exit code {})'.format(name, results[name]))
+    return len(failed) == 0
+
+
+def run_shards(jobs_paths, node_ram=NODE_RAM, node_threads=NODE_THREADS, scratch_path=SCRATCH_PATH, scratch_workdir=SCRATCH_WORKDIR):
+    """
+    Run several job files at once, one process per job file, as a local stand-in for running each shard of a
+    sharded batch on its own node. Each process gets the full node_ram/node_threads
+    :param jobs_paths: list of job files (one per shard)
+    :type jobs_paths: list
+    :param node_ram: ram (GB) per shard
+    :type node_ram: int
+    :param node_threads: threads per shard
+    :type node_threads: int
+    :param scratch_path: node-local folder to stage raw inputs to (None: read from storage)
+    :type scratch_path: str
+    :param scratch_workdir: also run FragPipe in workdirs under the scratch path
+    :type scratch_workdir: bool
+    :return: True if all runs in all shards succeeded
+    :rtype: bool
+    """
+    with multiprocessing.Pool(len(jobs_paths)) as pool:
+        shard_results = pool.starmap(main, [(jobs_path, node_ram, node_threads, scratch_path, scratch_workdir) for jobs_path in jobs_paths])
+    for jobs_path, success in zip(jobs_paths, shard_results):
+        if not success:
+            print('Failed shard: {}'.format(jobs_path))
+    return all(shard_results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a FragPipe batch job file, packing runs into the node capacity')
+    parser.add_argument('jobs_paths', nargs='+', help='fragpipe_batch.json written by Fragpipe_Batch_Runner (several: run each as its own node)')
+    parser.add_argument('--ram', type=int, default=NODE_RAM, help='node ram (GB) available to runs')
+    parser.add_argument('--threads', type=int, default=NODE_THREADS, help='node threads available to runs')
+    parser.add_argument('--scratch', default=SCRATCH_PATH, help='node-local folder to stage raw inputs to before each run')
+    parser.add_argument('--scratch-quota', type=float, default=ScratchStaging.SCRATCH_QUOTA_GB, help='max GB of staged inputs')
+    parser.add_argument('--scratch-workdir', action='store_true', default=SCRATCH_WORKDIR, help='with --scratch: run FragPipe in a scratch workdir, synced back after each run')
+    args = parser.parse_args()
+    ScratchStaging.SCRATCH_QUOTA_GB = args.scratch_quota
+    if len(args.jobs_paths) > 1:
+        success = run_shards(args.jobs_paths, args.ram, args.threads, args.scratch, args.scratch_workdir)
+    else:
+        success = main(args.jobs_paths[0], args.ram, args.threads, args.scratch, args.scratch_workdir)
+    if not success:
+        exit(1)
@@ -0,0 +1,188 @@
+"""
+Incremental reruns of FragPipe runs into an existing output folder. The workflow requested for the new run is
+compared with the one requested for the last successful run in that folder (RunMarkers.REQUESTED_WORKFLOW_NAME), and
+each changed key is mapped to the pipeline stage it affects. The earliest stage that changed (or is newly enabled
+and has no outputs yet) and everything after it run again; the stages before it are disabled, as long as their
+outputs exist. E.g. changing only a PTM-Shepherd parameter reruns PTM-Shepherd onward. The manifest contents and the
+FragPipe/tool paths are saved with the requested workflow too, and any change to them reruns everything. The
+requested workflow is saved as PENDING_WORKFLOW_NAME when the batch is prepared, and only replaces the previous one
+when the run succeeds (see Fragpipe_Batch_Runner.make_run_commands).
+"""
+import glob
+import hashlib
+import os
+
+import PathTranslation
+import RunMarkers
+
+PENDING_WORKFLOW_NAME = RunMarkers.REQUESTED_WORKFLOW_NAME + '.pending'     # requested workflow of a run not yet completed
+# inputs other than the workflow, saved as extra keys of the requested workflow. Not part of any stage, so a change
+# reruns from the first stage
+MANIFEST_KEY = 'incremental-rerun.manifest'
+TOOLS_KEY = 'incremental-rerun.tools'
+
+
+class Stage(object):
+    """
+    container for one pipeline stage: the tools (DisableTools values) it runs, the workflow keys that affect it,
+    and the outputs it leaves in the output folder
+    """
+    name: str
+    tools: list
+    key_prefixes: tuple
+    outputs: list
+
+    def __init__(self, name, tools, key_prefixes, outputs):
+        self.name = name
+        self.tools = tools
+        self.key_prefixes = key_prefixes
+        self.outputs = outputs
+
+
+# in pipeline order
+STAGES = [
+    Stage('MSFragger', ['msfragger'], ('msfragger.', 'database.'), ['*.pepXML', '*.pin']),
+    Stage('PSM validation', ['peptide-prophet', 'percolator', 'psm-validation'],
+          ('peptide-prophet.', 'percolator.', 'msbooster.', 'run-psm-validation', 'crystalc.'), ['interact-*.pep.xml', '*/interact-*.pep.xml']),
+    Stage('PTMProphet', ['ptmprophet'], ('ptmprophet.',), ['*.mod.pep.xml', '*/*.mod.pep.xml']),
+    Stage('ProteinProphet', ['protein-prophet'], ('protein-prophet.',), ['*.prot.xml']),
+    Stage('filter and report', ['report'], ('phi-report.',), ['psm.tsv', '*/psm.tsv']),
+    Stage('PTM-Shepherd', ['shepherd'], ('ptmshepherd.',), ['global.profile.tsv']),
+    Stage('O-Pair', ['opair'], ('opair.',), []),
+    Stage('quant', ['freequant', 'label-free-quant'], ('freequant.', 'ionquant.', 'quantitation.'), ['combined_protein.tsv']),
+    Stage('TMT-Integrator', ['tmtintegrator'], ('tmtintegrator.',), []),
+    Stage('spectral library', ['speclibgen'], ('speclibgen.',), ['library.tsv']),
+    Stage('DIA-NN', ['dia-nn'], ('diann.',), []),
+]
+# keys that do not change results
+IGNORED_PREFIXES = ('workflow.description', 'workflow.saved-with-ver', 'workflow.ram', 'workflow.threads', 'fragpipe-ui.')
+
+
+def tool_signature(path):
+    """
+    Identify a tool by its path, plus size and modified time for files that can be read from here (so a tool
+    replaced in place is not matched to old results). Folders are identified by path only
+    :param path: tool file or folder path
+    :type path: str
+    :return: signature string
+    :rtype: str
+    """
+    if path is not None and os.path.isfile(path):
+        stat = os.stat(path)
+        return '{}|{}|{}'.format(PathTranslation.to_linux(path), stat.st_size, int(stat.st_mtime))
+    return PathTranslation.to_linux(path) if path is not None else ''
+
+
+def get_input_params(manifest_path, tool_paths):
+    """
+    Get the extra keys describing a run's inputs other than the workflow (see MANIFEST_KEY, TOOLS_KEY)
+    :param manifest_path: full path to the run's manifest
+    :type manifest_path: str
+    :param tool_paths: FragPipe and tool paths (files or folders) used by the run
+    :type tool_paths: list
+    :return: dict of key: value
+    :rtype: dict
+    """
+    with open(manifest_path, 'r') as readfile:
+        rows = [PathTranslation.to_linux(line.rstrip('\r\n')) for line in readfile if line.strip() != '']
+    return {MANIFEST_KEY: hashlib.sha256('\n'.join(rows).encode()).hexdigest(),
+            TOOLS_KEY: ';'.join([tool_signature(x) for x in tool_paths])}
+
+
+def save_requested_workflow(requested_path, workflow_lines, input_params):
+    """
+    Save the requested workflow with its input keys, for comparing to the next run in the output folder
+    :param requested_path: full path to save to (PENDING_WORKFLOW_NAME in the output folder)
+    :type requested_path: str
+    :param workflow_lines: lines of the requested workflow
+    :type workflow_lines: list
+    :param input_params: dict of key: value from get_input_params
+    :type input_params: dict
+    :return: void
+    """
+    with open(requested_path, 'w') as outfile:
+        outfile.writelines(workflow_lines)
+        for key, value in input_params.items():
+            outfile.write('{}={}\n'.format(key, value))
+
+
+def changed_keys(new_params, old_params):
+    """
+    Get the workflow keys with different values (or only in one of the workflows), except IGNORED_PREFIXES
+    :param new_params: dict of key: value for the new run
+    :type new_params: dict
+    :param old_params: dict of key: value for the previous run
+    :type old_params: dict
+    :return: sorted list of keys
+    :rtype: list
+    """
+    keys = set(new_params.keys()) | set(old_params.keys())
+    return sorted([x for x in keys if new_params.get(x) != old_params.get(x) and not x.startswith(IGNORED_PREFIXES)])
+
+
+def stage_of_key(key):
+    """
+    Get the index in STAGES of the stage a key affects. Keys of no known stage count as affecting the first stage
+    :param key: workflow key
+    :type key: str
+    :return: stage index
+    :rtype: int
+    """
+    for index, stage in enumerate(STAGES):
+        if key.startswith(stage.key_prefixes):
+            return index
+    return 0
+
+
+def is_enabled(stage, params):
+    """
+    Check if any tool of a stage is turned on in a workflow (a [prefix.]run-[tool] key is true)
+    :param stage: stage
+    :type stage: Stage
+    :param params: dict of workflow key: value
+    :type params: dict
+    :return: bool
+    :rtype: bool
+    """
+    run_keys = tuple(['run-{}'.format(x) for x in stage.tools])
+    return any(key.split('.')[-1] in run_keys and value == 'true' for key, value in params.items())
+
+
+def has_outputs(stage, output_folder):
+    """
+    Check that a stage's outputs exist in the output folder (stages with no known outputs never count as done)
+    :param stage: stage
+    :type stage: Stage
+    :param output_folder: run output folder
+    :type output_folder: str
+    :return: bool
+    :rtype: bool
+    """
+    return any(len(glob.glob(os.path.join(output_folder, pattern))) > 0 for pattern in stage.outputs)
+
+
+def find_reusable_stages(new_params, old_params, output_folder):
+    """
+    Find the stages whose results in the output folder can be kept for the new run: all enabled stages before the
+    first stage that changed or has no outputs. If nothing changed and all enabled stages have outputs, there is
+    nothing to rerun
+    :param new_params: dict of key: value requested for the new run
+    :type new_params: dict
+    :param old_params: dict of key: value requested for the previous run in the folder
+    :type old_params: dict
+    :param output_folder: run output folder
+    :type output_folder: str
+    :return: list of tools (DisableTools values) to disable, list of changed keys, True if anything needs rerunning
+    :rtype: tuple
+    """
+    changes = changed_keys(new_params, old_params)
+    first_rerun = min([stage_of_key(x) for x in changes]) if len(changes) > 0 else len(STAGES)
+    for index, stage in enumerate(STAGES[:first_rerun]):
+        if is_enabled(stage, new_params) and not has_outputs(stage, output_folder):
+            first_rerun = index
+            break
+    disable = []
+    for stage in STAGES[:first_rerun]:
+        if is_enabled(stage, new_params):
+            disable.extend(stage.tools)
+    return disable, changes, first_rerun < len(STAGES)
@@ -2,13 +2,10 @@
 Command line runner for MSConvert
 """
 
-import tkinter
-from tkinter import filedialog
 import os
 import subprocess
 import multiprocessing
 import time
-import RemoveScans_mzML
 
 CHECK_ONLY = False  # do not actually run MSConvert if True, only validate that files are all converted successfully
 # CHECK_ONLY = True  # do not actually run MSConvert if True, only validate that files are all converted successfully
@@ -117,7 +114,7 @@ def run_msconvert(raw_files, activation_types=None, deisotope=False):
     :param deisotope: whether to desiotope with MSConvert
     :return: void
     """
-    maindir = os.path.dirname(files[0])
+    maindir = os.path.dirname(raw_files[0])
 
     if activation_types is None:
         # just run without splitting/filtering
@@ -202,6 +199,7 @@ def rename_files_activation(activation, outputfiles, do_ethcd_fix=False):
 
         # if EThcD, fix files here too
         if do_ethcd_fix:
+            import RemoveScans_mzML     # needs pyopenms, only import when filtering scans
             RemoveScans_mzML.filter_scans(new_path, [RemoveScans_mzML.ActivationType.HCD], maindir)  # keep HCD only (e.g. do on 'HCD' output of EThcD conversion to remove EThcD scans from the HCD file)
 
 
@@ -298,6 +296,8 @@ def inner_loop(cmd, filepath):
 
 
 if __name__ == '__main__':
+    import tkinter
+    from tkinter import filedialog
     root = tkinter.Tk()
     root.withdraw()
 
@@ -3,8 +3,6 @@ Script for testing deisotoping speed for comparison in manuscript. Uses MSConver
 """
 
 import MSConvertWrapper
-import tkinter
-from tkinter import filedialog
 import os
 import subprocess
 import time
@@ -46,6 +44,8 @@ def run_cmd(command_str):
 
 
 if __name__ == '__main__':
+    import tkinter
+    from tkinter import filedialog
     root = tkinter.Tk()
     root.withdraw()
 
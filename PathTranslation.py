@@ -0,0 +1,176 @@
+"""
+Table-driven translation of paths between the Windows (Z: / corexfs share) and linux (/storage) mounts. Shared
+by Fragpipe_Batch_Runner and PrepFraggerRuns so both give the same answer. Paths may be embedded in a longer
+line (workflow 'key=value' lines, including Java-escaped 'Z\\:\\\\' forms, or command lines with several paths).
+A path runs from the mount prefix to the next tab/newline, or to a space followed by an option ('-') or another
+mounted path, so paths with spaces in them are kept whole. Files (translate_file, e.g. tab-delimited manifests
+whose file names may contain ' -') use fields instead: the path runs to the next tab/newline.
+"""
+import functools
+import re
+
+# Windows prefix: linux prefix. Longest matching prefix wins, so more specific mounts can be added above/below freely
+LINUX_MOUNTS = {
+    r'\\corexfs.med.umich.edu\proteomics': '/storage',
+    'Z:': '/storage',
+    'C\\:': '',       # Java-escaped form only (workflow files); plain C:\ paths are left as is
+}
+# linux prefix: Windows prefix
+WINDOWS_MOUNTS = {
+    '/storage': 'Z:',
+    '/nfs/corexfs/proteomic': 'Z:',
+}
+PATH_END = r'[^\t\r\n]*'       # path runs to the end of the field (tab-delimited manifests) or line
+PATH_BREAK = r'\s+(?:-|{})'     # in lines: a path also ends at whitespace before an option or another mounted path ({}: mount prefixes)
+
+
+def windows_prefix_pattern(prefix):
+    """
+    Regex for a Windows mount prefix, allowing either slash direction, repeated (escaped) separators, and
+    Java-escaped drive colons. A prefix written with an escaped colon (e.g. 'C\\:') only matches the escaped form
+    :param prefix: Windows prefix (e.g. 'Z:' or UNC share)
+    :type prefix: str
+    :return: regex string
+    :rtype: str
+    """
+    parts = [x for x in re.split(r'[\\/]+(?!:)', prefix) if x != '']
+    pattern = r'[\\/]{2,}' if re.match(r'[\\/]', prefix) else r'(?<![A-Za-z0-9])'
+    part_patterns = []
+    for part in parts:
+        if part.endswith('\\:'):
+            part_patterns.append(re.escape(part[:-2]) + r'\\:')
+        elif part.endswith(':'):
+            part_patterns.append(re.escape(part[:-1]) + r'\\?:')
+        else:
+            part_patterns.append(re.escape(part))
+    return pattern + r'[\\/]+'.join(part_patterns)
+
+
+def linux_prefix_pattern(prefix):
+    """
+    Regex for a linux mount prefix, only matching at path component boundaries
+    :param prefix: linux prefix (e.g. '/storage')
+    :type prefix: str
+    :return: regex string
+    :rtype: str
+    """
+    return r'(?<![\w./-])' + re.escape(prefix.rstrip('/')) + r'(?![\w.-])'
+
+
+@functools.lru_cache(maxsize=None)
+def get_pattern(to_linux, fields=False):
+    """
+    Compile the mount table for one direction into a single regex (alternatives sorted longest prefix first). Each
+    alternative is its own group with the rest of the path nested inside it, so the matched mount is
+    match.lastindex and the rest of the path is the following group
+    :param to_linux: direction
+    :type to_linux: bool
+    :param fields: if True, paths run to the end of the tab-delimited field (see PATH_END), otherwise they also end
+    before another option or path on the line (see PATH_BREAK)
+    :type fields: bool
+    :return: compiled regex, list of replacement prefixes in alternative order
+    :rtype: tuple
+    """
+    if to_linux:
+        mounts = sorted(LINUX_MOUNTS.items(), key=lambda x: len(x[0]), reverse=True)
+        alternatives = [windows_prefix_pattern(x[0]) for x in mounts]
+    else:
+        mounts = sorted(WINDOWS_MOUNTS.items(), key=lambda x: len(x[0]), reverse=True)
+        alternatives = [linux_prefix_pattern(x[0]) for x in mounts]
+    first_chars = set()
+    for prefix, _ in mounts:
+        first_chars.update(['\\', '/'] if re.match(r'[\\/]', prefix) else [prefix[0]])
+    # cheap first-character check so the full alternation is only tried where a mount could start
+    lookahead = '(?=[{}])'.format(''.join([re.escape(x) for x in sorted(first_chars)]))
+    if fields:
+        path_end = PATH_END
+    else:
+        path_end = r'(?:(?!{})[^\t\r\n])*'.format(PATH_BREAK.format('|'.join(alternatives)))
+    pattern = lookahead + '(?:{})'.format('|'.join(['({}({}))'.format(x, path_end) for x in alternatives]))
+    return re.compile(pattern), [x[1] for x in mounts]
+
+
+def reload_mounts():
+    """
+    Clear compiled patterns and memoized results after editing LINUX_MOUNTS/WINDOWS_MOUNTS
+    :return: void
+    """
+    get_pattern.cache_clear()
+    to_linux.cache_clear()
+    to_windows.cache_clear()
+
+
+def translate_text(text, linux=True, fields=False):
+    """
+    Translate all mounted paths in a block of text (a line or a whole file) in one pass
+    :param text: text to translate
+    :type text: str
+    :param linux: if True, Windows -> linux, otherwise linux -> Windows
+    :type linux: bool
+    :param fields: if True, each path runs to the end of its tab-delimited field (files like manifests)
+    :type fields: bool
+    :return: translated text
+    :rtype: str
+    """
+    pattern, replacements = get_pattern(linux, fields)
+
+    def replace(match):
+        """
+        replace the matched prefix and fix separators in the rest of the path
+        """
+        index = match.lastindex
+        rest = match.group(index + 1)
+        if linux:
+            rest = rest.replace('\\', '/')
+            while '//' in rest:
+                rest = rest.replace('//', '/')
+        else:
+            rest = rest.replace('/', '\\')
+        return replacements[(index - 1) // 2] + rest
+
+    return pattern.sub(replace, text)
+
+
+@functools.lru_cache(maxsize=65536)
+def to_linux(path):
+    """
+    Translate a Windows path (or line containing one) to linux. Memoized
+    :param path: path or line
+    :type path: str
+    :return: translated string
+    :rtype: str
+    """
+    return translate_text(path, linux=True)
+
+
+@functools.lru_cache(maxsize=65536)
+def to_windows(path):
+    """
+    Translate a linux path (or line containing one) to Windows. Memoized
+    :param path: path or line
+    :type path: str
+    :return: translated string
+    :rtype: str
+    """
+    return translate_text(path, linux=False)
+
+
+def translate_file(input_path, output_path=None, linux=True):
+    """
+    Translate all paths in a file (e.g. manifest with many raw paths) in a single read/translate/write pass
+    :param input_path: file to read
+    :type input_path: str
+    :param output_path: where to save (default: overwrite input)
+    :type output_path: str
+    :param linux: if True, Windows -> linux, otherwise linux -> Windows
+    :type linux: bool
+    :return: output path
+    :rtype: str
+    """
+    with open(input_path, 'r') as readfile:
+        text = readfile.read()
+    if output_path is None:
+        output_path = input_path
+    with open(output_path, 'w', newline='') as outfile:
+        outfile.write(translate_text(text, linux, fields=True))
+    return output_path
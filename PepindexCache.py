@@ -0,0 +1,265 @@
+"""
+Shared cache of MSFragger peptide indexes (.pepindex). MSFragger writes its index next to the database FASTA, so
+instead of each run pointing at the FASTA in the database folder, runs are pointed at a hardlink of the FASTA in a
+cache entry keyed by the FASTA contents and the MSFragger parameters that determine the digest. Runs with the same
+key share the entry (and its index); the first run to start builds the index while the others wait for it. The
+builder records its host and PID in the lock and keeps it fresh while it runs, so a lock left by a killed run is
+broken by the next waiting run instead of making every run wait the full WAIT_MINUTES. Runs using an entry leave a
+reader marker in it for as long as they run. Entries are evicted least recently used first under a size cap,
+skipping entries being built or read.
+"""
+import hashlib
+import json
+import os
+import shutil
+import socket
+import time
+
+import PathTranslation
+import ToolsCache
+
+ENTRIES_FOLDER = 'entries'
+ENTRY_INFO_NAME = '.pepindex_key.json'
+COMPLETE_NAME = '.complete'         # written by the run that built the index, once it succeeded
+LOCK_NAME = '.building'             # folder made (atomically) by the run building the index
+LOCK_OWNER_NAME = 'owner'           # in the lock folder: "host PID" of the builder, touched every minute while it runs
+LOCK_STALE_MINUTES = 10             # a lock not touched for this long is left by a run that is gone
+READERS_FOLDER = '.readers'         # marker file per running run using the entry, named host_PID
+READER_LEASE_HOURS = 168            # reader markers older than this are left by runs that are gone (killed on another host)
+LAST_USED_NAME = '.last_used'
+MAX_CACHE_GB = 200
+WAIT_MINUTES = 240                  # longest a run waits for another run to build the index before building its own
+# MSFragger workflow keys (prefixes) that change the peptide index
+DIGEST_PARAM_PREFIXES = ('msfragger.search_enzyme',
+                         'msfragger.allowed_missed_cleavage',
+                         'msfragger.num_enzyme_termini',
+                         'msfragger.digest_',
+                         'msfragger.clip_nTerm_M',
+                         'msfragger.max_variable_mods',
+                         'msfragger.table.var-mods',
+                         'msfragger.table.fix-mods',
+                         'msfragger.mass_offsets',
+                         'msfragger.restrict_deltamass_to',
+                         'msfragger.misc.fragger.enzyme-dropdown')
+
+
+def find_local_file(path):
+    """
+    Find a workflow/template file path (either mount, Java-escaped or not) from here
+    :param path: file path
+    :type path: str
+    :return: readable path, or None if not found
+    :rtype: str
+    """
+    path = path.replace('\\\\', '\\').replace('\\:', ':')
+    for candidate in [path, PathTranslation.to_linux(path), PathTranslation.to_windows(path)]:
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+def make_cache_key(database_hash, workflow_params):
+    """
+    Combine the FASTA hash and the digest parameters into a cache key
+    :param database_hash: sha256 of the FASTA
+    :type database_hash: str
+    :param workflow_params: dict of workflow key: value
+    :type workflow_params: dict
+    :return: key
+    :rtype: str
+    """
+    hasher = hashlib.sha256(database_hash.encode())
+    for key in sorted(workflow_params.keys()):
+        if key.startswith(DIGEST_PARAM_PREFIXES):
+            hasher.update('{}={}\n'.format(key, workflow_params[key]).encode())
+    return hasher.hexdigest()[:16]
+
+
+def get_cache_entry(cache_path, database_path, workflow_params):
+    """
+    Get the cache entry for a database and set of MSFragger parameters (the entry is not made here, see make_entry)
+    :param cache_path: cache root folder
+    :type cache_path: str
+    :param database_path: FASTA path from the template or workflow
+    :type database_path: str
+    :param workflow_params: dict of workflow key: value
+    :type workflow_params: dict
+    :return: entry folder, FASTA path in the entry, local FASTA source (None if the database cannot be read from here)
+    :rtype: tuple
+    """
+    source = find_local_file(database_path) if database_path else None
+    if source is None:
+        print('Warning: could not find database {}, not using the pepindex cache'.format(database_path))
+        return None
+    hash_index = ToolsCache.load_hash_index(cache_path)
+    saved = dict(hash_index)
+    database_hash = ToolsCache.file_hash(source, hash_index)
+    if hash_index != saved and os.path.isdir(cache_path):
+        # (cache folder is made with the first entry, not here, so a dry run writes nothing)
+        ToolsCache.save_hash_index(cache_path, hash_index)
+    entry_path = os.path.join(cache_path, ENTRIES_FOLDER, make_cache_key(database_hash, workflow_params))
+    return entry_path, os.path.join(entry_path, os.path.basename(source)), source
+
+
+def make_entry(entry_path, fasta_path, source, workflow_params):
+    """
+    Make (or reuse) a cache entry: link the FASTA into it and mark it as used now
+    :param entry_path: entry folder
+    :type entry_path: str
+    :param fasta_path: FASTA path in the entry
+    :type fasta_path: str
+    :param source: FASTA to link
+    :type source: str
+    :param workflow_params: dict of workflow key: value (digest parameters are saved for reference)
+    :type workflow_params: dict
+    :return: void
+    """
+    os.makedirs(entry_path, exist_ok=True)
+    if not os.path.exists(fasta_path):
+        ToolsCache.link_or_copy(source, fasta_path)
+        info = {key: value for key, value in workflow_params.items() if key.startswith(DIGEST_PARAM_PREFIXES)}
+        info['database'] = source
+        with open(os.path.join(entry_path, ENTRY_INFO_NAME), 'w') as outfile:
+            json.dump(info, outfile, indent=1)
+    with open(os.path.join(entry_path, LAST_USED_NAME), 'w') as outfile:
+        outfile.write('{}\n'.format(time.time()))
+
+
+def lock_commands(entry_path):
+    """
+    Shell commands making runs that share an entry take turns: before FragPipe, mark the entry as read by this run
+    and wait until the index is complete or this run gets the build lock; after FragPipe, the run holding the lock
+    marks the index complete (on success) and releases the lock, and the reader marker is removed. If the builder
+    fails, the next waiting run takes over; if it was killed (its PID is gone on this host, or the lock was not
+    touched for LOCK_STALE_MINUTES), the next waiting run breaks the lock
+    :param entry_path: entry folder (linux path)
+    :type entry_path: str
+    :return: command before FragPipe, command for the success line, command after FragPipe
+    :rtype: tuple
+    """
+    lock = '{}/{}'.format(entry_path, LOCK_NAME)
+    owner = '{}/{}'.format(lock, LOCK_OWNER_NAME)
+    before = ['pepindexLock=0\n',
+              'mkdir -p {}/{}\n'.format(entry_path, READERS_FOLDER),
+              'pepindexReader={}/{}/$(hostname)_$$\n'.format(entry_path, READERS_FOLDER),
+              'touch $pepindexReader\n',
+              'for i in $(seq 1 {}); do\n'.format(WAIT_MINUTES),
+              '\tif [ -e {}/{} ]; then\n\t\tbreak\n\tfi\n'.format(entry_path, COMPLETE_NAME),
+              '\tif mkdir {} 2>/dev/null; then\n'.format(lock),
+              '\t\techo "$(hostname) $$" > {}\n'.format(owner),
+              '\t\tpepindexLock=1\n',
+              # keep the lock fresh while this script runs (stops if the script is killed)
+              '\t\t(set +x; while kill -0 $$ 2> /dev/null; do touch {} 2> /dev/null; sleep 60; done) &\n'.format(owner),
+              '\t\tpepindexHeartbeat=$!\n\t\tbreak\n\tfi\n',
+              '\tpepindexOwner=$(cat {} 2> /dev/null || true)\n'.format(owner),
+              '\tpepindexStale=0\n',
+              '\tif [[ -n "$pepindexOwner" && "${pepindexOwner% *}" == "$(hostname)" ]] && ! ps -p ${pepindexOwner#* } > /dev/null 2>&1; then\n\t\tpepindexStale=1\n',
+              '\telif [[ -e {} && -z "$(find {} -mmin -{} 2> /dev/null)" ]]; then\n\t\tpepindexStale=1\n\tfi\n'.format(lock, lock, LOCK_STALE_MINUTES),
+              '\tif [ $pepindexStale -eq 1 ]; then\n',
+              '\t\techo "Warning: breaking the pepindex lock of $pepindexOwner (no longer running)"\n',
+              # move the lock aside first so only one waiting run breaks it; put it back if it was taken again meanwhile
+              '\t\tif mv -T {lock} {lock}.stale_$$ 2> /dev/null; then\n'
+              '\t\t\tif [ "$(cat {lock}.stale_$$/{owner_name} 2> /dev/null || true)" == "$pepindexOwner" ]; then\n'
+              '\t\t\t\trm -rf {lock}.stale_$$\n'
+              '\t\t\telse\n'
+              '\t\t\t\tmv -T {lock}.stale_$$ {lock} 2> /dev/null || rm -rf {lock}.stale_$$\n'
+              '\t\t\tfi\n'
+              '\t\tfi\n'.format(lock=lock, owner_name=LOCK_OWNER_NAME),
+              '\t\tcontinue\n\tfi\n',
+              '\tsleep 60\ndone\n']
+    success = 'if [ $pepindexLock -eq 1 ]; then touch {}/{}; fi'.format(entry_path, COMPLETE_NAME)
+    after = 'if [ $pepindexLock -eq 1 ]; then kill $pepindexHeartbeat 2> /dev/null || true; rm -rf {}; fi\nrm -f $pepindexReader\n'.format(lock)
+    return ''.join(before), success, after
+
+
+def is_pid_alive(pid):
+    """
+    Check if a process is running on this host
+    :param pid: process ID
+    :type pid: int
+    :return: bool
+    :rtype: bool
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True     # exists, owned by another user
+    return True
+
+
+def is_building(entry_path):
+    """
+    Check if an entry's index is being built: its lock exists and was touched recently (see lock_commands)
+    :param entry_path: entry folder
+    :type entry_path: str
+    :return: bool
+    :rtype: bool
+    """
+    lock_path = os.path.join(entry_path, LOCK_NAME)
+    if not os.path.exists(lock_path):
+        return False
+    owner_path = os.path.join(lock_path, LOCK_OWNER_NAME)
+    touched = os.path.getmtime(owner_path) if os.path.exists(owner_path) else os.path.getmtime(lock_path)
+    return time.time() - touched < LOCK_STALE_MINUTES * 60
+
+
+def is_being_read(entry_path):
+    """
+    Check if a running run uses an entry (see lock_commands). Markers of runs that are gone (PID not running on this
+    host, or older than READER_LEASE_HOURS) are removed
+    :param entry_path: entry folder
+    :type entry_path: str
+    :return: bool
+    :rtype: bool
+    """
+    readers_path = os.path.join(entry_path, READERS_FOLDER)
+    if not os.path.isdir(readers_path):
+        return False
+    in_use = False
+    for name in os.listdir(readers_path):
+        marker_path = os.path.join(readers_path, name)
+        host, _, pid = name.rpartition('_')
+        try:
+            expired = time.time() - os.path.getmtime(marker_path) > READER_LEASE_HOURS * 3600
+            if expired or (host == socket.gethostname() and pid.isdigit() and not is_pid_alive(int(pid))):
+                os.remove(marker_path)
+            else:
+                in_use = True
+        except FileNotFoundError:
+            pass    # the run finished meanwhile
+    return in_use
+
+
+def evict_pepindex_cache(cache_path, max_gb=MAX_CACHE_GB):
+    """
+    Remove least recently used entries until the cache is under its size cap. Entries being built or read by a
+    running run are kept
+    :param cache_path: cache root folder
+    :type cache_path: str
+    :param max_gb: maximum cache size (GB)
+    :type max_gb: float
+    :return: void
+    """
+    entries_path = os.path.join(cache_path, ENTRIES_FOLDER)
+    if not os.path.exists(entries_path):
+        return
+    entries = []
+    for entry in os.listdir(entries_path):
+        entry_path = os.path.join(entries_path, entry)
+        last_used_path = os.path.join(entry_path, LAST_USED_NAME)
+        last_used = os.path.getmtime(last_used_path) if os.path.exists(last_used_path) else 0
+        entries.append([last_used, entry_path, ToolsCache.path_size(entry_path)])
+    entries.sort(key=lambda x: x[0])
+
+    max_bytes = max_gb * 1024 ** 3
+    total_bytes = sum([x[2] for x in entries])
+    for last_used, entry_path, size in entries:
+        if total_bytes <= max_bytes:
+            break
+        if is_building(entry_path) or is_being_read(entry_path):
+            continue
+        print('removing least recently used pepindex cache entry {}'.format(entry_path))
+        shutil.rmtree(entry_path, ignore_errors=True)
+        total_bytes -= size
@@ -0,0 +1,254 @@
+"""
+Parsed Philosopher pipeline config (philosopher.yml). The yml is parsed once into its lines, with the section and
+key of each "key: value  # comment" line, and every variant PrepFragger_v2 needs (database path edited, PeptideProphet
+only, steps disabled, PTMProphet command line options) is made from the one parse. Keys are matched exactly
+(whatever their indentation within the section), optionally only within a section, and edited lines keep their
+indentation, comment and line ending; all other lines are kept exactly as read.
+
+Run directly to check that a yml round-trips unchanged and that edits only change the edited values:
+python PhilosopherConfig.py /path/to/philosopher.yml
+Tests (on the sample yml in tests/data): python -m unittest discover tests
+"""
+import re
+import sys
+
+LINE_PATTERN = re.compile(r'^(?P<indent>[ \t]*)(?P<key>[^\s#:\-][^#:]*?)[ \t]*:(?P<sep>[ \t]*)(?P<value>[^#\r\n]*?)(?P<comment>[ \t]*#[^\r\n]*)?(?P<newline>\r?\n?)$')
+# copy_yml_disable_tools tool names: Steps keys (v4 yml)
+STEP_KEYS = {'peptide': 'Peptide Validation',
+             'ptmp': 'PTM Localization',
+             'protein': 'Protein Inference',
+             'lfq': 'Label-Free Quantification',
+             'labelq': 'Isobaric Quantification',
+             'fdr': 'FDR Filtering',
+             'report': 'Individual Reports'}
+PTMPROPHET_SECTION = 'ptmprophet'
+# PTMProphet yml key: (command line option, how the value is used). 'value': OPTION=value, 'nonempty': OPTION=value
+# if set, 'flag': OPTION if true, 'raw': value as is
+PTMPROPHET_OPTIONS = {'cions': ('CIONS', 'nonempty'),
+                      'nions': ('NIONS', 'nonempty'),
+                      'em': ('EM', 'value'),
+                      'static': ('STATIC', 'flag'),
+                      'fragppmtol': ('FRAGPPMTOL', 'value'),
+                      'lability': ('LABILITY', 'flag'),
+                      'ppmtol': ('PPMTOL', 'value'),
+                      'minprob': ('MINPROB', 'value'),
+                      'maxthreads': ('MAXTHREADS', 'value'),
+                      'mods': ('', 'raw'),
+                      'massdiffmode': ('MASSDIFFMODE', 'flag'),
+                      'excludemassdiffmin': ('EXCLUDEMASSDIFFMIN', 'value'),
+                      'excludemassdiffmax': ('EXCLUDEMASSDIFFMAX', 'value')}
+
+
+def section_name(name):
+    """
+    Normalize a section name for matching (case and punctuation insensitive, e.g. 'PTMProphet' == 'ptm-prophet')
+    :param name: section name
+    :type name: str
+    :return: normalized name
+    :rtype: str
+    """
+    return re.sub(r'[^a-z0-9]', '', name.lower())
+
+
+class ConfigLine(object):
+    """
+    container for one line of the yml: the line as read and, for key lines, its parts
+    """
+    text: str
+    section: str
+    match: re.Match
+
+    def __init__(self, text, section, match):
+        self.text = text
+        self.section = section
+        self.match = match
+
+    def key(self):
+        """
+        :return: key (None for comments, blank lines, list items, etc)
+        :rtype: str
+        """
+        return self.match.group('key') if self.match is not None else None
+
+    def value(self):
+        """
+        :return: value, without comment or surrounding whitespace (None if not a key line)
+        :rtype: str
+        """
+        return self.match.group('value').strip() if self.match is not None else None
+
+    def with_value(self, value):
+        """
+        Get the line with a new value, keeping indentation, comment and line ending
+        :param value: new value
+        :type value: str
+        :return: edited line
+        :rtype: str
+        """
+        match = self.match
+        comment = match.group('comment') or ''
+        if match.group('value') == '':
+            # separator whitespace only lined up the comment
+            sep = ' '
+            comment = ' ' + comment.strip() if comment != '' else ''
+        else:
+            sep = match.group('sep') if match.group('sep') != '' else ' '
+        return '{}{}:{}{}{}{}'.format(match.group('indent'), match.group('key'), sep, value, comment, match.group('newline'))
+
+
+class PhilosopherConfig(object):
+    """
+    Philosopher yml parsed once into lines, to make edited variants from
+    """
+    lines: list
+
+    def __init__(self, lines):
+        """
+        :param lines: lines of the yml file
+        :type lines: list
+        """
+        self.lines = []
+        section = ''
+        for text in lines:
+            match = LINE_PATTERN.match(text)
+            if match is not None and match.group('indent') == '' and match.group('value') == '':
+                # top level key with no value starts a section
+                section = section_name(match.group('key'))
+            self.lines.append(ConfigLine(text, section, match))
+
+    def find(self, key, section=None):
+        """
+        Get the lines with a key
+        :param key: key (exact match)
+        :type key: str
+        :param section: if provided, only lines in this section
+        :type section: str
+        :return: list of ConfigLines
+        :rtype: list
+        """
+        return [x for x in self.lines if x.key() == key and x.match.group('indent') != '' and (section is None or x.section == section_name(section))]
+
+    def get(self, key, section=None):
+        """
+        Get the value of a key (first match)
+        :param key: key
+        :type key: str
+        :param section: if provided, only look in this section
+        :type section: str
+        :return: value, or None if the key is not in the file
+        :rtype: str
+        """
+        found = self.find(key, section)
+        return found[0].value() if len(found) > 0 else None
+
+    def edit_lines(self, edits):
+        """
+        Get the lines of the yml with edited values. Keys not in the file are ignored
+        :param edits: dict of key: new value, or (section, key): new value to only edit the key in that section
+        :type edits: dict
+        :return: list of lines
+        :rtype: list
+        """
+        key_edits = {}
+        section_edits = {}
+        for key, value in edits.items():
+            if isinstance(key, tuple):
+                section_edits[(section_name(key[0]), key[1])] = value
+            else:
+                key_edits[key] = value
+        output = []
+        for line in self.lines:
+            key = line.key()
+            if key is not None and line.match.group('indent') != '':
+                if (line.section, key) in section_edits:
+                    output.append(line.with_value(section_edits[(line.section, key)]))
+                    continue
+                if key in key_edits:
+                    output.append(line.with_value(key_edits[key]))
+                    continue
+            output.append(line.text)
+        return output
+
+    def disable_steps_lines(self, tools_to_disable):
+        """
+        Get the lines with the Steps of the provided tools turned off (see STEP_KEYS)
+        :param tools_to_disable: list of tool names ('peptide', 'protein', etc)
+        :type tools_to_disable: list
+        :return: list of lines
+        :rtype: list
+        """
+        return self.edit_lines({STEP_KEYS[x]: 'no' for x in tools_to_disable if x in STEP_KEYS})
+
+    def ptmprophet_options(self):
+        """
+        Generate the command line options for PTMProphet from its section of the yml (in file order)
+        :return: formatted command line option string
+        :rtype: str
+        """
+        outputs = []
+        for line in self.lines:
+            if line.section == PTMPROPHET_SECTION and line.key() in PTMPROPHET_OPTIONS and line.match.group('indent') != '':
+                option, kind = PTMPROPHET_OPTIONS[line.key()]
+                value = line.value()
+                if kind == 'raw':
+                    outputs.append(value)
+                elif kind == 'flag':
+                    if value == 'true':
+                        outputs.append(option)
+                elif kind == 'value' or value != '':
+                    outputs.append('{}={}'.format(option, value))
+        return ' '.join(outputs)
+
+
+def read_config(yml_path):
+    """
+    Read and parse a yml file
+    :param yml_path: full path to yml file
+    :type yml_path: str
+    :return: parsed config
+    :rtype: PhilosopherConfig
+    """
+    with open(yml_path, 'r', newline='') as readfile:
+        return PhilosopherConfig(list(readfile))
+
+
+def check_round_trip(yml_path):
+    """
+    Check that a yml is written back unchanged when nothing is edited, and that editing every key only changes the
+    value of each key line (same key, section, indentation and comment when parsed again). Prints any problems
+    :param yml_path: yml file to check
+    :type yml_path: str
+    :return: True if the checks pass
+    :rtype: bool
+    """
+    with open(yml_path, 'r', newline='') as readfile:
+        text = readfile.read()
+    config = PhilosopherConfig(text.splitlines(keepends=True))
+    success = True
+    if ''.join(config.edit_lines({})) != text:
+        print('ERROR: unedited output differs from {}'.format(yml_path))
+        success = False
+
+    key_lines = [x for x in config.lines if x.key() is not None and x.match.group('indent') != '']
+    edits = {(x.section, x.key()): 'edited_{}'.format(index) for index, x in enumerate(key_lines)}
+    edited = PhilosopherConfig(config.edit_lines(edits))
+    for original, new in zip(config.lines, edited.lines):
+        if original.key() is None or original.match.group('indent') == '':
+            if original.text != new.text:
+                print('ERROR: line changed without an edit: {}'.format(original.text.rstrip()))
+                success = False
+            continue
+        expected = edits[(original.section, original.key())]
+        if (new.key(), new.section, new.value()) != (original.key(), original.section, expected) or \
+                new.match.group('indent') != original.match.group('indent') or \
+                (new.match.group('comment') or '').strip() != (original.match.group('comment') or '').strip():
+            print('ERROR: edited line not parsed back as edited: {} -> {}'.format(original.text.rstrip(), new.text.rstrip()))
+            success = False
+    print('{}: {} lines, {} keys, round trip {}'.format(yml_path, len(config.lines), len(key_lines), 'OK' if success else 'FAILED'))
+    return success
+
+
+if __name__ == '__main__':
+    results = [check_round_trip(x) for x in sys.argv[1:]]
+    if not all(results):
+        exit(1)
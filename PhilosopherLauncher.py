@@ -0,0 +1,235 @@
+"""
+Bounded Philosopher launcher for PrepFragger_v2 results. Runs the phil.sh script in each results folder with at
+most a set number of Philosopher runs at once, and only starts another run if its memory fits under the memory
+ceiling (and, on linux, the node still has that much memory available). Folders that already have a psm.tsv are
+skipped. Blocks until all runs are done, then prints the status of each folder.
+
+Each run's exit code is saved to PHIL_EXIT_NAME in its folder (serial mode scripts from PrepFragger_v2 write it
+too), so the status of a folder can be checked later with --summary.
+
+To Use (on the node):
+python3 PhilosopherLauncher.py /path/to/__FraggerResults [more folders] [--slots 4] [--memory 128] [--job-memory 32]
+python3 PhilosopherLauncher.py --summary /path/to/__FraggerResults       only print the status of each folder
+"""
+import argparse
+import os
+import subprocess
+import time
+
+PHIL_SLOTS = 4              # max Philosopher runs at once
+PHIL_MEMORY_GB = 128        # max total memory (GB) of running Philosopher runs
+PHIL_JOB_MEMORY_GB = 32     # memory (GB) to reserve per Philosopher run
+POLL_INTERVAL = 10          # seconds between checks for finished runs
+PHIL_SCRIPT_NAME = 'phil.sh'
+PHIL_LOG_NAME = 'phil.log'
+PHIL_EXIT_NAME = 'phil.exit'
+DONE_FILE = 'psm.tsv'
+
+STATUS_OK = 'done'
+STATUS_SKIPPED = 'skipped ({} exists)'.format(DONE_FILE)
+STATUS_FAILED = 'failed'
+STATUS_NO_OUTPUT = 'finished without {}'.format(DONE_FILE)
+STATUS_NOT_RUN = 'not run'
+
+
+def find_folders(paths):
+    """
+    Get the folders to run Philosopher in: each path that has a phil.sh, otherwise each subfolder of the path
+    that has one
+    :param paths: list of results folders (or single run folders)
+    :type paths: list
+    :return: list of folders
+    :rtype: list
+    """
+    folders = []
+    for path in paths:
+        if os.path.exists(os.path.join(path, PHIL_SCRIPT_NAME)):
+            candidates = [path]
+        else:
+            candidates = [os.path.join(path, x) for x in sorted(os.listdir(path))]
+        for folder in candidates:
+            if os.path.isdir(folder) and os.path.exists(os.path.join(folder, PHIL_SCRIPT_NAME)) and folder not in folders:
+                folders.append(folder)
+    return folders
+
+
+def available_memory_gb():
+    """
+    Get the memory available on this node (linux only)
+    :return: GB available, or None if unknown
+    :rtype: float
+    """
+    try:
+        with open('/proc/meminfo', 'r') as readfile:
+            for line in readfile:
+                if line.startswith('MemAvailable'):
+                    return int(line.split()[1]) / 1024 ** 2
+    except OSError:
+        pass
+    return None
+
+
+def start_phil(folder):
+    """
+    Launch the phil.sh of a folder, logging to phil.log in the folder
+    :param folder: run folder
+    :type folder: str
+    :return: running process
+    :rtype: subprocess.Popen
+    """
+    logfile = open(os.path.join(folder, PHIL_LOG_NAME), 'w')
+    process = subprocess.Popen(['bash', os.path.join(folder, PHIL_SCRIPT_NAME)], stdout=logfile, stderr=subprocess.STDOUT)
+    logfile.close()     # child has its own handle
+    return process
+
+
+def save_exit_code(folder, return_code):
+    """
+    :param folder: run folder
+    :type folder: str
+    :param return_code: exit code of the run
+    :type return_code: int
+    :return: void
+    """
+    with open(os.path.join(folder, PHIL_EXIT_NAME), 'w') as outfile:
+        outfile.write('{}\n'.format(return_code))
+
+
+def folder_status(folder):
+    """
+    Get the status of a folder from its saved exit code and outputs
+    :param folder: run folder
+    :type folder: str
+    :return: status string
+    :rtype: str
+    """
+    try:
+        with open(os.path.join(folder, PHIL_EXIT_NAME), 'r') as readfile:
+            return_code = int(readfile.read().strip())
+    except (OSError, ValueError):
+        return STATUS_SKIPPED if os.path.exists(os.path.join(folder, DONE_FILE)) else STATUS_NOT_RUN
+    if return_code != 0:
+        return '{} (exit code {})'.format(STATUS_FAILED, return_code)
+    return STATUS_OK if os.path.exists(os.path.join(folder, DONE_FILE)) else STATUS_NO_OUTPUT
+
+
+def run_folders(folders, slots=PHIL_SLOTS, memory_gb=PHIL_MEMORY_GB, job_memory_gb=PHIL_JOB_MEMORY_GB, poll_interval=POLL_INTERVAL):
+    """
+    Run Philosopher in each folder, in order, with at most slots runs (and memory_gb of reserved memory) at once.
+    A run is always started if nothing else is running, even if the node reports less memory available
+    :param folders: list of run folders
+    :type folders: list
+    :param slots: max runs at once
+    :type slots: int
+    :param memory_gb: max total reserved memory (GB)
+    :type memory_gb: float
+    :param job_memory_gb: memory (GB) reserved per run
+    :type job_memory_gb: float
+    :param poll_interval: seconds between checks for finished runs
+    :type poll_interval: float
+    :return: dict of folder: status
+    :rtype: dict
+    """
+    results = {}
+    pending = []
+    for folder in folders:
+        if os.path.exists(os.path.join(folder, DONE_FILE)):
+            results[folder] = STATUS_SKIPPED
+        else:
+            pending.append(folder)
+    running = {}
+    start_time = time.time()
+
+    while len(pending) > 0 or len(running) > 0:
+        # collect finished runs
+        for folder, process in list(running.items()):
+            return_code = process.poll()
+            if return_code is not None:
+                del running[folder]
+                save_exit_code(folder, return_code)
+                results[folder] = folder_status(folder)
+                print('finished {}: {} after {:.1f} min'.format(folder, results[folder], (time.time() - start_time) / 60))
+
+        # start runs while slots and memory allow
+        while len(pending) > 0 and len(running) < slots and (len(running) + 1) * job_memory_gb <= max(memory_gb, job_memory_gb):
+            available = available_memory_gb()
+            if len(running) > 0 and available is not None and available < job_memory_gb:
+                break
+            folder = pending.pop(0)
+            running[folder] = start_phil(folder)
+            print('started {}; {} running, {} waiting'.format(folder, len(running), len(pending)))
+
+        if len(running) > 0:
+            time.sleep(poll_interval)
+    return results
+
+
+def print_summary(results):
+    """
+    Print the status of each folder
+    :param results: dict of folder: status
+    :type results: dict
+    :return: True if no run failed
+    :rtype: bool
+    """
+    print('Philosopher runs:')
+    for folder, status in results.items():
+        print('\t{}: {}'.format(folder, status))
+    failed = [x for x in results.values() if x.startswith(STATUS_FAILED)]
+    if len(failed) > 0:
+        print('ERROR: {} of {} Philosopher runs failed'.format(len(failed), len(results)))
+    return len(failed) == 0
+
+
+def positive_int(value):
+    """
+    argparse type for a count of at least 1
+    :param value: command line value
+    :type value: str
+    :return: int
+    :rtype: int
+    """
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError('must be at least 1, got {}'.format(value))
+    return number
+
+
+def main(paths, slots=PHIL_SLOTS, memory_gb=PHIL_MEMORY_GB, job_memory_gb=PHIL_JOB_MEMORY_GB, summary_only=False):
+    """
+    Run (or only check) Philosopher in all folders found in the provided paths and print a summary
+    :param paths: list of results folders (or single run folders)
+    :type paths: list
+    :param slots: max runs at once
+    :type slots: int
+    :param memory_gb: max total reserved memory (GB)
+    :type memory_gb: float
+    :param job_memory_gb: memory (GB) reserved per run
+    :type job_memory_gb: float
+    :param summary_only: only print the status of each folder, do not run anything
+    :type summary_only: bool
+    :return: True if no run failed
+    :rtype: bool
+    """
+    if slots < 1:
+        print('ERROR: at least 1 Philosopher slot is needed, got {}'.format(slots))
+        return False
+    folders = find_folders(paths)
+    if summary_only:
+        results = {folder: folder_status(folder) for folder in folders}
+    else:
+        print('running Philosopher in {} folders, {} at once'.format(len(folders), min(slots, max(1, int(memory_gb // job_memory_gb)))))
+        results = run_folders(folders, slots, memory_gb, job_memory_gb)
+    return print_summary(results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run phil.sh in PrepFragger results folders, a limited number at once')
+    parser.add_argument('paths', nargs='+', help='results folder(s) with one subfolder per run, or run folder(s)')
+    parser.add_argument('--slots', type=positive_int, default=PHIL_SLOTS, help='max Philosopher runs at once')
+    parser.add_argument('--memory', type=float, default=PHIL_MEMORY_GB, help='max total memory (GB) of running Philosopher runs')
+    parser.add_argument('--job-memory', type=float, default=PHIL_JOB_MEMORY_GB, help='memory (GB) to reserve per Philosopher run')
+    parser.add_argument('--summary', action='store_true', help='only print the status of each folder')
+    args = parser.parse_args()
+    if not main(args.paths, args.slots, args.memory, args.job_memory, args.summary):
+        exit(1)
@@ -7,6 +7,7 @@ Module to do gruntwork for preparing many fragger runs in various folders
 import os
 import shutil
 import PrepIndividFDRruns
+import PathTranslation
 
 PREP_INDIVID_TOO = False
 INDIVID_SHELL = r"Z:\dpolasky\tools\Philosopher_shells\philosopher_shell_individ.sh"      # mass width 4000, open search
@@ -70,17 +71,26 @@ def get_db_file(param_file):
     :return: DB file relative path string to write to files
     """
     with open(param_file, 'r') as readfile:
-        for line in list(readfile):
-            if line.startswith('database_name'):
-                splits = line.rstrip('\n').split('=')
-                if '#' in splits[1]:
-                    db_file = splits[1].split('#')[0].strip()
-                else:
-                    db_file = splits[1].strip()
-                # handle pre-digested fastas (pass the original fasta to Philosopher, leave the digested one for Fragger). Requires that both are in same directory
-                if '_digest.fasta' in db_file:
-                    db_file = db_file.rstrip('_digest.fasta') + '.fasta'
-                return db_file
+        return get_db_file_from_lines(readfile)
+
+
+def get_db_file_from_lines(param_lines):
+    """
+    Read the database path from the lines of a parameters file (see get_db_file)
+    :param param_lines: iterable of param file lines
+    :return: DB file relative path string to write to files
+    """
+    for line in param_lines:
+        if line.startswith('database_name'):
+            splits = line.rstrip('\n').split('=')
+            if '#' in splits[1]:
+                db_file = splits[1].split('#')[0].strip()
+            else:
+                db_file = splits[1].strip()
+            # handle pre-digested fastas (pass the original fasta to Philosopher, leave the digested one for Fragger). Requires that both are in same directory
+            if '_digest.fasta' in db_file:
+                db_file = db_file.rstrip('_digest.fasta') + '.fasta'
+            return db_file
 
 
 def update_folder_linux(folder_name):
@@ -89,18 +99,7 @@ def update_folder_linux(folder_name):
     :param folder_name: path to update
     :return: updated path
     """
-    if folder_name.startswith('//corexfs'):
-        linux_name = folder_name.replace('//corexfs.med.umich.edu/proteomics', '/storage')
-        linux_name = linux_name.replace('\\', '/')
-    elif folder_name.startswith('\\\\corexfs'):
-        folder_name = folder_name.replace('\\', '/')
-        linux_name = folder_name.replace('//corexfs.med.umich.edu/proteomics', '/storage')
-    elif folder_name.startswith('Z:'):
-        linux_name = folder_name.replace('Z:', '/storage')
-        linux_name = linux_name.replace('\\', '/')
-    else:
-        linux_name = folder_name
-    return linux_name
+    return PathTranslation.to_linux(folder_name)
 
 
 def update_folder_windows(folder_name):
@@ -109,12 +108,7 @@ def update_folder_windows(folder_name):
     :param folder_name: path to update
     :return: updated path
     """
-    if folder_name.startswith('/storage'):
-        win_name = folder_name.replace('/storage', 'Z:')
-        win_name = win_name.replace('/', '\\')
-    else:
-        win_name = folder_name
-    return win_name
+    return PathTranslation.to_windows(folder_name)
 
 
 def gen_single_shell(params_file, db_file, subfolder, shell_template, individ_folder=None, fragger_jar=None,
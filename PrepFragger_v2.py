@@ -3,14 +3,14 @@ alternative method to prep fragger runs, using philosopher pipeline and easier h
 """
 
 import PrepFraggerRuns
-import tkinter
-from tkinter import filedialog
-import tkfilebrowser
+import concurrent.futures
 import os
+import posixpath
 import shutil
 import subprocess
 from dataclasses import dataclass
 import EditParams
+import PhilosopherConfig
 
 # FRAGGER_JARNAME = 'msfragger-2.4-RC4_Glyco-1.0_20200316.one-jar.jar'  # deiso paper
 # FRAGGER_JARNAME = 'msfragger-2.4-RC6_Glyco-1.0_20200320_intFilterFix.one-jar.jar'   # Sciex deiso paper
@@ -28,7 +28,7 @@ FRAGGER_JARNAME = 'msfragger-3.4-rc4-jar-with-dependencies.jar'
 USE_BATCH = False
 
 # SERIAL_PHILOSOPHER = False
-SERIAL_PHILOSOPHER = True      # Serial philosopher is more convenient in most cases, but CANNOT be used with multi-activation or enzyme methods (as these need all runs to finish for combined phil runs)
+SERIAL_PHILOSOPHER = True      # Serial philosopher is more convenient in most cases. Multi-activation/enzyme runs start Philosopher once the last search of the param set is done
 
 FRAGGER_MEM = 200
 RAW_FORMAT = '.mzML'
@@ -67,6 +67,20 @@ SPLIT_DB_SCRIPT = '/storage/dpolasky/tools/msfragger_pep_split_20191106.py'
 OVERRIDE_MAINDIR = True    # default True. If false, will read maindir from file rather than using the param path (use false for combined runs)
 
 TOOL_DIR_PATH = '/storage/dpolasky/tools'
+TMT_REPORT_FOLDER = 'tmt-report'
+TMTI_SECTION = 'TMTIntegrator'      # yml section with the TMT-Integrator path/memory/output/mod_tag
+WRITE_THREADS = 16      # parallel folder/file writes when saving generated runs (network share latency)
+PHIL_SLOTS = 4          # max Philosopher runs at once
+PHIL_MEMORY_GB = 128    # max total memory (GB) of running Philosopher runs
+PHIL_JOB_MEMORY_GB = 32     # memory (GB) to reserve per Philosopher run
+PHIL_LAUNCHER_PYTHON = 'python3'
+PHIL_LAUNCHER_SCRIPT = TOOL_DIR_PATH + '/PhilosopherLauncher.py'     # copy of PhilosopherLauncher.py readable from the nodes
+PHIL_SCRATCH_PATH = None    # node-local folder (linux) to run each Philosopher workspace in (None: run in the results folder)
+# PHIL_SCRATCH_PATH = '/tmp/philosopher'
+PHIL_SCRATCH_QUOTA_GB = 100     # max size of a scratch workspace (each running workspace has this much reserved on scratch)
+PHIL_SCRATCH_CHECK_SECONDS = 30     # seconds between workspace size checks
+PHIL_SCRATCH_CONFIG_FOLDER = 'scratch_configs'  # yml copies with the absolute fasta path, next to each yml, for scratch workspaces
+PHIL_OUTPUTS = ['psm.tsv', 'peptide.tsv', 'protein.tsv', 'ion.tsv']    # copied back from scratch to the results folder
 
 
 @dataclass
@@ -91,7 +105,127 @@ class RunContainer(object):
     is_last_activation_type: bool
 
 
-def prepare_runs_yml(params_files, yml_files, raw_path_files, shell_template, main_dir, activation_types, enzymes, raw_names_list, fragger_jar, annotation_path):
+class RunMatrix(object):
+    """
+    Files for generating many runs at once: each input file (base params, yml, shell template) is read once and
+    kept in memory, and generated files are kept in memory (identical outputs collapse to one) until write_all
+    writes all folders and files together on a thread pool. yml files are also parsed only once (read_config)
+    """
+    input_lines: dict
+    output_lines: dict
+    copies: dict
+    folders: set
+    generated: set
+    configs: dict
+
+    def __init__(self):
+        self.input_lines = {}
+        self.output_lines = {}
+        self.copies = {}
+        self.folders = set()
+        self.generated = set()
+        self.configs = {}
+
+    def read_lines(self, path):
+        """
+        Get the lines of a file: from a generated file not yet written, otherwise from the file (read only once)
+        :param path: file path
+        :type path: str
+        :return: list of lines
+        :rtype: list
+        """
+        key = os.path.normcase(os.path.normpath(path))
+        if key in self.output_lines:
+            return self.output_lines[key][1]
+        if key not in self.input_lines:
+            with open(path, 'r') as readfile:
+                self.input_lines[key] = list(readfile)
+        return self.input_lines[key]
+
+    def read_config(self, path):
+        """
+        Get a parsed Philosopher yml (see read_lines), parsed again only if the file has been regenerated since
+        :param path: yml file path
+        :type path: str
+        :return: parsed config
+        :rtype: PhilosopherConfig.PhilosopherConfig
+        """
+        key = os.path.normcase(os.path.normpath(path))
+        lines = self.read_lines(path)
+        if key not in self.configs or self.configs[key][0] is not lines:
+            self.configs[key] = (lines, PhilosopherConfig.PhilosopherConfig(lines))
+        return self.configs[key][1]
+
+    def write_lines(self, path, lines, newline=''):
+        """
+        Save a generated file (written by write_all, replacing any earlier version of the same file)
+        :param path: file path
+        :type path: str
+        :param lines: lines to write
+        :type lines: list
+        :param newline: newline handling when writing (see open): '' writes lines as is (shell scripts), None
+        writes the platform line ending (params and yml files)
+        :type newline: str
+        :return: void
+        """
+        self.output_lines[os.path.normcase(os.path.normpath(path))] = (path, list(lines), newline)
+
+    def copy_file(self, source, destination):
+        """
+        Copy a file (done by write_all)
+        :param source: file to copy
+        :type source: str
+        :param destination: path to copy to
+        :type destination: str
+        :return: void
+        """
+        self.copies[os.path.normcase(os.path.normpath(destination))] = (source, destination)
+
+    def make_folder(self, path):
+        """
+        Make a folder if it does not exist (done by write_all, before writing files)
+        :param path: folder path
+        :type path: str
+        :return: void
+        """
+        self.folders.add(path)
+
+    def write_all(self, max_workers=WRITE_THREADS):
+        """
+        Make all folders, then write all generated files and copies, in parallel
+        :param max_workers: number of threads
+        :type max_workers: int
+        :return: void
+        """
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(lambda x: os.makedirs(x, exist_ok=True), self.folders))
+            futures = [executor.submit(write_file, path, lines, newline) for path, lines, newline in self.output_lines.values()]
+            futures.extend([executor.submit(shutil.copy, source, destination) for source, destination in self.copies.values()])
+            for future in futures:
+                future.result()
+        # written files are now inputs with the same contents
+        self.input_lines.update({key: value[1] for key, value in self.output_lines.items()})
+        self.output_lines = {}
+        self.copies = {}
+        self.folders = set()
+
+
+def write_file(path, lines, newline=''):
+    """
+    :param path: file to write
+    :type path: str
+    :param lines: lines to write
+    :type lines: list
+    :param newline: newline handling (see open)
+    :type newline: str
+    :return: void
+    """
+    with open(path, 'w', newline=newline) as outfile:
+        for line in lines:
+            outfile.write(line)
+
+
+def prepare_runs_yml(params_files, yml_files, raw_path_files, shell_template, main_dir, activation_types, enzymes, raw_names_list, fragger_jar, annotation_path, matrix=None):
     """
     Generates subfolders for each Fragger .params file found in the provided outer directory. Uses
     params file name as a the subfolder name
@@ -104,9 +238,18 @@ def prepare_runs_yml(params_files, yml_files, raw_path_files, shell_template, ma
     :param enzymes: list of enzyme strings (or '')
     :param raw_names_list: list of raw names (only required if >1 raw path provided)
     :param fragger_jar: name of the fragger jar file (including .jar). NOT including path since that's appended from ToolDir in the shell script
+    :param matrix: files shared by all runs being generated (written by its write_all). If not provided, files are written before returning
+    :type matrix: RunMatrix
     :return: void
     """
     run_containers = []
+    write_now = matrix is None
+    if write_now:
+        matrix = RunMatrix()
+    # every combination of raw path x yml x params x enzyme x activation type, each listed value only once
+    run_enzymes = list(dict.fromkeys(enzymes)) if len(enzymes) > 1 else [None]      # single enzyme run: enzyme from the params file
+    run_activations = list(dict.fromkeys(activation_types)) if len(activation_types) > 0 else [None]
+    duplicates = 0
     for index, raw_path in enumerate(raw_path_files):
         # handle raw names to append
         try:
@@ -120,38 +263,27 @@ def prepare_runs_yml(params_files, yml_files, raw_path_files, shell_template, ma
                 print('ERROR: more raw paths provided than names; skipping')
                 return []
 
-        for yml_file in yml_files:
+        for yml_file in dict.fromkeys(yml_files):
             # For each param file, make a subfolder in each raw subfolder to run that analysis
-            for params_file in params_files:
-                if len(enzymes) > 1:
-                    # multi-enzyme run
-                    for enzyme in enzymes:
-                        if len(activation_types) > 0:
-                            for act_index, activation_type in enumerate(activation_types):
-                                if act_index + 1 == len(activation_types):
-                                    run_container = generate_single_run(params_file, yml_file, raw_path, shell_template, main_dir, fragger_jar, activation_type=activation_type, enzyme=enzyme, raw_name_append=raw_path_append, annotation_path=annotation_path, is_last_activation_type=True)
-                                else:
-                                    run_container = generate_single_run(params_file, yml_file, raw_path, shell_template, main_dir, fragger_jar, activation_type=activation_type, enzyme=enzyme, raw_name_append=raw_path_append, annotation_path=annotation_path, is_last_activation_type=False)
-                                run_containers.append(run_container)
-                        else:
-                            run_container = generate_single_run(params_file, yml_file, raw_path, shell_template, main_dir, fragger_jar, enzyme=enzyme, raw_name_append=raw_path_append, annotation_path=annotation_path)
-                            run_containers.append(run_container)
-                else:
-                    # single enzyme run
-                    if len(activation_types) > 0:
-                        for act_index, activation_type in enumerate(activation_types):
-                            if act_index + 1 == len(activation_types):
-                                run_container = generate_single_run(params_file, yml_file, raw_path, shell_template, main_dir, fragger_jar, activation_type=activation_type, raw_name_append=raw_path_append, annotation_path=annotation_path, is_last_activation_type=True)
-                            else:
-                                run_container = generate_single_run(params_file, yml_file, raw_path, shell_template, main_dir, fragger_jar, activation_type=activation_type, raw_name_append=raw_path_append, annotation_path=annotation_path, is_last_activation_type=False)
-                            run_containers.append(run_container)
-                    else:
-                        run_container = generate_single_run(params_file, yml_file, raw_path, shell_template, main_dir, fragger_jar, raw_name_append=raw_path_append, annotation_path=annotation_path)
+            for params_file in dict.fromkeys(params_files):
+                for enzyme in run_enzymes:
+                    for act_index, activation_type in enumerate(run_activations):
+                        variant = (main_dir, raw_path, raw_path_append, yml_file, params_file, enzyme, activation_type)
+                        if variant in matrix.generated:
+                            duplicates += 1
+                            continue
+                        matrix.generated.add(variant)
+                        run_container = generate_single_run(params_file, yml_file, raw_path, shell_template, main_dir, fragger_jar, activation_type=activation_type, enzyme=enzyme,
+                                                            raw_name_append=raw_path_append, annotation_path=annotation_path, is_last_activation_type=act_index + 1 == len(run_activations), matrix=matrix)
                         run_containers.append(run_container)
+    if duplicates > 0:
+        print('Warning: skipped {} runs identical to runs already generated'.format(duplicates))
+    if write_now:
+        matrix.write_all()
     return run_containers
 
 
-def generate_single_run(base_param_path, yml_file, raw_path, shell_template, main_dir, fragger_jar, activation_type=None, enzyme=None, raw_name_append='', annotation_path='', is_last_activation_type=True):
+def generate_single_run(base_param_path, yml_file, raw_path, shell_template, main_dir, fragger_jar, activation_type=None, enzyme=None, raw_name_append='', annotation_path='', is_last_activation_type=True, matrix=None):
     """
     Generate a RunContainer from the provided information and return it
     :param base_param_path: .params file for Fragger (path)
@@ -163,12 +295,16 @@ def generate_single_run(base_param_path, yml_file, raw_path, shell_template, mai
     :param enzyme: string ('TRYP', etc)
     :param raw_name_append: if provided, append this name to output folder to distinguish between runs of same params on different raw data
     :param fragger_jar: name of the fragger jar file (including .jar). NOT including path since that's appended from ToolDir in the shell script
+    :param matrix: files shared by all runs being generated (written by its write_all). If not provided, files are written before returning
+    :type matrix: RunMatrix
     :return: RunContainer
     :rtype: RunContainer
     """
+    write_now = matrix is None
+    if write_now:
+        matrix = RunMatrix()
     run_folder = os.path.join(main_dir, '__FraggerResults')
-    if not os.path.exists(run_folder):
-        os.makedirs(run_folder)
+    matrix.make_folder(run_folder)
 
     param_name = os.path.basename(os.path.splitext(base_param_path)[0])
     if raw_name_append is not '':
@@ -176,61 +312,53 @@ def generate_single_run(base_param_path, yml_file, raw_path, shell_template, mai
     else:
         combined_name = param_name
     param_subfolder = os.path.join(run_folder, combined_name)
-    params_filename = param_name + '.params'
-    if not os.path.exists(param_subfolder):
-        os.makedirs(param_subfolder)
+    matrix.make_folder(param_subfolder)
 
     if enzyme is not None:
         enzyme_subfolder = os.path.join(param_subfolder, enzyme)
-        if not os.path.exists(enzyme_subfolder):
-            os.makedirs(enzyme_subfolder)
-
-        if activation_type is not '':
-            param_path = EditParams.create_param_file(base_param_path, activation_type=activation_type, output_dir=enzyme_subfolder, enzyme=enzyme, remove_localize_delta_mass=REMOVE_LOCALIZE_DELTAMASS)
-        else:
-            param_path = EditParams.create_param_file(base_param_path, activation_type=None, output_dir=enzyme_subfolder, enzyme=enzyme, remove_localize_delta_mass=REMOVE_LOCALIZE_DELTAMASS)
-
+        matrix.make_folder(enzyme_subfolder)
+        param_folder = enzyme_subfolder
     else:
         # single enzyme run
-        if not activation_type == '':
-            param_path = EditParams.create_param_file(base_param_path, activation_type=activation_type, output_dir=param_subfolder, remove_localize_delta_mass=REMOVE_LOCALIZE_DELTAMASS)
-        else:
-            param_path = EditParams.create_param_file(base_param_path, activation_type=None, output_dir=param_subfolder, remove_localize_delta_mass=REMOVE_LOCALIZE_DELTAMASS)
-            # param_path = os.path.join(param_subfolder, params_filename)
-            # shutil.copy(base_param_path, param_path)
         enzyme_subfolder = ''
+        param_folder = param_subfolder
+    param_activation = activation_type if activation_type != '' else None
+    base_param_lines = matrix.read_lines(base_param_path)
+    param_lines = EditParams.edit_param_lines(base_param_lines, activation_type=param_activation, enzyme=enzyme, remove_localize_delta_mass=REMOVE_LOCALIZE_DELTAMASS)
+    param_path = None
+    if param_lines is not None:
+        param_path = EditParams.get_param_file_path(base_param_path, param_folder, param_activation)
+        matrix.write_lines(param_path, param_lines, newline=None)
 
     # get database file
-    db_file = PrepFraggerRuns.get_db_file(base_param_path)
-
+    db_file = PrepFraggerRuns.get_db_file_from_lines(base_param_lines)
+
+    # copy yml file for philosopher and edit the fasta path in it
+    yml_output_path = os.path.join(param_subfolder, 'philosopher.yml')
+    yml_edits = get_yml_database_edits(param_subfolder, db_file, disable_peptide_prophet=enzyme is not None)
+    matrix.write_lines(yml_output_path, matrix.read_config(yml_file).edit_lines(yml_edits), newline=None)
+    if RUN_TMTI:
+        matrix.make_folder(os.path.join(param_subfolder, TMT_REPORT_FOLDER))
     if enzyme is not None:
         # make 2 ymls - one for peptide prophet only and one for the main philosopher run
-        enzyme_yml = make_yml_peptideproph_only(yml_file, '../{}'.format(db_file), enzyme, enzyme_subfolder)
+        enzyme_yml = make_yml_peptideproph_only(yml_file, '../{}'.format(db_file), enzyme, enzyme_subfolder, matrix=matrix)
         enzyme_yml_linux = PrepFraggerRuns.update_folder_linux(enzyme_yml)
-
-        yml_output_path = os.path.join(param_subfolder, 'philosopher.yml')
-        shutil.copy(yml_file, yml_output_path)
-        edit_yml(yml_output_path, db_file, disable_peptide_prophet=True)
         if annotation_path is not '':
-            shutil.copy(annotation_path, os.path.join(enzyme_subfolder, os.path.basename(annotation_path)))
+            matrix.copy_file(annotation_path, os.path.join(enzyme_subfolder, os.path.basename(annotation_path)))
         if RUN_PTMPROPHET:
-            copy_yml_disable_tools(yml_output_path, ['peptide'], param_subfolder)
+            copy_yml_disable_tools(yml_output_path, ['peptide'], param_subfolder, matrix=matrix)
         # symlink_raw_files(enzyme_subfolder, raw_path, RAW_FORMAT, activation_type, enzyme)
         yml_final_linux_path = PrepFraggerRuns.update_folder_linux(yml_output_path)
         run_container = RunContainer(param_subfolder, param_path, db_file, shell_template, raw_path,
                                      yml_final_linux_path, fragger_jar, FRAGGER_MEM, RAW_FORMAT, activation_type,
                                      enzyme_subfolder, enzyme, enzyme_yml_linux, SPLIT_DBS, is_last_activation_type)
-        gen_single_shell_activation(run_container, write_output=True, run_philosopher=False)
+        gen_single_shell_activation(run_container, write_output=True, run_philosopher=False, matrix=matrix)
 
     else:
-        # copy yml file for philosopher and edit the fasta path in it
-        yml_output_path = os.path.join(param_subfolder, 'philosopher.yml')
-        shutil.copy(yml_file, yml_output_path)
-        edit_yml(yml_output_path, db_file)
         if annotation_path is not '':
-            shutil.copy(annotation_path, os.path.join(param_subfolder, os.path.basename(annotation_path)))
+            matrix.copy_file(annotation_path, os.path.join(param_subfolder, os.path.basename(annotation_path)))
         if RUN_PTMPROPHET and not PTMPROPHET_MANUAL:
-            copy_yml_disable_tools(yml_output_path, ['peptide'], param_subfolder)
+            copy_yml_disable_tools(yml_output_path, ['peptide'], param_subfolder, matrix=matrix)
         # symlink raw files for downstream tools - doesn't work if running philosopher on linux because these are windows symlinks...
         # symlink_raw_files(param_subfolder, raw_path, RAW_FORMAT, activation_type, '')
         yml_final_linux_path = PrepFraggerRuns.update_folder_linux(yml_output_path)
@@ -238,7 +366,9 @@ def generate_single_run(base_param_path, yml_file, raw_path, shell_template, mai
         # generate single shell for individual runs (if desired)
         run_container = RunContainer(param_subfolder, param_path, db_file, shell_template, raw_path, yml_final_linux_path,
                                      fragger_jar, FRAGGER_MEM, RAW_FORMAT, activation_type, '', '', '', SPLIT_DBS, is_last_activation_type)
-        gen_single_shell_activation(run_container, write_output=True, run_philosopher=True)
+        gen_single_shell_activation(run_container, write_output=True, run_philosopher=True, matrix=matrix)
+    if write_now:
+        matrix.write_all()
     return run_container
 
 
@@ -316,24 +446,41 @@ def gen_multilevel_shell(run_containers, main_dir, run_folders=None):
     # generate shell text
     # header
     all_subfolders = []
+    serial_subfolders = []
+    matrix = RunMatrix()
+    run_groups = get_run_groups(run_containers)
     for index, run_container in enumerate(run_containers):
         output_shell_lines.append('# Fragger Run {} of {}*************************************\n'.format(index + 1, len(run_containers)))
-        run_shell_lines = gen_single_shell_activation(run_container, write_output=False, run_philosopher=False)
+        # serial mode: multi-enzyme PeptideProphet runs with the rest of Philosopher, after the last search of the group
+        run_shell_lines = gen_single_shell_activation(run_container, write_output=False, run_philosopher=False, matrix=matrix, peptide_prophet=not SERIAL_PHILOSOPHER)
         for line in run_shell_lines:
             output_shell_lines.append(line)
         output_shell_lines.append('\n')
 
         if SERIAL_PHILOSOPHER:
-            # new serial philosopher mode - start run after each fragger run, but in parallel so next run can continue
-            if run_container.activation_type is not '' or run_container.enzyme is not '':
-                print('WARNING: serial philosopher run for multi-activation or enzyme run...Philosopher may be called multiple times on same files while still running! Use non-serial mode for these analyses')
-            subfolder = get_final_subfolder_linux(run_container)
-            output_shell_lines.append('#Run philosopher\n{}/phil.sh &> {}/phil.log &\n\n'.format(subfolder, subfolder))
+            # new serial philosopher mode - start run after the last fragger run of each group, but in parallel so next run can continue
+            group = run_groups[run_container.subfolder]
+            if run_container is not group[-1]:
+                continue
+            if run_container.enzyme is not '':
+                # combined run: PeptideProphet in each enzyme subfolder, then the rest of Philosopher on all of them
+                matrix.write_lines(os.path.join(run_container.subfolder, 'phil.sh'), gen_group_philosopher_lines(group, matrix))
+            subfolder = PrepFraggerRuns.update_folder_linux(run_container.subfolder)
+            output_shell_lines.append('#Run philosopher (once a slot is free)\n')
+            output_shell_lines.extend(gen_phil_throttle_lines())
+            output_shell_lines.append('({0}/phil.sh &> {0}/phil.log && echo 0 > {0}/phil.exit || echo $? > {0}/phil.exit) &\n\n'.format(subfolder))
+            if subfolder not in serial_subfolders:
+                serial_subfolders.append(subfolder)
         else:
             # add philosopher run on all subfolders at the end
             if run_container.subfolder not in all_subfolders:
                 all_subfolders.append(run_container.subfolder)
 
+    if SERIAL_PHILOSOPHER and len(serial_subfolders) > 0:
+        # don't exit before the last Philosopher runs are done
+        output_shell_lines.append('#********************Wait for Philosopher Runs*******************\nwait\n')
+        output_shell_lines.append('{} {} --summary {}\n'.format(PHIL_LAUNCHER_PYTHON, PHIL_LAUNCHER_SCRIPT, ' '.join(serial_subfolders)))
+
     if not SERIAL_PHILOSOPHER:
         # don't run philosopher in shell because this has to be run in the docker container, and philosopher has to be run outside it
         if not RAW_FORMAT == '.d':
@@ -346,10 +493,9 @@ def gen_multilevel_shell(run_containers, main_dir, run_folders=None):
                     output_shell_lines.append('cd ../\n')
                 write_multi_phil(output_shell_lines, run_containers, all_subfolders)
             else:
-                # multiple run subfolders. CD to each in the list in turn
-                for run_folder in run_folders:
-                    output_shell_lines.append('cd {}/__FraggerResults\n'.format(PrepFraggerRuns.update_folder_linux(run_folder)))
-                    write_multi_phil(output_shell_lines, run_containers, all_subfolders)
+                # multiple run subfolders. Run philosopher in all of them together
+                results_folders = ['{}/__FraggerResults'.format(PrepFraggerRuns.update_folder_linux(x)) for x in run_folders]
+                write_multi_phil(output_shell_lines, run_containers, all_subfolders, results_folders)
 
     # else:
     #     # old serial philosopher code. Does NOT currently support multi-enzyme mode or outer directory fanciness
@@ -362,27 +508,26 @@ def gen_multilevel_shell(run_containers, main_dir, run_folders=None):
     #         output_shell_lines.append('\n')
 
     # write final output to shell
-    with open(output_shell_name, 'w', newline='') as shellfile:
-        for line in output_shell_lines:
-            shellfile.write(line)
+    matrix.write_all()
+    write_file(output_shell_name, output_shell_lines)
     return output_shell_lines
 
 
-def write_multi_phil(output_shell_lines, run_containers, all_subfolders):
+def write_multi_phil(output_shell_lines, run_containers, all_subfolders, results_folders=None):
     """
     helper for writing out the multitrheaded philosopher shell code to call in multiple places. Edits the
-    provided list of lines and returns it.
+    provided list of lines and returns it. Philosopher is run by PhilosopherLauncher in each subfolder (with a
+    phil.sh and no psm.tsv yet) of the results folders, at most PHIL_SLOTS at once, and the shell waits for all
+    runs to finish.
+    :param results_folders: linux paths of the folders containing the run subfolders (default: current folder)
+    :type results_folders: list
     :return: updated list of output lines
     :rtype:
     """
-    output_shell_lines.append('for folder in *; do\n')  # loop over everything in results directory
-    output_shell_lines.append('\tif [[ -d $folder ]]; then\n')  # if item is a directory, consider it
-    output_shell_lines.append('\t\tif [[ ! -e $folder/psm.tsv ]] && [[ -e $folder/phil.sh ]] ; then\n')  # don't run philosopher if psm.tsv already exists (prevent re-running old results)
-    output_shell_lines.append('\t\t\techo $folder\n')
-    output_shell_lines.append('\t\t\t$folder/phil.sh &> $folder/phil.log &\n')  # run philospher shell script
-    output_shell_lines.append('\t\tfi\n')
-    output_shell_lines.append('\tfi\n')
-    output_shell_lines.append('done\n')
+    if results_folders is None:
+        results_folders = ['.']
+    output_shell_lines.append('{} {} --slots {} --memory {} --job-memory {} {}\n'.format(PHIL_LAUNCHER_PYTHON, PHIL_LAUNCHER_SCRIPT,
+                                                                                    PHIL_SLOTS, PHIL_MEMORY_GB, PHIL_JOB_MEMORY_GB, ' '.join(results_folders)))
 
     # if multienzyme, we also need to prep combined philosopher runs with manual parameters, since the individual philosopher shells don't work (b/c pipeline can't handle multienzyme)
     if run_containers[0].enzyme is not '':
@@ -402,7 +547,84 @@ def write_multi_phil(output_shell_lines, run_containers, all_subfolders):
     return output_shell_lines
 
 
-def gen_philosopher_lines_no_template(run_container: RunContainer, outer_shell=False):
+def get_run_groups(run_containers):
+    """
+    Group runs by their param subfolder. All activation types (and enzymes, in their enzyme subfolders) of a param
+    set are searched into the same subfolder, so Philosopher for the group can only start once the last of them is done
+    :param run_containers: list of run containers, in run order
+    :type run_containers: list[RunContainer]
+    :return: dict of subfolder: list of run containers in run order (the last is the group's last search)
+    :rtype: dict
+    """
+    run_groups = {}
+    for run_container in run_containers:
+        run_groups.setdefault(run_container.subfolder, []).append(run_container)
+    return run_groups
+
+
+def gen_group_philosopher_lines(group, matrix=None):
+    """
+    Philosopher shell for a multi-enzyme group (serial mode): PeptideProphet in each enzyme subfolder (from the run of
+    its last activation type), then the combined ProteinProphet/filter/report run in the param subfolder
+    :param group: run containers of the group, in run order
+    :type group: list[RunContainer]
+    :param matrix: files shared by all runs being generated
+    :type matrix: RunMatrix
+    :return: list of lines
+    :rtype: list
+    """
+    output = ['#!/bin/bash\nset -xe\n\n']
+    output.append('toolDirPath="{}"\n'.format(TOOL_DIR_PATH))
+    output.append('philosopherPath=$toolDirPath/philosopher\n')
+    for run_container in group:
+        if run_container.is_last_activation_type:
+            output.append('cd {}\n'.format(PrepFraggerRuns.update_folder_linux(run_container.enzyme_subfolder)))
+            output.extend(gen_enzyme_peptideprophet_lines(run_container, matrix))
+    # combined run (without its header)
+    output.extend(gen_philosopher_lines_no_template(group[-1], outer_shell=True, matrix=matrix)[1:])
+    return output
+
+
+def gen_enzyme_peptideprophet_lines(run_container: RunContainer, matrix):
+    """
+    Shell lines to run PeptideProphet in a multi-enzyme subfolder and move its results up to the param subfolder.
+    With PHIL_SCRATCH_PATH, PeptideProphet runs in its own scratch workspace (see gen_scratch_workspace_lines), in a
+    subshell so the workspace, its lock and TMPDIR end with it
+    :param run_container: run of the enzyme's last activation type
+    :type run_container: RunContainer
+    :param matrix: files shared by all runs being generated (written by its write_all)
+    :type matrix: RunMatrix
+    :return: list of lines
+    :rtype: list
+    """
+    if PHIL_SCRATCH_PATH is None:
+        return ['$philosopherPath workspace --clean\n$philosopherPath workspace --init\n$philosopherPath pipeline --config philosopher.yml ./\nanalysisName=${PWD##*/}\nmv ./interact.pep.xml ../${analysisName}_interact.pep.xml\n\n']
+    output = ['(\n']
+    output.extend(gen_scratch_workspace_lines())
+    output.append('$philosopherPath workspace --clean\n$philosopherPath workspace --init\n')
+    output.append('$philosopherPath pipeline --config {} ./\n'.format(get_workspace_config(run_container.enzyme_yml_path, run_container, matrix)))
+    output.append('cp $scratchDir/interact.pep.xml $resultsDir/\n)\n')
+    output.append('analysisName=${PWD##*/}\nmv ./interact.pep.xml ../${analysisName}_interact.pep.xml\n\n')
+    return output
+
+
+def gen_phil_throttle_lines():
+    """
+    Shell lines that wait until fewer than PHIL_SLOTS background Philosopher runs are running (and, if any are
+    running, the node has PHIL_JOB_MEMORY_GB available and another run fits in PHIL_MEMORY_GB) before the next one
+    is started. Serial mode equivalent of PhilosopherLauncher
+    :return: list of lines
+    :rtype: list
+    """
+    max_runs = max(1, min(PHIL_SLOTS, int(PHIL_MEMORY_GB // PHIL_JOB_MEMORY_GB)))
+    output = ['set +x\n']
+    output.append('while [[ $(jobs -rp | wc -l) -ge {0} || ( $(jobs -rp | wc -l) -gt 0 && $(awk \'/MemAvailable/ {{print int($2 / 1048576)}}\' /proc/meminfo) -lt {1} ) ]]; do\n'.format(max_runs, int(PHIL_JOB_MEMORY_GB)))
+    output.append('\tsleep 10\n')
+    output.append('done\nset -x\n')
+    return output
+
+
+def gen_philosopher_lines_no_template(run_container: RunContainer, outer_shell=False, matrix=None):
     """
     Non-template version (generates all lines for greater flexibility) of gen_philosopher lines. Generates
     shell script code to run philosopher according to provided parameters.
@@ -412,16 +634,27 @@ def gen_philosopher_lines_no_template(run_container: RunContainer, outer_shell=F
     :type run_container: RunContainer
     :param outer_shell: specify if running from the outer folder in multi-enzyme mode (the second philosopher shell) to hard code the proteinProphet/etc commands instead of using pipeline
     :type outer_shell: bool
+    :param matrix: files shared by all runs being generated (written by its write_all). If not provided, files are written before returning
+    :type matrix: RunMatrix
     :return: void
     :rtype:
     """
+    write_now = matrix is None
+    if write_now:
+        matrix = RunMatrix()
     output = ['#!/bin/bash\nset -xe\n\n']
     output.append('cd {}\n'.format(PrepFraggerRuns.update_folder_linux(run_container.subfolder)))
-    # add check to avoid running on empty directories and filling up /tmp/
+    # add check to avoid running on empty directories (and making empty workspaces)
     output = check_empty_phil(output)
     output.append('toolDirPath="{}"\n'.format(TOOL_DIR_PATH))
     output.append('philosopherPath=$toolDirPath/philosopher\n')
-    output.append('fastaPath="{}"\n'.format(run_container.database_file))
+    results_folder = PrepFraggerRuns.update_folder_linux(run_container.subfolder)
+    if PHIL_SCRATCH_PATH is not None:
+        # absolute fasta path, since the workspace is not in the results folder
+        output.append('fastaPath="$(realpath -m "{}")"\n'.format(run_container.database_file))
+        output.extend(gen_scratch_workspace_lines())
+    else:
+        output.append('fastaPath="{}"\n'.format(run_container.database_file))
     output.append('$philosopherPath workspace --clean\n')
     output.append('$philosopherPath workspace --init\n')
     # initial pipeline run
@@ -430,18 +663,19 @@ def gen_philosopher_lines_no_template(run_container: RunContainer, outer_shell=F
     if run_container.enzyme is '':
         if PTMPROPHET_MANUAL and RUN_PTMPROPHET:
             # run peptideProphet only first to prepare for PTMP run
-            pep_proph_config = copy_yml_disable_tools(run_container.yml_file, [], run_container.subfolder, only_run_tools=['peptide'])
-            output.append('$philosopherPath pipeline --config {} ./\n'.format(pep_proph_config))
+            pep_proph_config = copy_yml_disable_tools(run_container.yml_file, [], run_container.subfolder, only_run_tools=['peptide'], matrix=matrix)
+            output.append('$philosopherPath pipeline --config {} ./\n'.format(get_workspace_config(pep_proph_config, run_container, matrix)))
         else:
-            output.append('$philosopherPath pipeline --config {} ./\n'.format(run_container.yml_file))
+            output.append('$philosopherPath pipeline --config {} ./\n'.format(get_workspace_config(run_container.yml_file, run_container, matrix)))
     else:
         if not outer_shell:
             # inner (enzyme) folder phil shell just uses pipeline (standard behavior)
-            output.append('$philosopherPath pipeline --config {} ./\n'.format(run_container.enzyme_yml_path))
+            output.append('$philosopherPath pipeline --config {} ./\n'.format(get_workspace_config(run_container.enzyme_yml_path, run_container, matrix)))
         else:
             # CANNOT run pipeline for multi-enzyme data because it doesn't expect multiple interact.pep.xml files. Run manually
             print('WARNING: protein prophet, filter, and report commands are hard-coded for multi-enzyme mode and will NOT be read from your yml')
-            output.append('fastaPath="{}"\n'.format(run_container.database_file))
+            if PHIL_SCRATCH_PATH is None:
+                output.append('fastaPath="{}"\n'.format(run_container.database_file))
             output.append('decoyPrefix="rev_"\n')
             output.append('$philosopherPath database --annotate $fastaPath --prefix $decoyPrefix\n')
             output.append('$philosopherPath proteinprophet --maxppmdiff 2000000000 ./*.pep.xml\n')
@@ -455,86 +689,144 @@ def gen_philosopher_lines_no_template(run_container: RunContainer, outer_shell=F
             # copy PTMProphetParser to dir
             output.append('cp {} ./\n'.format(PrepFraggerRuns.update_folder_linux(PTMPROPHET_PARSER_PATH)))
             # set up PTMP options and specify path to .interact.pep.xml (assumes this is the output from peptide prophet)
-            ptmp_options = get_ptmprophet_options_from_yml(run_container.yml_file)
+            ptmp_options = get_ptmprophet_options_from_yml(run_container.yml_file, matrix=matrix)
             ptmp_command = './{} {} {}\n'.format(os.path.basename(PTMPROPHET_PARSER_PATH), ptmp_options, './interact.pep.xml')
             output.append(ptmp_command)     # PTMP command
             # rest of philosopher
-            updated_yml = copy_yml_disable_tools(run_container.yml_file, ['peptide', 'ptmp'], run_container.subfolder)
-            output.append('$philosopherPath pipeline --config ./philosopher_toolsDisabled.yml ./\n')
+            updated_yml = copy_yml_disable_tools(run_container.yml_file, ['peptide', 'ptmp'], run_container.subfolder, matrix=matrix)
+            output.append('$philosopherPath pipeline --config {} ./\n'.format(get_workspace_config(updated_yml, run_container, matrix, default='./philosopher_toolsDisabled.yml')))
             output.append('rm ./{}\n'.format(os.path.basename(PTMPROPHET_PARSER_PATH)))
         else:
+            disabled_yml = posixpath.join(results_folder, 'philosopher_toolsDisabled.yml')
             output.append('index=1\n')
             output.append('while [[ $index -lt 5 && (! -e ./interact.mod.pep.xml) ]]; do\n')
-            output.append('\t$philosopherPath pipeline --config ./philosopher_toolsDisabled.yml ./ |& tee phil_ptmp-rerun_${index}.log\n')
+            output.append('\t$philosopherPath pipeline --config {} ./ |& tee phil_ptmp-rerun_${{index}}.log\n'.format(get_workspace_config(disabled_yml, run_container, matrix, default='./philosopher_toolsDisabled.yml')))
             output.append('\tindex=$((index + 1))\n')
             output.append('done \n')
             output.append('set -e\n')       # turn stop-on-error back on to catch fragger errors/etc in the next analysis
 
+    if PHIL_SCRATCH_PATH is not None:
+        output.extend(gen_scratch_copy_back_lines())
     output.append('analysisName=${PWD##*/}\n')
     output.append('cp ./psm.tsv ../${analysisName}_psm.tsv\n')
     output.append('cp ./peptide.tsv ../${analysisName}_peptide.tsv\n')
     output.append('cp ./protein.tsv ../${analysisName}_protein.tsv\n')
     output.append('cp ./ion.tsv ../${analysisName}_ion.tsv\n')
+    if write_now:
+        matrix.write_all()
+    return output
+
+
+def gen_scratch_workspace_lines():
+    """
+    Shell lines to move a Philosopher run from the results folder (current folder) to a new workspace in
+    PHIL_SCRATCH_PATH: the inputs (pepXML, mzML, annotation) are linked, and Philosopher's temporary files also go to
+    the workspace (yml files are used from PHIL_SCRATCH_CONFIG_FOLDER, see get_workspace_config). Each running
+    workspace holds a lock on its .alive file and has PHIL_SCRATCH_QUOTA_GB reserved: a new one is only made (under a
+    lock, waiting for others to finish if needed) if the free space covers that for all of them, and a background
+    watchdog stops the run if its workspace grows over it. The workspace is deleted when the (sub)shell exits;
+    workspaces whose lock is not held are left by killed runs and deleted by the next run. The results folder is saved
+    as $resultsDir (see gen_scratch_copy_back_lines)
+    :return: list of lines
+    :rtype: list
+    """
+    quota_kb = int(PHIL_SCRATCH_QUOTA_GB * 1024 ** 2)
+    output = ['# run in a workspace on local scratch\n']
+    output.append('resultsDir=$PWD\n')
+    output.append('scriptPid=$BASHPID\n')
+    output.append('mkdir -p {}\n'.format(PHIL_SCRATCH_PATH))
+    output.append('set +x\n')
+    # free space (plus what running workspaces already use) must cover the quota of each running workspace and the new one
+    output.append('exec 9> {}/.workspace.lock\n'.format(PHIL_SCRATCH_PATH))
+    output.append('while true; do\n\tflock 9\n')
+    output.append('\tworkspaces=0\n\tused=0\n')
+    output.append('\tfor workspace in {}/phil_*; do\n'.format(PHIL_SCRATCH_PATH))
+    output.append('\t\tif [[ ! -d $workspace ]]; then\n\t\t\tcontinue\n\t\tfi\n')
+    output.append('\t\tif flock -n $workspace/.alive true 2> /dev/null; then\n')
+    output.append('\t\t\techo "removing Philosopher workspace $workspace left by a run that is gone"\n\t\t\trm -rf $workspace\n')
+    output.append('\t\telse\n\t\t\tworkspaces=$((workspaces + 1))\n')
+    output.append('\t\t\tused=$((used + $(du -sk $workspace | cut -f1)))\n\t\tfi\n\tdone\n')
+    output.append('\tfree=$(df -Pk {} | awk \'NR==2 {{print $4}}\')\n'.format(PHIL_SCRATCH_PATH))
+    output.append('\tif [[ $((free + used)) -ge $(((workspaces + 1) * {})) ]]; then\n\t\tbreak\n\tfi\n'.format(quota_kb))
+    output.append('\tflock -u 9\n')
+    output.append('\tif [[ $workspaces -eq 0 ]]; then\n')
+    output.append('\t\techo "ERROR: less than {} GB free in {}, not running Philosopher"\n\t\texit 1\n\tfi\n'.format(PHIL_SCRATCH_QUOTA_GB, PHIL_SCRATCH_PATH))
+    output.append('\techo "waiting for space in {} ($workspaces Philosopher workspaces running)"\n'.format(PHIL_SCRATCH_PATH))
+    output.append('\tsleep {}\ndone\n'.format(PHIL_SCRATCH_CHECK_SECONDS))
+    output.append('scratchDir=$(mktemp -d {}/phil_XXXXXX)\n'.format(PHIL_SCRATCH_PATH))
+    # held until the (sub)shell and Philosopher exit
+    output.append('exec 8> $scratchDir/.alive\nflock 8\n')
+    output.append('exec 9>&-\n')
+    output.append('(exec 8>&-\nwatchdogSelf=$BASHPID\nwhile kill -0 $scriptPid 2> /dev/null; do\n')
+    output.append('\tsleep {}\n'.format(PHIL_SCRATCH_CHECK_SECONDS))
+    output.append('\tif [[ $(du -sk $scratchDir | cut -f1) -gt {} ]]; then\n'.format(quota_kb))
+    output.append('\t\techo "ERROR: Philosopher workspace $scratchDir is over {} GB, stopping"\n'.format(PHIL_SCRATCH_QUOTA_GB))
+    # stop Philosopher (children of the script except the watchdog), then the script itself
+    output.append('\t\tkill $(pgrep -P $scriptPid | grep -v -x $watchdogSelf) $scriptPid\n\t\tbreak\n\tfi\ndone) &\n')
+    output.append('watchdogPid=$!\n')
+    output.append('trap \'set +e; kill $watchdogPid 2> /dev/null; rm -rf $scratchDir\' EXIT\n')
+    output.append('trap \'exit 1\' TERM\n')
+    output.append('mkdir $scratchDir/tmp\nexport TMPDIR=$scratchDir/tmp\n')
+    output.append('for file in $resultsDir/*.pepXML $resultsDir/*.pep.xml $resultsDir/*.mzML $resultsDir/*annotation.txt; do\n')
+    output.append('\tif [[ -e $file ]]; then\n\t\tln -s $file $scratchDir/\n\tfi\ndone\nset -x\n')
+    output.append('cd $scratchDir\n')
     return output
 
 
-def get_ptmprophet_options_from_yml(yml_file):
+def gen_scratch_copy_back_lines():
+    """
+    Shell lines to copy the final reports (PHIL_OUTPUTS) from the scratch workspace back to the results folder and
+    return there (see gen_scratch_workspace_lines)
+    :return: list of lines
+    :rtype: list
+    """
+    output = ['for file in {}; do\n'.format(' '.join(PHIL_OUTPUTS))]
+    output.append('\tif [[ -e $scratchDir/$file ]]; then\n\t\tcp $scratchDir/$file $resultsDir/\n\tfi\ndone\n')
+    output.append('cd $resultsDir\n')
+    return output
+
+
+def get_workspace_config(yml_path, run_container, matrix, default=None):
+    """
+    Get the path of a yml file to use from the Philosopher workspace. With scratch workspaces, this is a copy (in
+    PHIL_SCRATCH_CONFIG_FOLDER next to the yml) with the absolute fasta path, as the workspace is not in the results
+    folder. Otherwise the yml itself
+    :param yml_path: linux path of the yml file (relative paths are in the results folder)
+    :type yml_path: str
+    :param run_container: run the Philosopher shell is for
+    :type run_container: RunContainer
+    :param matrix: files shared by all runs being generated (the copy is written by its write_all)
+    :type matrix: RunMatrix
+    :param default: path to use if not using scratch workspaces (default: yml_path)
+    :type default: str
+    :return: path to use in the shell script
+    :rtype: str
+    """
+    if PHIL_SCRATCH_PATH is None:
+        return default if default is not None else yml_path
+    results_folder = PrepFraggerRuns.update_folder_linux(run_container.subfolder)
+    yml_path = posixpath.normpath(posixpath.join(results_folder, yml_path))
+    fasta_path = posixpath.normpath(posixpath.join(results_folder, run_container.database_file))
+    yml_windows = PrepFraggerRuns.update_folder_windows(yml_path)
+    config_path = os.path.join(os.path.dirname(yml_windows), PHIL_SCRATCH_CONFIG_FOLDER, os.path.basename(yml_windows))
+    matrix.make_folder(os.path.dirname(config_path))
+    matrix.write_lines(config_path, matrix.read_config(yml_windows).edit_lines({'protein_database': fasta_path}), newline=None)
+    return PrepFraggerRuns.update_folder_linux(config_path)
+
+
+def get_ptmprophet_options_from_yml(yml_file, matrix=None):
     """
     Generate the command line options for PTMProphet from the yml file
     :param yml_file: full path to file to parse (assumed linux path)
     :type yml_file: str
+    :param matrix: files shared by all runs being generated, to read the yml from if it has not been written yet
+    :type matrix: RunMatrix
     :return: formatted command line option string
     :rtype: str
     """
-    # read file
-    outputs = []
-    with open(PrepFraggerRuns.update_folder_windows(yml_file), 'r') as readfile:
-        for line in list(readfile):
-            if line.startswith('  cions'):
-                value = line.split(':')[1].split('#')[0].strip()
-                if value is not '':
-                    outputs.append('CIONS={}'.format(value))
-            elif line.startswith('  nions'):
-                value = line.split(':')[1].split('#')[0].strip()
-                if value is not '':
-                    outputs.append('NIONS={}'.format(value))
-            elif line.startswith('  em'):
-                value = line.split(':')[1].split('#')[0].strip()
-                outputs.append('EM={}'.format(value))
-            elif line.startswith('  static'):
-                value = line.split(':')[1].split('#')[0].strip()
-                if value == 'true':
-                    outputs.append('STATIC')
-            elif line.startswith('  fragppmtol'):
-                value = line.split(':')[1].split('#')[0].strip()
-                outputs.append('FRAGPPMTOL={}'.format(value))
-            elif line.startswith('  lability'):
-                value = line.split(':')[1].split('#')[0].strip()
-                if value == 'true':
-                    outputs.append('LABILITY')
-            elif line.startswith('  ppmtol'):
-                value = line.split(':')[1].split('#')[0].strip()
-                outputs.append('PPMTOL={}'.format(value))
-            elif line.startswith('  minprob'):
-                value = line.split(':')[1].split('#')[0].strip()
-                outputs.append('MINPROB={}'.format(value))
-            elif line.startswith('  maxthreads'):
-                value = line.split(':')[1].split('#')[0].strip()
-                outputs.append('MAXTHREADS={}'.format(value))
-            elif line.startswith('  mods'):
-                value = ':'.join(line.split(':')[1:]).split('#')[0].strip()
-                outputs.append('{}'.format(value))
-            elif line.startswith('  massdiffmode'):
-                value = line.split(':')[1].split('#')[0].strip()
-                if value == 'true':
-                    outputs.append('MASSDIFFMODE')
-            elif line.startswith('  excludemassdiffmin'):
-                value = line.split(':')[1].split('#')[0].strip()
-                outputs.append('EXCLUDEMASSDIFFMIN={}'.format(value))
-            elif line.startswith('  excludemassdiffmax'):
-                value = line.split(':')[1].split('#')[0].strip()
-                outputs.append('EXCLUDEMASSDIFFMAX={}'.format(value))
-    return ' '.join(outputs)
+    if matrix is None:
+        matrix = RunMatrix()
+    return matrix.read_config(PrepFraggerRuns.update_folder_windows(yml_file)).ptmprophet_options()
 
 
 def edit_yml(yml_file, database_path, disable_peptide_prophet=False):
@@ -545,33 +837,40 @@ def edit_yml(yml_file, database_path, disable_peptide_prophet=False):
     :param disable_peptide_prophet: for multi-enzyme searches
     :return: void
     """
-    lines = []
-    with open(yml_file, 'r') as readfile:
-        for line in list(readfile):
-            if line.startswith('  protein_database'):
-                line = '  protein_database: {}\n'.format(database_path)
-            if line.startswith('  peptideprophet'):
-                if disable_peptide_prophet:
-                    line = '  peptideprophet: no\n'
-            if RUN_TMTI:    # edit TMT-I params
-                if line.startswith('  path'):
-                    line = '  path: {}\n'.format(PrepFraggerRuns.update_folder_linux(TMTI_PATH))
-                if line.startswith('  memory'):
-                    line = '  memory: {}\n'.format(FRAGGER_MEM)
-                if line.startswith('  output'):
-                    tmt_dir = os.path.join(os.path.dirname(yml_file), 'tmt-report')
-                    if not os.path.exists(tmt_dir):
-                        os.makedirs(tmt_dir)
-                    line = '  output: {}\n'.format(PrepFraggerRuns.update_folder_linux(tmt_dir))
-                if line.startswith('  mod_tag'):
-                    line = '  mod_tag: {}\n'.format(TMTI_MODS)
-            lines.append(line)
-
-    with open(yml_file, 'w') as outfile:
+    config = PhilosopherConfig.read_config(yml_file)
+    lines = config.edit_lines(get_yml_database_edits(os.path.dirname(yml_file), database_path, disable_peptide_prophet))
+    if RUN_TMTI:
+        tmt_dir = os.path.join(os.path.dirname(yml_file), TMT_REPORT_FOLDER)
+        if not os.path.exists(tmt_dir):
+            os.makedirs(tmt_dir)
+
+    with open(yml_file, 'w', newline='') as outfile:
         for line in lines:
             outfile.write(line)
 
 
+def get_yml_database_edits(yml_folder, database_path, disable_peptide_prophet=False):
+    """
+    Get the yml edits for a run (see edit_yml): fasta database path, and TMT-Integrator settings if RUN_TMTI. Does
+    not make the TMT-I output folder (TMT_REPORT_FOLDER in yml_folder)
+    :param yml_folder: folder the edited yml is saved in
+    :type yml_folder: str
+    :param database_path: path string
+    :param disable_peptide_prophet: for multi-enzyme searches
+    :return: dict of yml key (or (section, key)): value
+    :rtype: dict
+    """
+    edits = {'protein_database': database_path}
+    if disable_peptide_prophet:
+        edits['peptideprophet'] = 'no'
+    if RUN_TMTI:    # edit TMT-I params
+        edits[(TMTI_SECTION, 'path')] = PrepFraggerRuns.update_folder_linux(TMTI_PATH)
+        edits[(TMTI_SECTION, 'memory')] = FRAGGER_MEM
+        edits[(TMTI_SECTION, 'output')] = PrepFraggerRuns.update_folder_linux(os.path.join(yml_folder, TMT_REPORT_FOLDER))
+        edits[(TMTI_SECTION, 'mod_tag')] = TMTI_MODS
+    return edits
+
+
 def get_final_subfolder_linux(run_container: RunContainer):
     """
     Determine the final linux path of the run folder for a given run (allowing for multi-enzyme mode, etc)
@@ -609,7 +908,7 @@ def check_empty_phil(output):
     return output
 
 
-def make_yml_peptideproph_only(yml_base, database_path, enzyme, output_subfolder, v4=False):
+def make_yml_peptideproph_only(yml_base, database_path, enzyme, output_subfolder, v4=False, matrix=None):
     """
     For multi-enzyme search, make a yml file that only runs peptide prophet in the enyzme subdirectory
     :param yml_base: base yml file path
@@ -617,36 +916,31 @@ def make_yml_peptideproph_only(yml_base, database_path, enzyme, output_subfolder
     :param enzyme: enzyme string
     :param output_subfolder: where to save the edited file
     :param v4: if using a version 4 (aka version 3.3.x) of philosopher with reconfigured config file
+    :param matrix: files shared by all runs being generated (written by its write_all). If not provided, files are written before returning
+    :type matrix: RunMatrix
     :return: void
     """
-    lines = []
+    write_now = matrix is None
+    if write_now:
+        matrix = RunMatrix()
     if v4:
         print('version 4 NOT yet configured - please fix!')
-    with open(yml_base, 'r') as readfile:
-        for line in list(readfile):
-            if line.startswith('  protein_database'):
-                line = '  protein_database: {}\n'.format(database_path)
-
-            # turn off the other pipeline items
-            elif line.startswith('  proteinprophet'):
-                line = '  proteinprophet: no\n'
-            elif line.startswith('  filter'):
-                line = '  filter: no\n'
-            elif line.startswith('  report'):
-                line = '  report: no\n'
-            elif line.startswith('  enzyme'):
-                line = '  enzyme: {}\n'.format(EditParams.ENZYME_DATA[enzyme][0])
-            lines.append(line)
+    # turn off the other pipeline items
+    lines = matrix.read_config(yml_base).edit_lines({'protein_database': database_path,
+                                                     'proteinprophet': 'no',
+                                                     'filter': 'no',
+                                                     'report': 'no',
+                                                     'enzyme': EditParams.ENZYME_DATA[enzyme][0]})
 
     # write output
     new_path = os.path.join(output_subfolder, os.path.basename('philosopher.yml'))
-    with open(new_path, 'w') as outfile:
-        for line in lines:
-            outfile.write(line)
+    matrix.write_lines(new_path, lines, newline=None)
+    if write_now:
+        matrix.write_all()
     return new_path
 
 
-def copy_yml_disable_tools(existing_formatted_yml, tools_to_disable, output_subfolder, only_run_tools=None):
+def copy_yml_disable_tools(existing_formatted_yml, tools_to_disable, output_subfolder, only_run_tools=None, matrix=None):
     """
     Make a copy of the existing yml file with the specified tools disabled. NOTE: assumes v4 Philosopher yml
     :param existing_formatted_yml: existing yml (NOT template - actual file in the subfolder) to copy (path)
@@ -657,11 +951,15 @@ def copy_yml_disable_tools(existing_formatted_yml, tools_to_disable, output_subf
     :type output_subfolder: str
     :param only_run_tools: if specified, ONLY run the specified tools (disable all others). OVERRIDES tools_to_disable
     :type only_run_tools: list
+    :param matrix: files shared by all runs being generated (written by its write_all). If not provided, files are written before returning
+    :type matrix: RunMatrix
     :return: path to updated config file
     :rtype: str
     """
-    lines = []
-    allowed_tools = ['peptide', 'ptmp', 'protein', 'lfq', 'labelq', 'fdr', 'report']
+    write_now = matrix is None
+    if write_now:
+        matrix = RunMatrix()
+    allowed_tools = list(PhilosopherConfig.STEP_KEYS.keys())
     if only_run_tools is not None:
         # disable all except the specified tool(s)
         tools_to_disable = [x for x in allowed_tools if x not in only_run_tools]
@@ -671,39 +969,16 @@ def copy_yml_disable_tools(existing_formatted_yml, tools_to_disable, output_subf
         if tool not in allowed_tools:
             print('ERROR: tool {} is not implemented for yml disabling - please fix or implement'.format(tool))
 
-    with open(PrepFraggerRuns.update_folder_windows(existing_formatted_yml), 'r') as readfile:
-        for line in list(readfile):
-            if line.startswith('  Peptide Validation'):
-                if 'peptide' in tools_to_disable:
-                    line = '  Peptide Validation: no\n'
-            elif line.startswith('  PTM Localization'):
-                if 'ptmp' in tools_to_disable:
-                    line = '  PTM Localization: no\n'
-            elif line.startswith('  Protein Inference'):
-                if 'protein' in tools_to_disable:
-                    line = '  Protein Inference: no\n'
-            elif line.startswith('  Label-Free Quantification'):
-                if 'lfq' in tools_to_disable:
-                    line = '  Label-Free Quantification: no\n'
-            elif line.startswith('  Individual Reports'):
-                if 'report' in tools_to_disable:
-                    line = '  Individual Reports: no\n'
-            elif line.startswith('  Isobaric Quantification'):
-                if 'labelq' in tools_to_disable:
-                    line = '  Isobaric Quantification: no\n'
-            elif line.startswith('  FDR Filtering'):
-                if 'fdr' in tools_to_disable:
-                    line = '  FDR Filtering: no\n'
-            lines.append(line)
+    lines = matrix.read_config(PrepFraggerRuns.update_folder_windows(existing_formatted_yml)).disable_steps_lines(tools_to_disable)
 
     # write output
     if only_run_tools is not None:
         new_path = os.path.join(output_subfolder, os.path.basename('philosopher_onlyTools.yml'))    # different path so can use both in one run
     else:
         new_path = os.path.join(output_subfolder, os.path.basename('philosopher_toolsDisabled.yml'))
-    with open(new_path, 'w') as outfile:
-        for line in lines:
-            outfile.write(line)
+    matrix.write_lines(new_path, lines, newline=None)
+    if write_now:
+        matrix.write_all()
     return PrepFraggerRuns.update_folder_linux(new_path)
 
 
@@ -721,14 +996,20 @@ def copy_yml_disable_tools(existing_formatted_yml, tools_to_disable, output_subf
 #         return line, raw_name
 
 
-def gen_single_shell_activation(run_container: RunContainer, write_output, run_philosopher):
+def gen_single_shell_activation(run_container: RunContainer, write_output, run_philosopher, matrix=None, peptide_prophet=True):
     """
     Wrapper method to call gen_single_shell but from a RunContainer
     :param run_container: run container
     :param write_output: whether to save the output directly to file or only return it
     :param run_philosopher: skip all philosopher lines if false
+    :param peptide_prophet: multi-enzyme runs: run PeptideProphet after the last activation type's search (false: it is run by the group's phil.sh)
+    :param matrix: files shared by all runs being generated (written by its write_all). If not provided, files are written before returning
+    :type matrix: RunMatrix
     :return: list of lines
     """
+    write_now = matrix is None
+    if write_now:
+        matrix = RunMatrix()
     if run_container.enzyme_subfolder is not '':
         subfolder = run_container.enzyme_subfolder
     else:
@@ -736,9 +1017,9 @@ def gen_single_shell_activation(run_container: RunContainer, write_output, run_p
 
     new_shell_name = os.path.join(subfolder, 'fragger_shell.sh')
     phil_shell_name = os.path.join(subfolder, 'phil.sh')
-    shell_lines = PrepFraggerRuns.read_shell(run_container.shell_template)
+    shell_lines = matrix.read_lines(run_container.shell_template)
     output = []
-    phil_output = gen_philosopher_lines_no_template(run_container)
+    phil_output = gen_philosopher_lines_no_template(run_container, matrix=matrix)
 
     # add a 'cd' to allow pasting together
     linux_folder = PrepFraggerRuns.update_folder_linux(subfolder)
@@ -809,18 +1090,16 @@ def gen_single_shell_activation(run_container: RunContainer, write_output, run_p
         else:
             output.append(line)
 
-    if run_container.enzyme is not '':
+    if run_container.enzyme is not '' and peptide_prophet:
         # add peptide prophet run and moving out of subfolder. NOTE: only add pep prophet run if this is the LAST activation type (otherwise will create redundant runs)
         if run_container.is_last_activation_type:
-            output.append('$philosopherPath workspace --clean\n$philosopherPath workspace --init\n$philosopherPath pipeline --config philosopher.yml ./\nanalysisName=${PWD##*/}\nmv ./interact.pep.xml ../${analysisName}_interact.pep.xml\n\n')
+            output.extend(gen_enzyme_peptideprophet_lines(run_container, matrix))
 
     if write_output:
-        with open(new_shell_name, 'w', newline='') as shellfile:
-            for line in output:
-                shellfile.write(line)
-        with open(phil_shell_name, 'w', newline='') as philfile:
-            for line in phil_output:
-                philfile.write(line)
+        matrix.write_lines(new_shell_name, output)
+        matrix.write_lines(phil_shell_name, phil_output)
+    if write_now:
+        matrix.write_all()
     return output
 
 
@@ -855,15 +1134,19 @@ def gen_single_shell_activation(run_container: RunContainer, write_output, run_p
 #     if len(all_runs) > 1:
 #         gen_multilevel_shell(all_runs, maindir)
 
-def batch_multiple_main_dirs():
+def batch_multiple_main_dirs(dir_list=None):
     """
     Execute the batch_template_run method (except looking for single, standardized template file) in each of the
     provided directories so as to generate a "super batch" that can be run from a single combined shell script.
+    :param dir_list: directories to batch (if not provided, asks with a dialog)
+    :type dir_list: list
     :return: void
     :rtype:
     """
     # get directories
-    dir_list = tkfilebrowser.askopendirnames()
+    if dir_list is None:
+        import tkfilebrowser
+        dir_list = tkfilebrowser.askopendirnames()
 
     combined_shell_lines = ['#!/bin/bash\nset -xe\n\n']
     for index, main_dir in enumerate(dir_list):
@@ -888,12 +1171,16 @@ def batch_multiple_main_dirs():
             outfile.write(line)
 
 
-def batch_template_run(override_maindir):
+def batch_template_run(override_maindir, templates=None):
     """
     Select and load template file(s) to be run
+    :param override_maindir: if true, use param path directory as main dir
+    :param templates: template files to run (if not provided, asks with a dialog)
     :return: void
     """
-    templates = filedialog.askopenfilenames(filetypes=[('Templates', '.csv')])
+    if templates is None:
+        from tkinter import filedialog
+        templates = filedialog.askopenfilenames(filetypes=[('Templates', '.csv')])
     # Get set(s) of runs from each template and generate a multilevel shell for each
     for template in templates:
         template_run_list, main_dir, run_folders = parse_template(template, override_maindir)
@@ -913,6 +1200,7 @@ def parse_template(template_file, override_maindir=True):
     """
     run_list = []
     run_folders = []
+    matrix = RunMatrix()
     with open(template_file, 'r') as tempfile:
         for line in list(tempfile):
             if line.startswith('#'):
@@ -965,8 +1253,9 @@ def parse_template(template_file, override_maindir=True):
                                                       raw_path_files=raw_path_list, shell_template=splits[3],
                                                       main_dir=current_maindir, activation_types=activation_types,
                                                       enzymes=enzymes, raw_names_list=raw_names_list, fragger_jar=msfragger_jar,
-                                                      annotation_path=annotation_file)
+                                                      annotation_path=annotation_file, matrix=matrix)
                 run_list.extend(run_container_list)
+    matrix.write_all()
     return run_list, return_maindir, run_folders
 
 
@@ -1002,6 +1291,7 @@ def find_specific_files(starting_dir, endswith=None):
 
 
 if __name__ == '__main__':
+    import tkinter
     root = tkinter.Tk()
     root.withdraw()
 
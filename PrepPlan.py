@@ -0,0 +1,89 @@
+"""
+Plan of filesystem actions (making folders, writing edited workflows, ...) needed to prepare a batch of runs.
+Actions are collected while the template is parsed and then run together on a thread pool, since each one is a
+high-latency round trip on the network share. Actions of the same run are done in order in one thread; a failure
+only stops that run. The plan can also just be printed (dry run) without touching the filesystem.
+"""
+import concurrent.futures
+from dataclasses import dataclass, field
+
+PREP_THREADS = 16
+
+
+@dataclass
+class PrepAction(object):
+    """
+    container for a single filesystem action
+    """
+    description: str
+    function: object
+    args: tuple = ()
+    kwargs: dict = field(default_factory=dict)
+
+
+class PrepPlan(object):
+    """
+    Filesystem actions to prepare a batch, grouped by run (in the order added)
+    """
+    actions: dict
+
+    def __init__(self):
+        self.actions = {}
+
+    def add(self, run_name, description, function, *args, **kwargs):
+        """
+        Add an action for a run. It will run after all earlier actions of the same run
+        :param run_name: unique name of the run (e.g. output folder)
+        :type run_name: str
+        :param description: readable description for the dry run
+        :type description: str
+        :param function: function to call
+        :type function: function
+        :return: void
+        """
+        self.actions.setdefault(run_name, []).append(PrepAction(description, function, args, kwargs))
+
+    def describe(self):
+        """
+        Print all actions without running them
+        :return: void
+        """
+        for run_name, run_actions in self.actions.items():
+            print(run_name)
+            for action in run_actions:
+                print('    {}'.format(action.description))
+        print('{} actions for {} runs'.format(sum([len(x) for x in self.actions.values()]), len(self.actions)))
+
+    def execute(self, max_workers=PREP_THREADS):
+        """
+        Run all actions, runs in parallel and each run's actions in order
+        :param max_workers: number of threads
+        :type max_workers: int
+        :return: dict of run name: error for runs that failed
+        :rtype: dict
+        """
+        failed = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {pool.submit(run_actions, actions): run_name for run_name, actions in self.actions.items()}
+            for future in concurrent.futures.as_completed(futures):
+                error = future.result()
+                if error is not None:
+                    failed[futures[future]] = error
+                    print('ERROR: preparing {} failed: {}'.format(futures[future], error))
+        return failed
+
+
+def run_actions(actions):
+    """
+    Run the actions of a single run in order, stopping at the first failure
+    :param actions: list of actions
+    :type actions: list[PrepAction]
+    :return: error message (None if all succeeded)
+    :rtype: str
+    """
+    for action in actions:
+        try:
+            action.function(*action.args, **action.kwargs)
+        except (OSError, ValueError) as error:
+            return '{}: {}'.format(action.description, error)
+    return None
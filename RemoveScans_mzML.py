@@ -4,11 +4,8 @@ module for removing scans from an mzML file without using MSConvert. Why? Becaus
 2) we can handle things like separating HCD from EThcD, where both "ETD" and "HCD" strings appear in the dissoc info
 """
 
-import tkinter
-from tkinter import filedialog
 import os
 from enum import Enum
-import pyopenms
 
 
 class ActivationType(Enum):
@@ -31,6 +28,7 @@ def filter_scans(mzml_file, exact_activation_list, output_append):
     :param output_append: what to add to the filename of the newly created file
     :return: void
     """
+    import pyopenms     # slow to import and not always installed, so only load when filtering
     print('loading file {}'.format(mzml_file))
     exp = pyopenms.MSExperiment()
     pyopenms.MzMLFile().load(mzml_file, exp)
@@ -68,6 +66,8 @@ def filter_scans(mzml_file, exact_activation_list, output_append):
 
 
 if __name__ == '__main__':
+    import tkinter
+    from tkinter import filedialog
     root = tkinter.Tk()
     root.withdraw()
 
@@ -0,0 +1,171 @@
+"""
+Predicted run time of FragPipe runs, for ordering batches longest-first and balancing them across nodes. Cost is
+raw data size (from the manifest) times a time per GB: from the historical stage timings database (see
+FragpipeTimings) for the run's workflow if there is history, otherwise a default rate scaled by the search
+settings (open vs closed search, mass offsets, variable mods), database size and threads. Runs that reuse an
+existing search skip the search and validation stages.
+"""
+import os
+
+import FragpipeTimings
+import PathTranslation
+import WorkflowRewriter
+
+DEFAULT_SECONDS_PER_GB = 600        # whole run, used when the workflow has no timing history
+SEARCH_FRACTION = 0.7               # part of the default rate spent in the stages skipped when reusing a search
+RUN_OVERHEAD_S = 120                # startup, database checks, reports
+REFERENCE_THREADS = 32              # threads the default rate is for
+REFERENCE_FASTA_MB = 40             # database size the default rate is for (~human + decoys)
+MIN_FASTA_FACTOR = 0.25
+OPEN_SEARCH_DA = 100                # precursor window wider than this (Da) is an open search
+OPEN_SEARCH_FACTOR = 5.0
+MASS_OFFSET_FACTOR = 0.5            # added search cost per mass offset beyond the first
+VAR_MOD_FACTOR = 1.5                # search cost multiplier per enabled variable mod beyond BASE_VAR_MODS
+BASE_VAR_MODS = 2
+HISTORY_RUNS = 50                   # most recent runs of a workflow to use for its timings
+# log stage names skipped when a run links results from another run's search (see DISABLE_IF_COPY)
+SEARCH_STAGE_PREFIXES = ('MSFragger', 'PeptideProphet', 'Percolator', 'ProteinProphet', 'PTMProphet', 'MSBooster', 'Crystal-C')
+
+
+def raw_gb(fragpipe_run):
+    """
+    Size of the raw data in a run's manifest
+    :param fragpipe_run: run (before updating to linux paths)
+    :type fragpipe_run: Fragpipe_Batch_Runner.FragpipeRun
+    :return: GB (0 if the raw files cannot be found from here)
+    :rtype: float
+    """
+    raw_bytes = FragpipeTimings.manifest_raw_bytes(fragpipe_run.manifest_path)
+    if raw_bytes is None:
+        print('Warning: could not find raw files of {} to estimate its cost'.format(fragpipe_run.manifest_path))
+        return 0
+    return raw_bytes / 1024 ** 3
+
+
+def fasta_mb(database_path):
+    """
+    Size of a database (from the workflow or template, either mount, Java-escaped or not)
+    :param database_path: path to FASTA
+    :type database_path: str
+    :return: MB (None if not found from here)
+    :rtype: float
+    """
+    if database_path is None or database_path == '':
+        return None
+    database_path = database_path.replace('\\\\', '\\').replace('\\:', ':')
+    for candidate in [database_path, PathTranslation.to_linux(database_path), PathTranslation.to_windows(database_path)]:
+        if os.path.isfile(candidate):
+            return os.path.getsize(candidate) / 1024 ** 2
+    return None
+
+
+def search_factor(workflow_params):
+    """
+    Relative cost of the MSFragger search from its settings: open search (wide precursor window), mass offsets,
+    and the number of enabled variable mods
+    :param workflow_params: dict of workflow key: value
+    :type workflow_params: dict
+    :return: multiplier on the default search cost
+    :rtype: float
+    """
+    factor = 1.0
+    try:
+        window = float(workflow_params.get('msfragger.precursor_mass_upper', 0)) - float(workflow_params.get('msfragger.precursor_mass_lower', 0))
+    except ValueError:
+        window = 0
+    if workflow_params.get('msfragger.precursor_mass_units', '1') == '0' and window > OPEN_SEARCH_DA:
+        factor *= OPEN_SEARCH_FACTOR
+
+    offsets = [x for x in workflow_params.get('msfragger.mass_offsets', '0').replace(',', '/').split('/') if x.strip() != '']
+    factor *= 1 + MASS_OFFSET_FACTOR * max(0, len(offsets) - 1)
+
+    # var mods table: 'mass,sites,enabled,max occurrences; ...'
+    var_mods = [x.split(',') for x in workflow_params.get('msfragger.table.var-mods', '').split(';')]
+    n_enabled = len([x for x in var_mods if len(x) > 2 and x[2].strip() == 'true'])
+    factor *= VAR_MOD_FACTOR ** max(0, n_enabled - BASE_VAR_MODS)
+    return factor
+
+
+def thread_factor(threads):
+    """
+    Relative run time for the declared threads compared to REFERENCE_THREADS (blank/0: FragPipe uses the node)
+    :param threads: threads value from the template
+    :type threads: str
+    :return: multiplier
+    :rtype: float
+    """
+    try:
+        threads = int(float(threads))
+    except (TypeError, ValueError):
+        threads = 0
+    if threads <= 0:
+        return 1.0
+    return REFERENCE_THREADS / threads
+
+
+def seconds_per_gb(fragpipe_run, stage_medians):
+    """
+    Predicted time per GB raw for a run
+    :param fragpipe_run: run
+    :type fragpipe_run: Fragpipe_Batch_Runner.FragpipeRun
+    :param stage_medians: dict of stage: median seconds per GB from history for this workflow (may be empty)
+    :type stage_medians: dict
+    :return: seconds per GB
+    :rtype: float
+    """
+    # split searches (see Fragpipe_Batch_Runner.FragpipeRun.split_search) only run MSFragger, the run they split
+    # runs everything else
+    search_only = fragpipe_run.split_of is not None
+    reuses_search = fragpipe_run.skip_msfragger_path is not None or len(fragpipe_run.split_runs) > 0
+    if len(stage_medians) > 0:
+        if search_only:
+            return sum([seconds for stage, seconds in stage_medians.items() if stage.startswith('MSFragger')])
+        if len(fragpipe_run.split_runs) > 0:
+            return sum([seconds for stage, seconds in stage_medians.items() if not stage.startswith('MSFragger')])
+        return sum([seconds for stage, seconds in stage_medians.items() if not (reuses_search and stage.startswith(SEARCH_STAGE_PREFIXES))])
+    rate = 0 if search_only else DEFAULT_SECONDS_PER_GB * (1 - SEARCH_FRACTION)
+    if not reuses_search:
+        workflow_params = WorkflowRewriter.parse_workflow(fragpipe_run.workflow_path)
+        database_mb = fasta_mb(fragpipe_run.database_path if fragpipe_run.database_path is not None else workflow_params.get(WorkflowRewriter.DATABASE_KEY))
+        database_factor = max(MIN_FASTA_FACTOR, database_mb / REFERENCE_FASTA_MB) if database_mb is not None else 1.0
+        rate += DEFAULT_SECONDS_PER_GB * SEARCH_FRACTION * search_factor(workflow_params) * database_factor
+    return rate * thread_factor(fragpipe_run.threads)
+
+
+def estimate_costs(run_list, timings_db=FragpipeTimings.DEFAULT_DB):
+    """
+    Predict the run time of each run. Call before the runs are updated to linux paths
+    :param run_list: list of runs
+    :type run_list: list[Fragpipe_Batch_Runner.FragpipeRun]
+    :param timings_db: historical timings database (not used if it does not exist)
+    :type timings_db: str
+    :return: list of predicted seconds, in run order
+    :rtype: list
+    """
+    use_history = timings_db is not None and os.path.exists(timings_db)
+    medians_by_workflow = {}
+    costs = []
+    for fragpipe_run in run_list:
+        if fragpipe_run.duplicate_of is not None:
+            # only links the results of an identical run
+            costs.append(0)
+            continue
+        workflow = os.path.basename(fragpipe_run.workflow_path)
+        if workflow not in medians_by_workflow:
+            medians_by_workflow[workflow] = FragpipeTimings.workflow_stage_medians(workflow, HISTORY_RUNS, timings_db) if use_history else {}
+        costs.append(RUN_OVERHEAD_S + raw_gb(fragpipe_run) * seconds_per_gb(fragpipe_run, medians_by_workflow[workflow]))
+    return costs
+
+
+def print_costs(run_list, costs):
+    """
+    Print the predicted time of each run and the batch total
+    :param run_list: list of runs
+    :type run_list: list[Fragpipe_Batch_Runner.FragpipeRun]
+    :param costs: predicted seconds of each run (same order)
+    :type costs: list
+    :return: void
+    """
+    for fragpipe_run, cost in zip(run_list, costs):
+        print('{:>8.2f} h  {}'.format(cost / 3600, fragpipe_run.original_output_path))
+    print('predicted total: {:.1f} h for {} runs (longest {:.1f} h)'.format(sum(costs) / 3600, len(costs), max(costs) / 3600 if len(costs) > 0 else 0))
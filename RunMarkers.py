@@ -0,0 +1,9 @@
+"""
+Names of the marker files a FragPipe batch run writes in its output folder once it succeeded. Shared by
+Fragpipe_Batch_Runner (writes and checks them), SearchReuse, IncrementalRerun, ScratchStaging (syncs them back
+last) and Fragpipe_Local_Executor (checks a finished job recorded its completion)
+"""
+FINGERPRINT_NAME = 'fragpipe_run.fingerprint'       # completed run: fingerprint of its inputs (see FragpipeRun.make_fingerprint)
+SEARCH_KEY_NAME = '.msfragger_search_key'           # completed MSFragger search, for reuse by later runs (see SearchReuse)
+REQUESTED_WORKFLOW_NAME = '.requested_workflow'     # workflow requested for the completed run, for incremental reruns (see IncrementalRerun)
+COMPLETION_MARKERS = (REQUESTED_WORKFLOW_NAME, FINGERPRINT_NAME, SEARCH_KEY_NAME)
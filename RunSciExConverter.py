@@ -2,8 +2,6 @@
 Script for running ABSciEx converter (wiff -> mzML)
 """
 
-import tkinter
-from tkinter import filedialog
 import os
 import subprocess
 import multiprocessing
@@ -26,6 +24,8 @@ def run_converter(wiff_files):
 
 
 if __name__ == '__main__':
+    import tkinter
+    from tkinter import filedialog
     root = tkinter.Tk()
     root.withdraw()
 
@@ -0,0 +1,294 @@
+"""
+Command line interface to the run scripts, for headless use (cron, compute nodes, ssh) without the file dialogs.
+Each subcommand only imports the modules it needs, and GUI/heavy libraries (tkinter, tkfilebrowser, pyopenms) are
+only loaded by the code paths that use them. Module constants not exposed as options keep their values from the
+module files.
+
+To Use:
+python RunScripts.py fragpipe-batch template.csv [--fragpipe /path/to/bin/fragpipe] [--shards 4] [--execute]
+python RunScripts.py executor fragpipe_batch.json [--ram 512] [--threads 64] [--scratch /local/scratch [--scratch-workdir]]
+python RunScripts.py prep-fragger template.csv [more templates] | --batch-dirs dir1 dir2 [--phil-scratch /local/scratch]
+python RunScripts.py philosopher /path/to/__FraggerResults [--slots 4] [--memory 128] [--summary]
+python RunScripts.py msconvert file1.raw file2.raw [--activation HCD ETD] [--deisotope] [--check-only]
+python RunScripts.py remove-scans file.mzML [--keep HCD ETD] [--append EThcD]
+python RunScripts.py rename-enzyme --enzyme TRYP file1.mzML ...
+python RunScripts.py update-fp-paths /path/to/results_folder
+python RunScripts.py telemetry fragpipe_batch.json
+python RunScripts.py monitor fragpipe_batch.sh [--interval 60] [--once]
+python RunScripts.py timings-ingest /path/to/results [--db timings.sqlite]
+python RunScripts.py timings-report [--db timings.sqlite]
+python RunScripts.py (any subcommand) -h     for all options
+"""
+import argparse
+import sys
+
+
+def fragpipe_batch(args):
+    """
+    Write (and optionally run) a FragPipe batch from a template
+    """
+    import Fragpipe_Batch_Runner
+    fragpipe_path = args.fragpipe
+    if fragpipe_path is None:
+        fragpipe_path = Fragpipe_Batch_Runner.find_fragpipe(Fragpipe_Batch_Runner.FRAGPIPE_PATH)
+        if fragpipe_path is None:
+            return 1
+    if args.shards is not None:
+        Fragpipe_Batch_Runner.SHARD_NODES = args.shards
+    if args.execute:
+        Fragpipe_Batch_Runner.RUN_LOCAL_EXECUTOR = True
+    if args.scratch is not None:
+        Fragpipe_Batch_Runner.SCRATCH_PATH = args.scratch
+    if args.scratch_workdir:
+        Fragpipe_Batch_Runner.SCRATCH_WORKDIR = True
+    if args.telemetry:
+        Fragpipe_Batch_Runner.USE_TELEMETRY = True
+    if args.no_resume:
+        Fragpipe_Batch_Runner.RESUME_COMPLETED_RUNS = False
+    if args.no_reuse:
+        Fragpipe_Batch_Runner.AUTO_REUSE_SEARCH = False
+    if args.pepindex_cache:
+        Fragpipe_Batch_Runner.USE_PEPINDEX_CACHE = True
+    if args.incremental:
+        Fragpipe_Batch_Runner.INCREMENTAL_RERUN = True
+    if args.split_search is not None:
+        Fragpipe_Batch_Runner.SPLIT_SEARCH_WAYS = args.split_search
+    Fragpipe_Batch_Runner.USE_LINUX = not args.windows
+    if args.disable is not None:
+        disable_list = [Fragpipe_Batch_Runner.DisableTools[x] for x in args.disable]
+    else:
+        disable_list = Fragpipe_Batch_Runner.TOOLS_TO_DISABLE
+    Fragpipe_Batch_Runner.main(args.template, fragpipe_path, not args.windows, disable_list)
+    return 0
+
+
+def executor(args):
+    """
+    Run batch job file(s) with the local executor
+    """
+    import Fragpipe_Local_Executor
+    ram = args.ram if args.ram is not None else Fragpipe_Local_Executor.NODE_RAM
+    threads = args.threads if args.threads is not None else Fragpipe_Local_Executor.NODE_THREADS
+    if args.scratch_quota is not None:
+        Fragpipe_Local_Executor.ScratchStaging.SCRATCH_QUOTA_GB = args.scratch_quota
+    if len(args.jobs_paths) > 1:
+        success = Fragpipe_Local_Executor.run_shards(args.jobs_paths, ram, threads, args.scratch, args.scratch_workdir)
+    else:
+        success = Fragpipe_Local_Executor.main(args.jobs_paths[0], ram, threads, args.scratch, args.scratch_workdir)
+    return 0 if success else 1
+
+
+def prep_fragger(args):
+    """
+    Prepare Philosopher pipeline runs from PrepFragger templates
+    """
+    import PrepFragger_v2
+    if args.phil_scratch is not None:
+        PrepFragger_v2.PHIL_SCRATCH_PATH = args.phil_scratch
+    if args.phil_scratch_quota is not None:
+        PrepFragger_v2.PHIL_SCRATCH_QUOTA_GB = args.phil_scratch_quota
+    if args.batch_dirs is not None:
+        PrepFragger_v2.batch_multiple_main_dirs(args.batch_dirs)
+    elif len(args.templates) > 0:
+        PrepFragger_v2.batch_template_run(not args.keep_maindir, args.templates)
+    else:
+        print('ERROR: provide template file(s) or --batch-dirs')
+        return 1
+    return 0
+
+
+def philosopher(args):
+    """
+    Run phil.sh in PrepFragger results folders, a limited number at once (or only print their status)
+    """
+    import PhilosopherLauncher
+    slots = args.slots if args.slots is not None else PhilosopherLauncher.PHIL_SLOTS
+    memory = args.memory if args.memory is not None else PhilosopherLauncher.PHIL_MEMORY_GB
+    job_memory = args.job_memory if args.job_memory is not None else PhilosopherLauncher.PHIL_JOB_MEMORY_GB
+    success = PhilosopherLauncher.main(args.paths, slots, memory, job_memory, args.summary)
+    return 0 if success else 1
+
+
+def msconvert(args):
+    """
+    Convert raw files with MSConvert (or only check converted files)
+    """
+    import MSConvertWrapper
+    if args.threads is not None:
+        MSConvertWrapper.THREADS = args.threads
+    MSConvertWrapper.DEISOTOPE = args.deisotope
+    if args.check_only:
+        bad_files = MSConvertWrapper.check_converted_files(args.files)
+        return 1 if len(bad_files) > 0 else 0
+    MSConvertWrapper.run_msconvert(args.files, args.activation, args.deisotope)
+    return 0
+
+
+def remove_scans(args):
+    """
+    Keep only scans with the requested activation types in mzML files
+    """
+    import RemoveScans_mzML
+    keep = [RemoveScans_mzML.ActivationType[x] for x in args.keep]
+    append = args.append if args.append is not None else ''.join(args.keep)
+    for mzml in args.files:
+        RemoveScans_mzML.filter_scans(mzml, keep, append)
+    return 0
+
+
+def rename_enzyme(args):
+    """
+    Insert the enzyme name into mzML file names
+    """
+    import EditParams
+    EditParams.rename_enzyme_mzmls(args.enzyme, args.files)
+    return 0
+
+
+def update_fp_paths(args):
+    """
+    Update a FragPipe results folder to Windows paths
+    """
+    import UpdateFP_FilePaths
+    for folder in args.folders:
+        UpdateFP_FilePaths.main(folder)
+    return 0
+
+
+def telemetry(args):
+    """
+    Summarize run telemetry for batch(es)
+    """
+    import RunTelemetry
+    RunTelemetry.summarize(args.paths)
+    return 0
+
+
+def monitor(args):
+    """
+    Show live progress and ETA of running batch(es)
+    """
+    import BatchMonitor
+    import FragpipeTimings
+    BatchMonitor.monitor(args.batch_paths, args.interval, args.once, args.db if args.db is not None else FragpipeTimings.DEFAULT_DB)
+    return 0
+
+
+def timings_ingest(args):
+    """
+    Add FragPipe logs under results folders to the timings database
+    """
+    import FragpipeTimings
+    FragpipeTimings.ingest(args.folders, args.db if args.db is not None else FragpipeTimings.DEFAULT_DB)
+    return 0
+
+
+def timings_report(args):
+    """
+    Print total hours per stage from the timings database
+    """
+    import FragpipeTimings
+    for stage_name, hours, count in FragpipeTimings.stage_totals(args.db if args.db is not None else FragpipeTimings.DEFAULT_DB):
+        print('{:<40}{:>10.1f} h{:>8} invocations'.format(stage_name[:39], hours, count))
+    return 0
+
+
+def build_parser():
+    """
+    Make the argument parser with all subcommands
+    :return: parser
+    :rtype: argparse.ArgumentParser
+    """
+    parser = argparse.ArgumentParser(description='Headless interface to the FragPipe/MSFragger run scripts')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    batch_parser = subparsers.add_parser('fragpipe-batch', help='write a FragPipe batch script from a template (Fragpipe_Batch_Runner)')
+    batch_parser.add_argument('template', help='batch template .csv')
+    batch_parser.add_argument('--fragpipe', help='fragpipe executable (default: latest in FRAGPIPE_PATH)')
+    batch_parser.add_argument('--windows', action='store_true', help='write a Windows .bat instead of a linux script')
+    batch_parser.add_argument('--disable', nargs='+', help='tools to disable in all runs (DisableTools names, e.g. MSFRAGGER)')
+    batch_parser.add_argument('--shards', type=int, help='split into this many per-node scripts')
+    batch_parser.add_argument('--execute', action='store_true', help='run the batch here with the local executor')
+    batch_parser.add_argument('--scratch', help='with --execute: node-local folder to stage raw inputs to before each run')
+    batch_parser.add_argument('--scratch-workdir', action='store_true', help='with --scratch: run FragPipe in a scratch workdir, synced back after each run')
+    batch_parser.add_argument('--telemetry', action='store_true', help='record resource use of each run')
+    batch_parser.add_argument('--no-resume', action='store_true', help='rerun runs already completed with the same inputs')
+    batch_parser.add_argument('--no-reuse', action='store_true', help='do not reuse matching MSFragger searches automatically')
+    batch_parser.add_argument('--pepindex-cache', action='store_true', help='share MSFragger peptide indexes between runs via the pepindex cache')
+    batch_parser.add_argument('--incremental', action='store_true', help='rerunning into existing output folders: keep results of stages whose parameters did not change')
+    batch_parser.add_argument('--split-search', type=int, help='split each MSFragger search over this many MSFragger-only runs, then validate all files together')
+    batch_parser.set_defaults(function=fragpipe_batch)
+
+    executor_parser = subparsers.add_parser('executor', help='run batch job file(s) (Fragpipe_Local_Executor)')
+    executor_parser.add_argument('jobs_paths', nargs='+', help='fragpipe_batch.json file(s); several are run as separate nodes')
+    executor_parser.add_argument('--ram', type=int, help='node ram (GB) (default: NODE_RAM)')
+    executor_parser.add_argument('--threads', type=int, help='node threads (default: NODE_THREADS)')
+    executor_parser.add_argument('--scratch', help='node-local folder to stage raw inputs to before each run')
+    executor_parser.add_argument('--scratch-quota', type=float, help='max GB of staged inputs (default: ScratchStaging.SCRATCH_QUOTA_GB)')
+    executor_parser.add_argument('--scratch-workdir', action='store_true', help='with --scratch: run FragPipe in a scratch workdir, synced back after each run')
+    executor_parser.set_defaults(function=executor)
+
+    prep_parser = subparsers.add_parser('prep-fragger', help='prepare Philosopher pipeline runs (PrepFragger_v2)')
+    prep_parser.add_argument('templates', nargs='*', help='template .csv file(s)')
+    prep_parser.add_argument('--batch-dirs', nargs='+', help='directories each containing one template.csv, combined into one shell')
+    prep_parser.add_argument('--keep-maindir', action='store_true', help='use the main dir from the template instead of the params folder')
+    prep_parser.add_argument('--phil-scratch', help='node-local folder (linux) to run Philosopher workspaces in, copying back only the reports')
+    prep_parser.add_argument('--phil-scratch-quota', type=float, help='max GB per scratch Philosopher workspace (default: PHIL_SCRATCH_QUOTA_GB)')
+    prep_parser.set_defaults(function=prep_fragger)
+
+    phil_parser = subparsers.add_parser('philosopher', help='run phil.sh in PrepFragger results folders, a limited number at once (PhilosopherLauncher)')
+    phil_parser.add_argument('paths', nargs='+', help='results folder(s) with one subfolder per run, or run folder(s)')
+    phil_parser.add_argument('--slots', type=int, help='max Philosopher runs at once (default: PHIL_SLOTS)')
+    phil_parser.add_argument('--memory', type=float, help='max total memory (GB) of running Philosopher runs (default: PHIL_MEMORY_GB)')
+    phil_parser.add_argument('--job-memory', type=float, help='memory (GB) to reserve per Philosopher run (default: PHIL_JOB_MEMORY_GB)')
+    phil_parser.add_argument('--summary', action='store_true', help='only print the status of each folder')
+    phil_parser.set_defaults(function=philosopher)
+
+    msconvert_parser = subparsers.add_parser('msconvert', help='convert raw files with MSConvert (MSConvertWrapper)')
+    msconvert_parser.add_argument('files', nargs='+')
+    msconvert_parser.add_argument('--activation', nargs='+', help='split by activation type(s), e.g. HCD ETD')
+    msconvert_parser.add_argument('--deisotope', action='store_true')
+    msconvert_parser.add_argument('--threads', type=int)
+    msconvert_parser.add_argument('--check-only', action='store_true', help='only check that converted files are complete')
+    msconvert_parser.set_defaults(function=msconvert)
+
+    remove_parser = subparsers.add_parser('remove-scans', help='keep only MS2 scans of the given activation (RemoveScans_mzML)')
+    remove_parser.add_argument('files', nargs='+', help='mzML files')
+    remove_parser.add_argument('--keep', nargs='+', default=['HCD'], help='activation types that must all be present (ActivationType names)')
+    remove_parser.add_argument('--append', help='appended to output file names (default: joined --keep types)')
+    remove_parser.set_defaults(function=remove_scans)
+
+    rename_parser = subparsers.add_parser('rename-enzyme', help='insert enzyme name into mzML file names (EditParams)')
+    rename_parser.add_argument('--enzyme', required=True)
+    rename_parser.add_argument('files', nargs='+')
+    rename_parser.set_defaults(function=rename_enzyme)
+
+    update_parser = subparsers.add_parser('update-fp-paths', help='update FragPipe results folder(s) to Windows paths (UpdateFP_FilePaths)')
+    update_parser.add_argument('folders', nargs='+')
+    update_parser.set_defaults(function=update_fp_paths)
+
+    telemetry_parser = subparsers.add_parser('telemetry', help='summarize run telemetry (RunTelemetry)')
+    telemetry_parser.add_argument('paths', nargs='+', help='fragpipe_batch.json file(s) and/or run output folders')
+    telemetry_parser.set_defaults(function=telemetry)
+
+    monitor_parser = subparsers.add_parser('monitor', help='live progress and ETA of running batch(es) (BatchMonitor)')
+    monitor_parser.add_argument('batch_paths', nargs='+', help='fragpipe_batch.sh script(s) and/or .json job file(s)')
+    monitor_parser.add_argument('--interval', type=float, default=60, help='seconds between updates')
+    monitor_parser.add_argument('--once', action='store_true', help='print the status once and exit')
+    monitor_parser.add_argument('--db', help='timings database (default: FragpipeTimings.DEFAULT_DB)')
+    monitor_parser.set_defaults(function=monitor)
+
+    ingest_parser = subparsers.add_parser('timings-ingest', help='add FragPipe logs to the timings database (FragpipeTimings)')
+    ingest_parser.add_argument('folders', nargs='+')
+    ingest_parser.add_argument('--db')
+    ingest_parser.set_defaults(function=timings_ingest)
+
+    report_parser = subparsers.add_parser('timings-report', help='total hours per stage (FragpipeTimings)')
+    report_parser.add_argument('--db')
+    report_parser.set_defaults(function=timings_report)
+    return parser
+
+
+if __name__ == '__main__':
+    arguments = build_parser().parse_args()
+    sys.exit(arguments.function(arguments))
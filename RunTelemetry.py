@@ -0,0 +1,250 @@
+"""
+Resource telemetry for FragPipe runs. Wraps a command (the FragPipe call in the batch script), samples /proc for
+its whole process tree while it runs, and appends one JSON record per run (wall time, peak RSS, CPU time and
+utilisation, bytes read/written) to fragpipe_telemetry.jsonl in the run's output folder. Output and exit code of
+the wrapped command are passed through unchanged.
+
+To Use:
+python3 RunTelemetry.py run --output /path/to/run_output -- fragpipe --headless ...
+python3 RunTelemetry.py summary /path/to/fragpipe_batch.json [more output folders or batch files]
+"""
+import argparse
+import datetime
+import json
+import os
+import socket
+import subprocess
+import time
+
+import Fragpipe_Local_Executor
+
+TELEMETRY_NAME = 'fragpipe_telemetry.jsonl'
+SAMPLE_INTERVAL = 5     # seconds between /proc samples
+EXIT_CHECK_INTERVAL = 0.2
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+GB = 1024 ** 3
+
+
+def read_proc_children():
+    """
+    Map each running process to its parent from /proc/[pid]/stat
+    :return: dict of parent pid: list of child pids
+    :rtype: dict
+    """
+    children = {}
+    for pid_str in os.listdir('/proc'):
+        if not pid_str.isdigit():
+            continue
+        try:
+            with open('/proc/{}/stat'.format(pid_str), 'r') as readfile:
+                stat = readfile.read()
+        except OSError:
+            continue        # process exited
+        # command name is in parentheses and may contain spaces, so split after the last ')'
+        fields = stat[stat.rfind(')') + 2:].split()
+        children.setdefault(int(fields[1]), []).append(int(pid_str))
+    return children
+
+
+def process_tree(root_pid):
+    """
+    Get the pids of a process and all of its descendants
+    :param root_pid: top level pid
+    :type root_pid: int
+    :return: list of pids
+    :rtype: list
+    """
+    children = read_proc_children()
+    tree = [root_pid]
+    index = 0
+    while index < len(tree):
+        tree.extend(children.get(tree[index], []))
+        index += 1
+    return tree
+
+
+def read_rss(pid):
+    """
+    Resident memory of a process in bytes
+    :param pid: process id
+    :type pid: int
+    :return: bytes (0 if the process has exited)
+    :rtype: int
+    """
+    try:
+        with open('/proc/{}/statm'.format(pid), 'r') as readfile:
+            return int(readfile.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+def read_io(pid):
+    """
+    Bytes read and written (storage) by a process so far
+    :param pid: process id
+    :type pid: int
+    :return: read bytes, write bytes (None if unavailable)
+    :rtype: tuple
+    """
+    counters = {}
+    try:
+        with open('/proc/{}/io'.format(pid), 'r') as readfile:
+            for line in readfile:
+                key, value = line.split(':')
+                counters[key] = int(value)
+    except (OSError, ValueError):
+        return None
+    return counters.get('read_bytes', 0), counters.get('write_bytes', 0)
+
+
+def run_with_telemetry(command, output_folder, sample_interval=SAMPLE_INTERVAL):
+    """
+    Run a command, sampling its process tree until it exits, and append a telemetry record to the output folder.
+    I/O of a process is counted up to its last sample, so very short-lived child processes may be under-counted
+    :param command: command to run (list of arguments)
+    :type command: list
+    :param output_folder: run output folder to write the record to
+    :type output_folder: str
+    :param sample_interval: seconds between samples
+    :type sample_interval: float
+    :return: exit code of the command
+    :rtype: int
+    """
+    start = time.time()
+    process = subprocess.Popen(command)
+    peak_rss = 0
+    peak_processes = 0
+    io_by_pid = {}
+    samples = 0
+    while True:
+        tree = process_tree(process.pid)
+        peak_rss = max(peak_rss, sum([read_rss(pid) for pid in tree]))
+        peak_processes = max(peak_processes, len(tree))
+        for pid in tree:
+            io = read_io(pid)
+            if io is not None:
+                # counters only go up for a given pid; keep the last value seen
+                previous = io_by_pid.get(pid, (0, 0))
+                io_by_pid[pid] = (max(previous[0], io[0]), max(previous[1], io[1]))
+        samples += 1
+        # check for exit more often than sampling so wall time is not rounded up to the sample interval.
+        # wait4 reaps the child and gives CPU time of it and all its waited-for descendants
+        next_sample = time.time() + sample_interval
+        pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+        while pid == 0 and time.time() < next_sample:
+            time.sleep(EXIT_CHECK_INTERVAL)
+            pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+        if pid != 0:
+            break
+    wall = time.time() - start
+    exit_code = os.waitstatus_to_exitcode(status)
+    process.returncode = exit_code
+
+    cpu_seconds = rusage.ru_utime + rusage.ru_stime
+    record = {
+        'command': ' '.join(command),
+        'host': socket.gethostname(),
+        'start': datetime.datetime.fromtimestamp(start).isoformat(timespec='seconds'),
+        'wall_s': round(wall, 1),
+        'exit_code': exit_code,
+        'peak_rss_gb': round(max(peak_rss, rusage.ru_maxrss * 1024) / GB, 2),
+        'cpu_s': round(cpu_seconds, 1),
+        'cpu_utilisation': round(cpu_seconds / wall, 2) if wall > 0 else 0,
+        'read_gb': round(sum([x[0] for x in io_by_pid.values()]) / GB, 2),
+        'write_gb': round(sum([x[1] for x in io_by_pid.values()]) / GB, 2),
+        'peak_processes': peak_processes,
+        'samples': samples,
+    }
+    os.makedirs(output_folder, exist_ok=True)
+    with open(os.path.join(output_folder, TELEMETRY_NAME), 'a') as outfile:
+        outfile.write(json.dumps(record) + '\n')
+    return exit_code
+
+
+def read_telemetry(output_folder):
+    """
+    Read all telemetry records from a run output folder
+    :param output_folder: run output folder
+    :type output_folder: str
+    :return: list of record dicts (oldest first)
+    :rtype: list
+    """
+    telemetry_path = os.path.join(output_folder, TELEMETRY_NAME)
+    records = []
+    if not os.path.exists(telemetry_path):
+        return records
+    with open(telemetry_path, 'r') as readfile:
+        for line in readfile:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                print('Warning: skipping unreadable telemetry line in {}'.format(telemetry_path))
+    return records
+
+
+def get_output_folders(paths):
+    """
+    Expand batch job files (fragpipe_batch.json) into their run output folders. Other paths are used as folders
+    :param paths: list of batch job files and/or output folders
+    :type paths: list
+    :return: list of output folders
+    :rtype: list
+    """
+    folders = []
+    for path in paths:
+        if path.endswith('.json'):
+            folders.extend([job.output_path for job in Fragpipe_Local_Executor.read_batch_jobs(path)])
+        else:
+            folders.append(path)
+    return folders
+
+
+def summarize(paths):
+    """
+    Print a per-run table (latest record of each run) and batch totals
+    :param paths: list of batch job files and/or output folders
+    :type paths: list
+    :return: list of (folder, latest record) for runs with telemetry
+    :rtype: list
+    """
+    runs = []
+    for folder in get_output_folders(paths):
+        records = read_telemetry(folder)
+        if len(records) == 0:
+            print('Warning: no telemetry for {}'.format(folder))
+            continue
+        runs.append((folder, records[-1]))
+    if len(runs) == 0:
+        return runs
+
+    print('{:<40}{:>10}{:>10}{:>10}{:>8}{:>10}{:>10}{:>6}'.format('run', 'wall (h)', 'RSS (GB)', 'CPU (h)', 'util', 'read GB', 'write GB', 'exit'))
+    for folder, record in runs:
+        print('{:<40}{:>10.2f}{:>10.1f}{:>10.2f}{:>8.1f}{:>10.1f}{:>10.1f}{:>6}'.format(os.path.basename(folder.rstrip('/'))[:39],
+                                                                                       record['wall_s'] / 3600, record['peak_rss_gb'],
+                                                                                       record['cpu_s'] / 3600, record['cpu_utilisation'],
+                                                                                       record['read_gb'], record['write_gb'], record['exit_code']))
+    total_wall = sum([x[1]['wall_s'] for x in runs])
+    total_cpu = sum([x[1]['cpu_s'] for x in runs])
+    print('{} runs: {:.2f} h wall, {:.2f} h CPU (mean utilisation {:.1f} cores), max RSS {:.1f} GB, {:.1f} GB read, {:.1f} GB written, {} failed'.format(
+        len(runs), total_wall / 3600, total_cpu / 3600, total_cpu / total_wall if total_wall > 0 else 0,
+        max([x[1]['peak_rss_gb'] for x in runs]), sum([x[1]['read_gb'] for x in runs]),
+        sum([x[1]['write_gb'] for x in runs]), len([x for x in runs if x[1]['exit_code'] != 0])))
+    return runs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='FragPipe run telemetry')
+    subparsers = parser.add_subparsers(dest='mode', required=True)
+    run_parser = subparsers.add_parser('run', help='run a command and record its resource use')
+    run_parser.add_argument('--output', required=True, help='run output folder to write telemetry to')
+    run_parser.add_argument('--interval', type=float, default=SAMPLE_INTERVAL, help='seconds between samples')
+    run_parser.add_argument('command', nargs=argparse.REMAINDER, help='command to run (after --)')
+    summary_parser = subparsers.add_parser('summary', help='summarize telemetry for a batch')
+    summary_parser.add_argument('paths', nargs='+', help='fragpipe_batch.json file(s) and/or run output folders')
+    args = parser.parse_args()
+
+    if args.mode == 'run':
+        run_command = args.command[1:] if len(args.command) > 0 and args.command[0] == '--' else args.command
+        exit(run_with_telemetry(run_command, args.output, args.interval))
+    else:
+        summarize(args.paths)
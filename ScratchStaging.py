@@ -0,0 +1,487 @@
+"""
+Staging of FragPipe run inputs (raw/mzML files from the manifest) to node-local scratch, used by
+Fragpipe_Local_Executor. Each run's inputs are copied to scratch in the background before the run starts (the
+executor prefetches upcoming runs while others compute), the run gets a copy of its manifest pointing to the
+scratch files, and files are deleted once no running or upcoming run needs them. Total staged size is kept under
+a quota; a run whose inputs do not fit reads them from storage as before.
+
+Runs can also use a workdir on scratch instead of their output folder, so FragPipe's intermediate files stay on
+local disk. The workdir is seeded from the output folder (results of a previous attempt, linked search results)
+in the background like input staging, and synced back after the run, with every copied file read back and
+checksummed, and completion markers copied last (only if everything else matched), before the scratch copy is
+removed. Note that paths recorded inside FragPipe's outputs (e.g. its workflow/manifest copies) will point to the
+scratch workdir.
+"""
+import concurrent.futures
+import hashlib
+import os
+import shutil
+import threading
+
+import RunMarkers
+
+SCRATCH_QUOTA_GB = 500
+STAGE_THREADS = 2       # parallel copies from storage
+MANIFEST_FOLDER = 'manifests'
+FILES_FOLDER = 'files'
+WORKDIR_FOLDER = 'workdirs'
+GB = 1024 ** 3
+VERIFY_BLOCK_SIZE = 1024 ** 2
+
+
+def read_manifest_inputs(manifest_path):
+    """
+    Get the input file paths from a (linux) manifest
+    :param manifest_path: full path to manifest
+    :type manifest_path: str
+    :return: list of input paths, list of manifest lines split by tab
+    :rtype: tuple
+    """
+    inputs = []
+    rows = []
+    with open(manifest_path, 'r') as readfile:
+        for line in readfile:
+            splits = line.rstrip('\r\n').split('\t')
+            rows.append(splits)
+            if splits[0] != '':
+                inputs.append(splits[0])
+    return inputs, rows
+
+
+def input_size(path):
+    """
+    Size of an input file or folder (e.g. Bruker .d)
+    :param path: input path
+    :type path: str
+    :return: bytes
+    :rtype: int
+    """
+    if os.path.isdir(path):
+        return sum([os.path.getsize(os.path.join(dirpath, x)) for dirpath, _, files in os.walk(path) for x in files])
+    return os.path.getsize(path)
+
+
+class StagedInput(object):
+    """
+    container for one input file staged (or being staged) to scratch
+    """
+    source: str
+    path: str
+    size: int
+    users: set
+    started: bool
+    done: threading.Event
+    failed: bool
+
+    def __init__(self, source, path, size):
+        self.source = source
+        self.path = path
+        self.size = size
+        self.users = set()
+        self.started = False
+        self.done = threading.Event()
+        self.failed = False
+
+
+class ScratchStager(object):
+    """
+    Stages job inputs to a scratch folder, shared between jobs that use the same files
+    """
+    scratch_path: str
+    quota_bytes: float
+    inputs: dict
+    futures: dict
+    manifests: dict
+    workdirs: dict
+
+    def __init__(self, scratch_path, quota_gb=None):
+        """
+        :param scratch_path: node-local scratch folder (created if needed)
+        :type scratch_path: str
+        :param quota_gb: maximum total size of staged inputs (default SCRATCH_QUOTA_GB)
+        :type quota_gb: float
+        """
+        if quota_gb is None:
+            quota_gb = SCRATCH_QUOTA_GB
+        self.scratch_path = scratch_path
+        self.quota_bytes = quota_gb * GB
+        self.inputs = {}
+        self.futures = {}
+        self.manifests = {}
+        self.workdirs = {}
+        self.lock = threading.Lock()
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=STAGE_THREADS)
+        os.makedirs(os.path.join(scratch_path, MANIFEST_FOLDER), exist_ok=True)
+        os.makedirs(os.path.join(scratch_path, FILES_FOLDER), exist_ok=True)
+
+    def used_bytes(self):
+        """
+        total size of staged and reserved inputs
+        """
+        return sum([x.size for x in self.inputs.values()])
+
+    def reserve(self, job_name, sources):
+        """
+        Reserve scratch space for a job's inputs (shared inputs already staged count once). Must hold the lock
+        :param job_name: job name
+        :type job_name: str
+        :param sources: input paths
+        :type sources: list
+        :return: list of inputs this job uses, or None if they do not fit in the quota
+        :rtype: list
+        """
+        new_sizes = {}
+        for source in sources:
+            if source not in self.inputs and source not in new_sizes:
+                new_sizes[source] = input_size(source)
+        if self.used_bytes() + sum(new_sizes.values()) > self.quota_bytes:
+            return None
+        staged = []
+        for source in sources:
+            if source not in self.inputs:
+                digest = hashlib.sha256(source.encode()).hexdigest()[:12]
+                scratch_file = os.path.join(self.scratch_path, FILES_FOLDER, digest, os.path.basename(source.rstrip('/')))
+                self.inputs[source] = StagedInput(source, scratch_file, new_sizes[source])
+            self.inputs[source].users.add(job_name)
+            staged.append(self.inputs[source])
+        return staged
+
+    def stage_job(self, job_name, manifest_path):
+        """
+        Copy a job's inputs to scratch and write its scratch manifest (run in a background thread)
+        :param job_name: job name
+        :type job_name: str
+        :param manifest_path: the job's (linux) manifest
+        :type manifest_path: str
+        :return: scratch manifest path, or None if the inputs could not be staged
+        :rtype: str
+        """
+        try:
+            sources, rows = read_manifest_inputs(manifest_path)
+            with self.lock:
+                staged = self.reserve(job_name, sources)
+        except OSError as error:
+            print('Warning: could not read inputs of {}: {}'.format(job_name, error))
+            return None
+        if staged is None:
+            return None
+        for staged_input in staged:
+            with self.lock:
+                # only one thread copies each input, jobs sharing it wait for that copy
+                copy_needed = not staged_input.started
+                staged_input.started = True
+            if copy_needed:
+                try:
+                    self.copy_input(staged_input)
+                except OSError as error:
+                    print('Warning: staging {} failed: {}'.format(staged_input.source, error))
+                    staged_input.failed = True
+                staged_input.done.set()
+            staged_input.done.wait()
+        if any(x.failed for x in staged):
+            self.release(job_name)
+            return None
+
+        scratch_paths = {x.source: x.path for x in staged}
+        scratch_manifest = os.path.join(self.scratch_path, MANIFEST_FOLDER, '{}.fp-manifest'.format(job_name))
+        try:
+            with open(scratch_manifest, 'w', newline='') as outfile:
+                for row in rows:
+                    if row[0] in scratch_paths:
+                        row = [scratch_paths[row[0]]] + row[1:]
+                    outfile.write('\t'.join(row) + '\n')
+        except OSError as error:
+            print('Warning: could not write scratch manifest of {}: {}'.format(job_name, error))
+            self.release(job_name)
+            return None
+        return scratch_manifest
+
+    def copy_input(self, staged_input):
+        """
+        Copy one input to scratch (to a temp name first, so a partial copy is never used)
+        :param staged_input: input to copy
+        :type staged_input: StagedInput
+        :return: void
+        """
+        if os.path.exists(staged_input.path):
+            return
+        os.makedirs(os.path.dirname(staged_input.path), exist_ok=True)
+        temp_path = staged_input.path + '.partial'
+        if os.path.isdir(staged_input.source):
+            shutil.copytree(staged_input.source, temp_path)
+        else:
+            shutil.copyfile(staged_input.source, temp_path)
+        os.rename(temp_path, staged_input.path)
+
+    def prefetch(self, job_name, manifest_path):
+        """
+        Start staging a job's inputs in the background, if not already started or staged
+        :param job_name: job name
+        :type job_name: str
+        :param manifest_path: the job's (linux) manifest
+        :type manifest_path: str
+        :return: void
+        """
+        future = self.futures.get(job_name)
+        if future is None or (future.done() and future.result() is None):
+            # first attempt, or retry one that did not fit in the quota (space may have been freed since)
+            self.futures[job_name] = self.pool.submit(self.stage_job, job_name, manifest_path)
+
+    def is_ready(self, job_name):
+        """
+        Check if a job's staging has finished (successfully or not)
+        :param job_name: job name
+        :type job_name: str
+        :return: bool
+        :rtype: bool
+        """
+        return job_name in self.futures and self.futures[job_name].done()
+
+    def prefetch_workdir(self, job_name, output_path, workdir):
+        """
+        Start seeding a job's scratch workdir from its output folder in the background (see seed_workdir), if not
+        already started. Only for jobs whose dependencies are done, as they may write to the output folder
+        :param job_name: job name
+        :type job_name: str
+        :param output_path: the job's output folder (on storage)
+        :type output_path: str
+        :param workdir: scratch workdir to create
+        :type workdir: str
+        :return: void
+        """
+        if job_name not in self.workdirs:
+            self.workdirs[job_name] = self.pool.submit(self.seed_job, job_name, output_path, workdir)
+
+    def seed_job(self, job_name, output_path, workdir):
+        """
+        Seed a job's scratch workdir (run in a background thread)
+        :param job_name: job name
+        :type job_name: str
+        :param output_path: the job's output folder (on storage)
+        :type output_path: str
+        :param workdir: scratch workdir to create
+        :type workdir: str
+        :return: workdir, or None if it could not be seeded
+        :rtype: str
+        """
+        try:
+            return seed_workdir(output_path, workdir)
+        except OSError as error:
+            print('Warning: could not seed the scratch workdir of {}: {}'.format(job_name, error))
+            shutil.rmtree(workdir, ignore_errors=True)
+            return None
+
+    def is_seeded(self, job_name):
+        """
+        Check if seeding a job's workdir has finished (successfully or not)
+        :param job_name: job name
+        :type job_name: str
+        :return: bool
+        :rtype: bool
+        """
+        return job_name in self.workdirs and self.workdirs[job_name].done()
+
+    def get_workdir(self, job_name, output_path, workdir):
+        """
+        Get the workdir a job should run in, waiting for its seeding to finish
+        :param job_name: job name
+        :type job_name: str
+        :param output_path: the job's output folder (on storage)
+        :type output_path: str
+        :param workdir: scratch workdir
+        :type workdir: str
+        :return: seeded scratch workdir, or None to run in the output folder (seeding failed)
+        :rtype: str
+        """
+        self.prefetch_workdir(job_name, output_path, workdir)
+        seeded = self.workdirs.pop(job_name).result()
+        if seeded is None:
+            print('Warning: running {} in its output folder instead of a scratch workdir'.format(job_name))
+        return seeded
+
+    def get_manifest(self, job_name, manifest_path):
+        """
+        Get the manifest a job should use, waiting for its staging to finish
+        :param job_name: job name
+        :type job_name: str
+        :param manifest_path: the job's (linux) manifest
+        :type manifest_path: str
+        :return: scratch manifest, or the original manifest if staging was not possible
+        :rtype: str
+        """
+        if job_name not in self.futures:
+            self.prefetch(job_name, manifest_path)
+        scratch_manifest = self.futures[job_name].result()
+        if scratch_manifest is None:
+            print('Warning: could not stage inputs of {} to scratch (quota or copy error), reading from storage'.format(job_name))
+            return manifest_path
+        self.manifests[job_name] = scratch_manifest
+        return scratch_manifest
+
+    def release(self, job_name):
+        """
+        A job is done with its inputs: delete staged files no other job still needs
+        :param job_name: job name
+        :type job_name: str
+        :return: void
+        """
+        with self.lock:
+            for source, staged_input in list(self.inputs.items()):
+                staged_input.users.discard(job_name)
+                if len(staged_input.users) == 0:
+                    shutil.rmtree(os.path.dirname(staged_input.path), ignore_errors=True)
+                    del self.inputs[source]
+        scratch_manifest = self.manifests.pop(job_name, None)
+        if scratch_manifest is not None and os.path.exists(scratch_manifest):
+            os.remove(scratch_manifest)
+
+    def close(self):
+        """
+        Stop background copies and remove everything staged
+        :return: void
+        """
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        shutil.rmtree(os.path.join(self.scratch_path, FILES_FOLDER), ignore_errors=True)
+        shutil.rmtree(os.path.join(self.scratch_path, MANIFEST_FOLDER), ignore_errors=True)
+
+
+def list_entries(folder):
+    """
+    Get all files and symlinks (including symlinked folders, not followed) in a folder
+    :param folder: folder to list
+    :type folder: str
+    :return: list of paths relative to the folder
+    :rtype: list
+    """
+    entries = []
+    for dirpath, dirnames, files in os.walk(folder):
+        for name in files + [x for x in dirnames if os.path.islink(os.path.join(dirpath, x))]:
+            entries.append(os.path.relpath(os.path.join(dirpath, name), folder))
+    return entries
+
+
+def same_entry(source, destination):
+    """
+    Check if a file (same size and modified time) or symlink (same target) has already been copied
+    :param source: source path
+    :type source: str
+    :param destination: destination path
+    :type destination: str
+    :return: bool
+    :rtype: bool
+    """
+    if os.path.islink(source):
+        return os.path.islink(destination) and os.readlink(destination) == os.readlink(source)
+    if os.path.islink(destination) or not os.path.isfile(destination):
+        return False
+    source_stat = os.stat(source)
+    destination_stat = os.stat(destination)
+    return source_stat.st_size == destination_stat.st_size and int(source_stat.st_mtime) == int(destination_stat.st_mtime)
+
+
+def file_digest(path):
+    """
+    :param path: file path
+    :type path: str
+    :return: sha256 hex digest of the file contents
+    :rtype: str
+    """
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as readfile:
+        for block in iter(lambda: readfile.read(VERIFY_BLOCK_SIZE), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def verify_copy(source, destination):
+    """
+    Check a copy by reading the destination back: same symlink target, or same size and checksum as the source
+    :param source: source path
+    :type source: str
+    :param destination: destination path
+    :type destination: str
+    :return: bool
+    :rtype: bool
+    """
+    if os.path.islink(source):
+        return same_entry(source, destination)
+    if os.path.islink(destination) or not os.path.isfile(destination):
+        return False
+    return os.path.getsize(source) == os.path.getsize(destination) and file_digest(source) == file_digest(destination)
+
+
+def sync_folder(source_folder, destination_folder):
+    """
+    Copy new or changed files and symlinks from one folder to another, keeping modified times so unchanged files
+    are skipped next time. Each copied file is verified (see verify_copy); completion markers
+    (RunMarkers.COMPLETION_MARKERS) are copied last, and only if everything else matched
+    :param source_folder: folder to copy from
+    :type source_folder: str
+    :param destination_folder: folder to copy to
+    :type destination_folder: str
+    :return: list of relative paths that do not match after copying (empty if verified)
+    :rtype: list
+    """
+    # completion markers last, so an interrupted sync never looks like a completed run
+    sync_last = RunMarkers.COMPLETION_MARKERS
+    entries = sorted(list_entries(source_folder), key=lambda x: os.path.basename(x) in sync_last)
+    mismatched = []
+    for entry in entries:
+        if len(mismatched) > 0 and os.path.basename(entry) in sync_last:
+            mismatched.append(entry)
+            continue
+        source = os.path.join(source_folder, entry)
+        destination = os.path.join(destination_folder, entry)
+        if same_entry(source, destination):
+            continue
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        if os.path.islink(source):
+            if os.path.lexists(destination):
+                os.remove(destination)
+            os.symlink(os.readlink(source), destination)
+        else:
+            shutil.copy2(source, destination)
+        if not verify_copy(source, destination):
+            # removed so a retry copies it again instead of trusting its size and modified time
+            os.remove(destination)
+            mismatched.append(entry)
+    return mismatched
+
+
+def seed_workdir(output_path, workdir):
+    """
+    Make a scratch workdir for a run, with copies of anything already in its output folder
+    :param output_path: run output folder (on storage)
+    :type output_path: str
+    :param workdir: scratch workdir to create
+    :type workdir: str
+    :return: workdir
+    :rtype: str
+    """
+    os.makedirs(workdir, exist_ok=True)
+    if os.path.isdir(output_path):
+        sync_folder(output_path, workdir)
+    return workdir
+
+
+def sync_back(workdir, output_path):
+    """
+    Copy a finished run's scratch workdir back to its output folder and remove the scratch copy once all files are
+    verified. If the sync fails, the scratch copy is kept
+    :param workdir: scratch workdir
+    :type workdir: str
+    :param output_path: run output folder (on storage)
+    :type output_path: str
+    :return: True if synced and verified
+    :rtype: bool
+    """
+    try:
+        mismatched = sync_folder(workdir, output_path)
+    except OSError as error:
+        print('ERROR: syncing {} to {} failed: {}. Results are kept in {}'.format(workdir, output_path, error, workdir))
+        return False
+    if len(mismatched) > 0:
+        print('ERROR: {} files in {} do not match after syncing (e.g. {}). Results are kept in {}'.format(len(mismatched), output_path, mismatched[0], workdir))
+        return False
+    shutil.rmtree(workdir, ignore_errors=True)
+    return True
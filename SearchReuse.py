@@ -0,0 +1,200 @@
+"""
+Automatic reuse of MSFragger search results between FragPipe runs. Each run that does its own search gets a
+search key: a hash of the workflow parameters that determine the linked search outputs (MSFragger and the
+validation stages disabled when copying, see DISABLE_IF_COPY), the manifest rows, and the database. Completed
+runs record their key in the output folder, so later runs (in the same batch or a later one) with the same key
+can link the existing .pep.xml/.prot.xml instead of searching again.
+"""
+import hashlib
+import os
+
+import PathTranslation
+import RunMarkers
+import WorkflowRewriter
+
+# workflow keys (prefixes) that change the search and validation outputs that are linked when reusing a search
+SEARCH_KEY_PREFIXES = ('msfragger.',
+                       'peptide-prophet.',
+                       'percolator.',
+                       'msbooster.',
+                       'crystalc.',
+                       'protein-prophet.',
+                       'ptmprophet.',
+                       'psm-validation.',
+                       'database.decoy-tag')
+RUN_MSFRAGGER_KEY = 'msfragger.run-msfragger'
+
+
+def database_signature(database_path):
+    """
+    Identify a database by its (linux) path, plus size and modified time if it can be read from here (so a
+    regenerated database with the same name is not matched to old results)
+    :param database_path: path to FASTA
+    :type database_path: str
+    :return: signature string
+    :rtype: str
+    """
+    database_path = database_path.replace('\\\\', '\\').replace('\\:', ':')     # un-escape Java style workflow paths
+    try:
+        stat = os.stat(database_path)
+        return '{}|{}|{}'.format(PathTranslation.to_linux(database_path), stat.st_size, int(stat.st_mtime))
+    except OSError:
+        return PathTranslation.to_linux(database_path)
+
+
+def make_search_key(workflow_params, manifest_path, database_path=None, disabled_tools=None):
+    """
+    Hash the search-relevant parameters, manifest rows, and database into a search key. Tools disabled for the run
+    count as turned off in the workflow, so a run that does not write all the linked outputs (e.g. ProteinProphet
+    disabled) does not match a full search
+    :param workflow_params: dict of workflow key: value (from the original workflow, before disabling tools)
+    :type workflow_params: dict
+    :param manifest_path: full path to manifest file
+    :type manifest_path: str
+    :param database_path: database override from the template, if any
+    :type database_path: str
+    :param disabled_tools: tool names (run-[TOOL] format, e.g. DisableTools values) disabled for the run
+    :type disabled_tools: list
+    :return: search key (hex digest)
+    :rtype: str
+    """
+    disabled_keys = set(['run-{}'.format(x) for x in disabled_tools]) if disabled_tools is not None else set()
+    hasher = hashlib.sha256()
+    for key in sorted(workflow_params.keys()):
+        if key.startswith(SEARCH_KEY_PREFIXES):
+            value = 'false' if key.split('.')[-1] in disabled_keys else workflow_params[key]
+            hasher.update('{}={}\n'.format(key, value).encode())
+    with open(manifest_path, 'r') as readfile:
+        rows = sorted([PathTranslation.to_linux(line.rstrip('\r\n')) for line in readfile if line.strip() != ''])
+    hasher.update('\n'.join(rows).encode())
+    if database_path is None:
+        database_path = workflow_params.get(WorkflowRewriter.DATABASE_KEY, '')
+    hasher.update(database_signature(database_path).encode())
+    return hasher.hexdigest()
+
+
+def read_search_key(folder):
+    """
+    Get the search key recorded in an output folder
+    :param folder: run output folder
+    :type folder: str
+    :return: search key, or None if not recorded
+    :rtype: str
+    """
+    key_path = os.path.join(folder, RunMarkers.SEARCH_KEY_NAME)
+    if not os.path.exists(key_path):
+        return None
+    with open(key_path, 'r') as readfile:
+        return readfile.read().strip()
+
+
+def has_search_outputs(folder, filetypes):
+    """
+    Check that a folder has all the file types that are linked when reusing a search
+    :param folder: run output folder
+    :type folder: str
+    :param filetypes: list of file endings (FILETYPES_FOR_COPY)
+    :type filetypes: list
+    :return: bool
+    :rtype: bool
+    """
+    files = os.listdir(folder)
+    return all(any(file.endswith(filetype) for file in files) for filetype in filetypes)
+
+
+class SearchIndex(object):
+    """
+    Index of search key: output folder for completed searches on disk and searches already planned in this batch.
+    Output folders of runs in this batch are never indexed from disk (their searches may be redone with other keys)
+    """
+    filetypes: list
+    searches: dict
+    scanned_folders: set
+    batch_folders: set
+    workflow_params: dict
+
+    def __init__(self, filetypes):
+        """
+        :param filetypes: file endings that must exist in a completed search folder (FILETYPES_FOR_COPY)
+        :type filetypes: list
+        """
+        self.filetypes = filetypes
+        self.searches = {}
+        self.scanned_folders = set()
+        self.batch_folders = set()
+        self.workflow_params = {}
+
+    def get_workflow_params(self, workflow_path):
+        """
+        Parse a workflow, reusing the result for other runs of the same workflow in the batch
+        :param workflow_path: full path to workflow
+        :type workflow_path: str
+        :return: dict of key: value
+        :rtype: dict
+        """
+        if workflow_path not in self.workflow_params:
+            self.workflow_params[workflow_path] = WorkflowRewriter.parse_workflow(workflow_path)
+        return self.workflow_params[workflow_path]
+
+    def add_batch_folders(self, output_folders):
+        """
+        Register the output folders of all runs in this batch, so that scan does not index the searches already in
+        them (runs in the batch that keep or redo a search register it with add)
+        :param output_folders: list of run output folders
+        :type output_folders: list
+        :return: void
+        """
+        self.batch_folders.update([os.path.normpath(x) for x in output_folders])
+
+    def scan(self, results_folder):
+        """
+        Add completed searches from all run folders in a results folder (e.g. __FraggerResults). Each folder is
+        only scanned once
+        :param results_folder: folder containing run output folders
+        :type results_folder: str
+        :return: void
+        """
+        if results_folder in self.scanned_folders or not os.path.isdir(results_folder):
+            return
+        self.scanned_folders.add(results_folder)
+        for folder_name in os.listdir(results_folder):
+            folder = os.path.join(results_folder, folder_name)
+            if not os.path.isdir(folder) or os.path.normpath(folder) in self.batch_folders:
+                continue
+            key = read_search_key(folder)
+            if key is not None and key not in self.searches and has_search_outputs(folder, self.filetypes):
+                self.searches[key] = folder
+
+    def find(self, search_key, results_folders, exclude_folder=None):
+        """
+        Find an existing or planned search with this key
+        :param search_key: search key of the new run
+        :type search_key: str
+        :param results_folders: folders to scan for completed runs
+        :type results_folders: list
+        :param exclude_folder: the new run's own output folder (a rerun cannot reuse itself)
+        :type exclude_folder: str
+        :return: output folder of the matching search, or None
+        :rtype: str
+        """
+        for results_folder in results_folders:
+            self.scan(results_folder)
+        match = self.searches.get(search_key)
+        if match is not None and exclude_folder is not None and os.path.normpath(match) == os.path.normpath(exclude_folder):
+            return None
+        return match
+
+    def add(self, search_key, output_folder):
+        """
+        Register a run in this batch that will do (or keep) its own search, so later runs with the same key link
+        to it. Any other key pointing at the same folder is removed, as its search there is replaced
+        :param search_key: search key
+        :type search_key: str
+        :param output_folder: run output folder
+        :type output_folder: str
+        :return: void
+        """
+        output_folder_norm = os.path.normpath(output_folder)
+        for key in [x for x, folder in self.searches.items() if os.path.normpath(folder) == output_folder_norm]:
+            del self.searches[key]
+        self.searches[search_key] = output_folder
@@ -0,0 +1,283 @@
+"""
+Content-addressed cache of tool sets (MSFragger/IonQuant/diaTracer jars, optional ext folder) for FragPipe runs
+that request specific tool versions. Each file is stored once under blobs/ by content hash, and each distinct
+combination of tools gets one folder under sets/ made of hardlinks (or symlinks/copies as fallback) to the blobs.
+Identical tool sets are shared between runs and reused across batches; old sets are evicted least recently used
+first under a count and size cap.
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+BLOBS_FOLDER = 'blobs'
+SETS_FOLDER = 'sets'
+HASH_INDEX_NAME = 'hash_index.json'      # path/size/mtime -> hash, so unchanged files are not re-hashed every batch
+SET_INFO_NAME = '.tool_set.json'
+LAST_USED_NAME = '.last_used'
+MAX_TOOL_SETS = 20
+MAX_CACHE_GB = 50
+
+
+def load_hash_index(cache_path):
+    """
+    Read the saved file hashes
+    :param cache_path: cache root folder
+    :type cache_path: str
+    :return: dict of path: [size, mtime, hash]
+    :rtype: dict
+    """
+    index_path = os.path.join(cache_path, HASH_INDEX_NAME)
+    if not os.path.exists(index_path):
+        return {}
+    try:
+        with open(index_path, 'r') as readfile:
+            return json.load(readfile)
+    except ValueError:
+        print('Warning: could not read tools cache hash index {}, rebuilding'.format(index_path))
+        return {}
+
+
+def save_hash_index(cache_path, hash_index):
+    """
+    Save file hashes for reuse in the next batch
+    :param cache_path: cache root folder
+    :type cache_path: str
+    :param hash_index: dict of path: [size, mtime, hash]
+    :type hash_index: dict
+    :return: void
+    """
+    temp_path = os.path.join(cache_path, '{}.{}'.format(HASH_INDEX_NAME, uuid.uuid4().hex))
+    with open(temp_path, 'w') as outfile:
+        json.dump(hash_index, outfile)
+    os.replace(temp_path, os.path.join(cache_path, HASH_INDEX_NAME))
+
+
+def file_hash(file_path, hash_index):
+    """
+    Get the sha256 of a file, reusing the saved hash if the file size and modified time have not changed
+    :param file_path: full path to file
+    :type file_path: str
+    :param hash_index: dict of path: [size, mtime, hash] (updated in place)
+    :type hash_index: dict
+    :return: hex digest
+    :rtype: str
+    """
+    stat = os.stat(file_path)
+    key = os.path.abspath(file_path)
+    saved = hash_index.get(key)
+    if saved is not None and saved[0] == stat.st_size and saved[1] == stat.st_mtime:
+        return saved[2]
+    hasher = hashlib.sha256()
+    with open(file_path, 'rb') as readfile:
+        for chunk in iter(lambda: readfile.read(1 << 20), b''):
+            hasher.update(chunk)
+    digest = hasher.hexdigest()
+    hash_index[key] = [stat.st_size, stat.st_mtime, digest]
+    return digest
+
+
+def folder_hash(folder_path, hash_index):
+    """
+    Get a hash of a folder tree from the relative paths and hashes of all files in it
+    :param folder_path: full path to folder
+    :type folder_path: str
+    :param hash_index: dict of path: [size, mtime, hash] (updated in place)
+    :type hash_index: dict
+    :return: hex digest
+    :rtype: str
+    """
+    hasher = hashlib.sha256()
+    for dirpath, dirnames, filenames in os.walk(folder_path):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            file_path = os.path.join(dirpath, filename)
+            hasher.update(os.path.relpath(file_path, folder_path).replace('\\', '/').encode())
+            hasher.update(file_hash(file_path, hash_index).encode())
+    return hasher.hexdigest()
+
+
+def link_or_copy(source, destination):
+    """
+    Hardlink a file, falling back to a (relative) symlink, then a copy
+    :param source: existing file
+    :type source: str
+    :param destination: new path
+    :type destination: str
+    :return: void
+    """
+    try:
+        os.link(source, destination)
+    except OSError:
+        try:
+            os.symlink(os.path.relpath(source, os.path.dirname(destination)), destination)
+        except OSError:
+            shutil.copy2(source, destination)
+
+
+def store_blob(cache_path, source, digest, is_folder=False):
+    """
+    Copy a file (or folder) into the blob store under its hash if not already there
+    :param cache_path: cache root folder
+    :type cache_path: str
+    :param source: file or folder to store
+    :type source: str
+    :param digest: content hash
+    :type digest: str
+    :param is_folder: if True, store a folder tree
+    :type is_folder: bool
+    :return: path to the blob
+    :rtype: str
+    """
+    blob_path = os.path.join(cache_path, BLOBS_FOLDER, digest)
+    if os.path.exists(blob_path):
+        return blob_path
+    # copy to a temp name first so an interrupted copy is never mistaken for a complete blob
+    temp_path = '{}.tmp{}'.format(blob_path, uuid.uuid4().hex)
+    if is_folder:
+        shutil.copytree(source, temp_path)
+    else:
+        shutil.copy2(source, temp_path)
+    try:
+        os.rename(temp_path, blob_path)
+    except OSError:
+        # stored concurrently by another batch
+        if is_folder:
+            shutil.rmtree(temp_path, ignore_errors=True)
+        else:
+            os.remove(temp_path)
+    return blob_path
+
+
+def get_tools_folder(cache_path, tool_paths, ext_folder=None):
+    """
+    Get a tools folder containing exactly the requested tools, reusing an identical existing set if there is one
+    :param cache_path: cache root folder
+    :type cache_path: str
+    :param tool_paths: list of tool files (jars) to include
+    :type tool_paths: list
+    :param ext_folder: if provided, also include this folder as 'ext' (for raw file workflows)
+    :type ext_folder: str
+    :return: path to the tools folder for this set
+    :rtype: str
+    """
+    os.makedirs(os.path.join(cache_path, BLOBS_FOLDER), exist_ok=True)
+    os.makedirs(os.path.join(cache_path, SETS_FOLDER), exist_ok=True)
+    hash_index = load_hash_index(cache_path)
+
+    contents = {}
+    for tool_path in tool_paths:
+        contents[os.path.basename(tool_path)] = file_hash(tool_path, hash_index)
+    if ext_folder is not None:
+        contents['ext'] = 'ext-' + folder_hash(ext_folder, hash_index)
+    save_hash_index(cache_path, hash_index)
+
+    set_key = hashlib.sha256(json.dumps(contents, sort_keys=True).encode()).hexdigest()[:16]
+    set_path = os.path.join(cache_path, SETS_FOLDER, set_key)
+    if not os.path.exists(os.path.join(set_path, SET_INFO_NAME)):
+        temp_path = '{}.tmp{}'.format(set_path, uuid.uuid4().hex)
+        os.makedirs(temp_path)
+        for tool_path in tool_paths:
+            blob_path = store_blob(cache_path, tool_path, contents[os.path.basename(tool_path)])
+            link_or_copy(blob_path, os.path.join(temp_path, os.path.basename(tool_path)))
+        if ext_folder is not None:
+            blob_path = store_blob(cache_path, ext_folder, contents['ext'], is_folder=True)
+            try:
+                os.symlink(os.path.relpath(blob_path, temp_path), os.path.join(temp_path, 'ext'), target_is_directory=True)
+            except OSError:
+                shutil.copytree(blob_path, os.path.join(temp_path, 'ext'), copy_function=link_or_copy)
+        with open(os.path.join(temp_path, SET_INFO_NAME), 'w') as outfile:
+            json.dump(contents, outfile, indent=1)
+        try:
+            os.rename(temp_path, set_path)
+        except OSError:
+            # made concurrently by another batch
+            shutil.rmtree(temp_path, ignore_errors=True)
+        print('made new tool set {} for {}'.format(set_key, ', '.join(sorted(contents.keys()))))
+    touch_tool_set(set_path)
+    return set_path
+
+
+def touch_tool_set(set_path):
+    """
+    Mark a tool set as used now (for least recently used eviction)
+    :param set_path: tool set folder
+    :type set_path: str
+    :return: void
+    """
+    with open(os.path.join(set_path, LAST_USED_NAME), 'w') as outfile:
+        outfile.write('{}\n'.format(time.time()))
+
+
+def path_size(path):
+    """
+    Total size of a file or folder tree (not following symlinks)
+    :param path: file or folder
+    :type path: str
+    :return: size in bytes
+    :rtype: int
+    """
+    if not os.path.isdir(path) or os.path.islink(path):
+        return os.lstat(path).st_size
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            total += os.lstat(os.path.join(dirpath, filename)).st_size
+    return total
+
+
+def evict_tools_cache(cache_path, max_sets=MAX_TOOL_SETS, max_gb=MAX_CACHE_GB):
+    """
+    Remove least recently used tool sets until both the set count and blob store size are under their caps, then
+    remove blobs no longer used by any set
+    :param cache_path: cache root folder
+    :type cache_path: str
+    :param max_sets: maximum number of tool sets to keep
+    :type max_sets: int
+    :param max_gb: maximum size of the blob store (GB)
+    :type max_gb: float
+    :return: void
+    """
+    sets_path = os.path.join(cache_path, SETS_FOLDER)
+    blobs_path = os.path.join(cache_path, BLOBS_FOLDER)
+    if not os.path.exists(sets_path):
+        return
+
+    tool_sets = []
+    for set_key in os.listdir(sets_path):
+        set_path = os.path.join(sets_path, set_key)
+        info_path = os.path.join(set_path, SET_INFO_NAME)
+        if not os.path.exists(info_path):
+            continue        # temp folder being built (or broken); leave it
+        with open(info_path, 'r') as readfile:
+            contents = json.load(readfile)
+        last_used_path = os.path.join(set_path, LAST_USED_NAME)
+        last_used = os.path.getmtime(last_used_path) if os.path.exists(last_used_path) else 0
+        tool_sets.append([last_used, set_path, set(contents.values())])
+    tool_sets.sort(key=lambda x: x[0])
+
+    blob_sizes = {x: path_size(os.path.join(blobs_path, x)) for x in os.listdir(blobs_path) if '.tmp' not in x}
+    max_bytes = max_gb * 1024 ** 3
+
+    def used_bytes():
+        """
+        size of all blobs used by remaining sets
+        """
+        used = set().union(*[x[2] for x in tool_sets]) if len(tool_sets) > 0 else set()
+        return sum([size for blob, size in blob_sizes.items() if blob in used])
+
+    while len(tool_sets) > 0 and (len(tool_sets) > max_sets or used_bytes() > max_bytes):
+        last_used, set_path, blobs = tool_sets.pop(0)
+        print('removing least recently used tool set {}'.format(set_path))
+        shutil.rmtree(set_path, ignore_errors=True)
+
+    used_blobs = set().union(*[x[2] for x in tool_sets]) if len(tool_sets) > 0 else set()
+    for blob in blob_sizes:
+        if blob not in used_blobs:
+            blob_path = os.path.join(blobs_path, blob)
+            if os.path.isdir(blob_path):
+                shutil.rmtree(blob_path, ignore_errors=True)
+            else:
+                os.remove(blob_path)
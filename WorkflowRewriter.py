@@ -0,0 +1,205 @@
+"""
+Single-pass rewriter for FragPipe .workflow files. Parses the workflow once into key/value lines and applies
+all edits (tool disabling, database override, path translation) in one pass, reading and writing the file
+once instead of once per edit.
+
+Run directly to benchmark against the old copy + three read-modify-write passes:
+python WorkflowRewriter.py /path/to/file.workflow [n_workflows]
+"""
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+# workflow keys holding file paths that need translating between Windows and linux
+PATH_KEYS = ('database.db-path',
+             'ptmshepherd.glycodatabase',
+             'ptmshepherd.opair.glyco_db',
+             'opair.glyco_db',
+             'opair.oxonium_filtering_file',
+             'msfragger.mass_offset_file',
+             'mbg.glycan_db')
+DATABASE_KEY = 'database.db-path'
+
+
+def split_workflow_line(line):
+    """
+    Split a workflow line into key and value. Comments and blank lines have no key
+    :param line: line from workflow file
+    :type line: str
+    :return: key, value (both None for comment/blank lines)
+    :rtype: tuple
+    """
+    if line.startswith('#') or '=' not in line:
+        return None, None
+    key, value = line.rstrip('\r\n').split('=', 1)
+    return key, value
+
+
+def parse_workflow(workflow_path):
+    """
+    Read a workflow file into a dict of key: value
+    :param workflow_path: full path to workflow file
+    :type workflow_path: str
+    :return: dict of key: value
+    :rtype: dict
+    """
+    with open(workflow_path, 'r') as readfile:
+        return parse_workflow_lines(readfile)
+
+
+def parse_workflow_lines(lines):
+    """
+    Parse workflow lines into a dict of key: value
+    :param lines: iterable of workflow lines
+    :type lines: iterable
+    :return: dict of key: value
+    :rtype: dict
+    """
+    params = {}
+    for line in lines:
+        key, value = split_workflow_line(line)
+        if key is not None:
+            params[key] = value
+    return params
+
+
+class WorkflowRewriter(object):
+    """
+    Compiled set of edits to apply to a workflow in one pass
+    """
+    disable_pattern: re.Pattern
+    database_path: str
+
+    def __init__(self, disable_tools=None, database_path=None, translate=None, path_keys=PATH_KEYS):
+        """
+        :param disable_tools: list of tool names (run-[TOOL] format, e.g. DisableTools values) to set to false
+        :type disable_tools: list
+        :param database_path: if provided, override (or add) the database path
+        :type database_path: str
+        :param translate: if provided, function to translate paths in the path_keys lines (e.g. update_folder_linux)
+        :type translate: function
+        :param path_keys: workflow keys (prefixes) holding paths to translate
+        :type path_keys: tuple
+        """
+        if disable_tools:
+            # one compiled search per line instead of a substring check per tool
+            self.disable_pattern = re.compile('run-(?:{})'.format('|'.join(sorted([re.escape(x) for x in set(disable_tools)], key=len, reverse=True))))
+        else:
+            self.disable_pattern = None
+        self.database_path = database_path if database_path else None
+        self.translate = translate
+        self.path_keys = tuple(path_keys)
+
+    def rewrite_lines(self, lines):
+        """
+        Apply all edits to the provided workflow lines
+        :param lines: iterable of workflow lines
+        :type lines: iterable
+        :return: list of edited lines
+        :rtype: list
+        """
+        output = []
+        found_db = False
+        for line in lines:
+            key, value = split_workflow_line(line)
+            if key is not None:
+                if self.disable_pattern is not None and self.disable_pattern.search(key):
+                    line = key + '=false\n'
+                if self.database_path is not None:
+                    if key == DATABASE_KEY:
+                        line = '{}={}\n'.format(DATABASE_KEY, self.database_path)
+                        found_db = True
+                    elif key.startswith('crystalc') and not found_db:
+                        # db-path is not in the file (would have been found already), add it here
+                        output.append(self.translate_line('{}={}\n'.format(DATABASE_KEY, self.database_path)))
+                        found_db = True
+                line = self.translate_line(line)
+            output.append(line)
+        return output
+
+    def translate_line(self, line):
+        """
+        translate paths in the line if it is one of the path keys
+        :param line: workflow line
+        :type line: str
+        :return: updated line
+        :rtype: str
+        """
+        if self.translate is not None and line.startswith(self.path_keys):
+            return self.translate(line)
+        return line
+
+    def rewrite(self, workflow_path, output_path=None):
+        """
+        Read the workflow once, apply all edits, and write once
+        :param workflow_path: workflow to read
+        :type workflow_path: str
+        :param output_path: where to save the edited workflow (default: overwrite the input)
+        :type output_path: str
+        :return: list of edited lines
+        :rtype: list
+        """
+        with open(workflow_path, 'r') as readfile:
+            output = self.rewrite_lines(readfile)
+        if output_path is None:
+            output_path = workflow_path
+        with open(output_path, 'w') as outfile:
+            outfile.writelines(output)
+        return output
+
+
+def benchmark(workflow_path, n_workflows=1000):
+    """
+    Time rewriting n_workflows copies of a workflow with the old copy + three read-modify-write passes vs
+    the single-pass rewriter. Prints time per 1,000 workflows for each
+    :param workflow_path: workflow to use as the test input
+    :type workflow_path: str
+    :param n_workflows: number of copies to write
+    :type n_workflows: int
+    :return: (old seconds, new seconds) per 1,000 workflows
+    :rtype: tuple
+    """
+    disable_tools = ['msfragger', 'peptide-prophet', 'percolator', 'protein-prophet', 'psm-validation', 'ptmprophet']
+    database = '/storage/test/database.fasta'
+
+    def to_linux(line):
+        return line.replace('Z\\:', '/storage').replace('\\\\', '/')
+
+    disable_edit = WorkflowRewriter(disable_tools=disable_tools)
+    database_edit = WorkflowRewriter(database_path=database)
+    linux_edit = WorkflowRewriter(translate=to_linux)
+    combined_edit = WorkflowRewriter(disable_tools=disable_tools, database_path=database, translate=to_linux)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        start = time.time()
+        for index in range(n_workflows):
+            output_path = os.path.join(temp_dir, 'old_{}.workflow'.format(index))
+            shutil.copy(workflow_path, output_path)
+            disable_edit.rewrite(output_path)
+            database_edit.rewrite(output_path)
+            linux_edit.rewrite(output_path)
+        old_time = (time.time() - start) * 1000 / n_workflows
+
+        start = time.time()
+        for index in range(n_workflows):
+            combined_edit.rewrite(workflow_path, os.path.join(temp_dir, 'new_{}.workflow'.format(index)))
+        new_time = (time.time() - start) * 1000 / n_workflows
+
+        # check the two produce identical output
+        with open(os.path.join(temp_dir, 'old_0.workflow'), 'r') as old_file, open(os.path.join(temp_dir, 'new_0.workflow'), 'r') as new_file:
+            if old_file.read() != new_file.read():
+                print('Warning: single-pass output differs from multi-pass output')
+
+    print('copy + 3 passes: {:.2f} s per 1,000 workflows'.format(old_time))
+    print('single pass:     {:.2f} s per 1,000 workflows'.format(new_time))
+    return old_time, new_time
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2:
+        benchmark(sys.argv[1], int(sys.argv[2]))
+    else:
+        benchmark(sys.argv[1])
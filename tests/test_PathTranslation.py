@@ -0,0 +1,37 @@
+"""
+Tests for PathTranslation. Run from the repo folder:
+python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import PathTranslation
+
+
+class TestPathTranslation(unittest.TestCase):
+    def test_single_paths(self):
+        self.assertEqual(PathTranslation.to_linux(r'Z:\data\run 1\a.raw'), '/storage/data/run 1/a.raw')
+        self.assertEqual(PathTranslation.to_linux(r'\\corexfs.med.umich.edu\proteomics\data\a.raw'), '/storage/data/a.raw')
+        self.assertEqual(PathTranslation.to_windows('/storage/data/run 1/a.raw'), r'Z:\data\run 1\a.raw')
+
+    def test_two_paths_on_a_line(self):
+        self.assertEqual(PathTranslation.to_linux(r'Z:\tools\fragpipe Z:\data\a.workflow'), '/storage/tools/fragpipe /storage/data/a.workflow')
+        self.assertEqual(PathTranslation.to_windows('/storage/tools/fragpipe /storage/data/a.workflow'), r'Z:\tools\fragpipe Z:\data\a.workflow')
+
+    def test_command_line(self):
+        command = r'--workflow Z:\data\a.workflow --workdir Z:\data\out 1 --config-tools-folder Z:\tools --ram 10'
+        self.assertEqual(PathTranslation.to_linux(command), '--workflow /storage/data/a.workflow --workdir /storage/data/out 1 --config-tools-folder /storage/tools --ram 10')
+
+    def test_escaped_workflow_value(self):
+        self.assertEqual(PathTranslation.to_linux(r'database.db-path=Z\:\\data\\db.fasta'), 'database.db-path=/storage/data/db.fasta')
+        self.assertEqual(PathTranslation.to_linux(r'C:\Users\a.fasta'), r'C:\Users\a.fasta')
+
+    def test_manifest_fields(self):
+        row = 'Z:\\data\\a -2.raw\texp\t\tDDA\n'
+        self.assertEqual(PathTranslation.translate_text(row, linux=True, fields=True), '/storage/data/a -2.raw\texp\t\tDDA\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+"""
+Tests for PhilosopherConfig on a sample v4 philosopher.yml (tests/data/philosopher_v4.yml). Run from the repo folder:
+python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import PhilosopherConfig
+
+SAMPLE_YML = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'philosopher_v4.yml')
+
+
+def read_sample():
+    """
+    :return: sample yml file contents, line endings as is
+    :rtype: str
+    """
+    with open(SAMPLE_YML, 'r', newline='') as readfile:
+        return readfile.read()
+
+
+def prefix_ptmprophet_options(lines):
+    """
+    PTMProphet options as generated by the original PrepFragger_v2.get_ptmprophet_options_from_yml (prefix matching
+    of lines in the whole file), to check the parsed version against
+    :param lines: yml lines
+    :type lines: list
+    :return: formatted command line option string
+    :rtype: str
+    """
+    outputs = []
+    for line in lines:
+        if line.startswith('  cions'):
+            value = line.split(':')[1].split('#')[0].strip()
+            if value != '':
+                outputs.append('CIONS={}'.format(value))
+        elif line.startswith('  nions'):
+            value = line.split(':')[1].split('#')[0].strip()
+            if value != '':
+                outputs.append('NIONS={}'.format(value))
+        elif line.startswith('  em'):
+            value = line.split(':')[1].split('#')[0].strip()
+            outputs.append('EM={}'.format(value))
+        elif line.startswith('  static'):
+            value = line.split(':')[1].split('#')[0].strip()
+            if value == 'true':
+                outputs.append('STATIC')
+        elif line.startswith('  fragppmtol'):
+            value = line.split(':')[1].split('#')[0].strip()
+            outputs.append('FRAGPPMTOL={}'.format(value))
+        elif line.startswith('  lability'):
+            value = line.split(':')[1].split('#')[0].strip()
+            if value == 'true':
+                outputs.append('LABILITY')
+        elif line.startswith('  ppmtol'):
+            value = line.split(':')[1].split('#')[0].strip()
+            outputs.append('PPMTOL={}'.format(value))
+        elif line.startswith('  minprob'):
+            value = line.split(':')[1].split('#')[0].strip()
+            outputs.append('MINPROB={}'.format(value))
+        elif line.startswith('  maxthreads'):
+            value = line.split(':')[1].split('#')[0].strip()
+            outputs.append('MAXTHREADS={}'.format(value))
+        elif line.startswith('  mods'):
+            value = ':'.join(line.split(':')[1:]).split('#')[0].strip()
+            outputs.append('{}'.format(value))
+        elif line.startswith('  massdiffmode'):
+            value = line.split(':')[1].split('#')[0].strip()
+            if value == 'true':
+                outputs.append('MASSDIFFMODE')
+        elif line.startswith('  excludemassdiffmin'):
+            value = line.split(':')[1].split('#')[0].strip()
+            outputs.append('EXCLUDEMASSDIFFMIN={}'.format(value))
+        elif line.startswith('  excludemassdiffmax'):
+            value = line.split(':')[1].split('#')[0].strip()
+            outputs.append('EXCLUDEMASSDIFFMAX={}'.format(value))
+    return ' '.join(outputs)
+
+
+class TestPhilosopherConfig(unittest.TestCase):
+    def setUp(self):
+        self.text = read_sample()
+        self.lines = self.text.splitlines(keepends=True)
+        self.config = PhilosopherConfig.PhilosopherConfig(self.lines)
+
+    def check_only_changed(self, edited_lines, expected):
+        """
+        Check that edited lines differ from the sample only on the expected lines
+        :param edited_lines: lines from edit_lines
+        :type edited_lines: list
+        :param expected: dict of line index: expected edited line
+        :type expected: dict
+        """
+        self.assertEqual(len(edited_lines), len(self.lines))
+        for index, (original, edited) in enumerate(zip(self.lines, edited_lines)):
+            self.assertEqual(edited, expected.get(index, original))
+
+    def test_sample_has_crlf_and_lf_lines(self):
+        self.assertIn('\r\n', self.text)
+        self.assertTrue(any(not x.endswith('\r\n') and x.endswith('\n') for x in self.lines))
+
+    def test_unedited_is_byte_identical(self):
+        self.assertEqual(''.join(self.config.edit_lines({})), self.text)
+        self.assertEqual(''.join(PhilosopherConfig.read_config(SAMPLE_YML).edit_lines({})), self.text)
+        self.assertTrue(PhilosopherConfig.check_round_trip(SAMPLE_YML))
+
+    def test_edit_empty_value_keeps_comment(self):
+        index = self.lines.index('  protein_database:                      # path to the target-decoy database: set by PrepFragger\n')
+        tmti_index = self.lines.index('  protein_database:                      # database for TMT-Integrator (separate from database: above)\r\n')
+        edited = self.config.edit_lines({'protein_database': '/data/db.fasta'})
+        self.check_only_changed(edited, {index: '  protein_database: /data/db.fasta # path to the target-decoy database: set by PrepFragger\n',
+                                         tmti_index: '  protein_database: /data/db.fasta # database for TMT-Integrator (separate from database: above)\r\n'})
+
+    def test_section_edit_crlf(self):
+        index = self.lines.index('  memory: 8\r\n')
+        edited = self.config.edit_lines({('tmtintegrator', 'memory'): '32'})
+        self.check_only_changed(edited, {index: '  memory: 32\r\n'})
+        self.assertEqual(PhilosopherConfig.PhilosopherConfig(edited).get('memory', 'tmtintegrator'), '32')
+
+    def test_exact_key_match(self):
+        # 'database' is also the start of 'protein_database' and a section name: only the peptideprophet key changes
+        index = self.lines.index('  database:\n')
+        edited = self.config.edit_lines({'database': 'x'})
+        self.check_only_changed(edited, {index: '  database: x\n'})
+
+    def test_disable_steps(self):
+        index = self.lines.index('  Peptide Validation: yes                # PeptideProphet\n')
+        edited = self.config.disable_steps_lines(['peptide'])
+        self.check_only_changed(edited, {index: '  Peptide Validation: no                # PeptideProphet\n'})
+
+    def test_ptmprophet_options_match_prefix_parser(self):
+        # the sample's other sections do not repeat PTMProphet keys, which the prefix parser would also have read
+        self.assertEqual(self.config.ptmprophet_options(), prefix_ptmprophet_options(self.lines))
+        self.assertEqual(self.config.ptmprophet_options(), 'NIONS=b EM=1 FRAGPPMTOL=10 LABILITY PPMTOL=1 STY:79.966331,M:15.9949 '
+                                                          'MINPROB=0.5 MAXTHREADS=1 EXCLUDEMASSDIFFMIN=-0.5 EXCLUDEMASSDIFFMAX=0.5')
+
+
+if __name__ == '__main__':
+    unittest.main()